@@ -0,0 +1,314 @@
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+from capture import CaptureBackend
+from color_scan import find_color_target
+from motion import MOTION_MODELS, PathPool, wind_mouse_path
+from program import compile_macro
+
+# Micro-benchmarks for the playback hot paths. Run e.g. `python bench.py components`.
+
+def timeit(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def make_blob_frame(num_blobs, width=1920, height=1080, colors=((75, 0, 87),), blob_size=6, seed=0):
+    # Full-HD frame with num_blobs small separated squares cycling through colors
+    rng = np.random.default_rng(seed)
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    cols = width // (blob_size * 2)
+    cells = rng.choice((height // (blob_size * 2)) * cols, size=num_blobs, replace=False)
+    for n, cell in enumerate(cells):
+        y = (cell // cols) * blob_size * 2
+        x = (cell % cols) * blob_size * 2
+        frame[y:y+blob_size, x:x+blob_size] = colors[n % len(colors)]
+    return frame
+
+def bench_components(args):
+    print(f"{'blobs':>8} {'closest ms':>12} {'furthest ms':>12} {'random ms':>12} {'stationary ms':>14}")
+    for num_blobs in args.blobs:
+        frame = make_blob_frame(num_blobs)
+        row = []
+        for mode in ('closest', 'furthest', 'random'):
+            seconds = timeit(lambda: find_color_target(frame, ['#4b0057'], None, mode, (960, 540)), args.repeat)
+            row.append(seconds * 1000.0)
+        seconds = timeit(lambda: find_color_target(frame, ['#4b0057'], frame, 'closest', (960, 540)), args.repeat)
+        row.append(seconds * 1000.0)
+        print(f"{num_blobs:>8} {row[0]:>12.2f} {row[1]:>12.2f} {row[2]:>12.2f} {row[3]:>14.2f}")
+
+def bench_pyramid(args):
+    print(f"{'blobs':>8} {'min size':>9} {'full ms':>10} {'pyramid ms':>11} {'speedup':>8}")
+    for num_blobs in args.blobs:
+        frame = make_blob_frame(num_blobs)
+        full = timeit(lambda: find_color_target(frame, ['#4b0057'], None, 'closest', (960, 540)), args.repeat)
+        for min_size in args.min_size:
+            pyramid = timeit(lambda: find_color_target(frame, ['#4b0057'], None, 'closest', (960, 540), pyramid_min_size=min_size), args.repeat)
+            print(f"{num_blobs:>8} {min_size:>9} {full * 1000.0:>10.2f} {pyramid * 1000.0:>11.2f} {full / pyramid:>7.1f}x")
+
+def legacy_wind_mouse(start_x, start_y, dest_x, dest_y, G_0=9, W_0=3, M_0=15, D_0=12, move_mouse=lambda x, y: None):
+    # The scalar per-step WindMouse that wind_mouse_path replaced, kept as the baseline
+    sqrt3 = np.sqrt(3)
+    sqrt5 = np.sqrt(5)
+    current_x, current_y = start_x, start_y
+    v_x = v_y = W_x = W_y = 0
+    while (dist := np.hypot(dest_x - start_x, dest_y - start_y)) >= 1:
+        W_mag = min(W_0, dist)
+        if dist >= D_0:
+            W_x = W_x / sqrt3 + (2 * np.random.random() - 1) * W_mag / sqrt5
+            W_y = W_y / sqrt3 + (2 * np.random.random() - 1) * W_mag / sqrt5
+        else:
+            W_x /= sqrt3
+            W_y /= sqrt3
+            if M_0 < 3:
+                M_0 = np.random.random() * 3 + 3
+            else:
+                M_0 /= sqrt5
+        v_x += W_x + G_0 * (dest_x - start_x) / dist
+        v_y += W_y + G_0 * (dest_y - start_y) / dist
+        v_mag = np.hypot(v_x, v_y)
+        if v_mag > M_0:
+            v_clip = M_0 / 2 + np.random.random() * M_0 / 2
+            v_x = (v_x / v_mag) * v_clip
+            v_y = (v_y / v_mag) * v_clip
+        start_x += v_x
+        start_y += v_y
+        move_x = int(np.round(start_x))
+        move_y = int(np.round(start_y))
+        if current_x != move_x or current_y != move_y:
+            move_mouse(current_x := move_x, current_y := move_y)
+    return current_x, current_y
+
+def bench_paths(args):
+    print(f"{'distance':>9} {'legacy paths/s':>15} {'numpy paths/s':>14} {'speedup':>8} {'steps':>6}")
+    rng = np.random.default_rng(0)
+    for distance in args.distances:
+        def legacy():
+            for _ in range(args.paths):
+                path = []
+                legacy_wind_mouse(100, 100, 100 + distance, 100, move_mouse=lambda x, y: path.append((x, y)))
+        def vectorized():
+            for _ in range(args.paths):
+                wind_mouse_path(100, 100, 100 + distance, 100, rng=rng)
+        steps = np.mean([len(wind_mouse_path(100, 100, 100 + distance, 100, rng=rng)[0]) for _ in range(50)])
+        old = args.paths / timeit(legacy, args.repeat)
+        new = args.paths / timeit(vectorized, args.repeat)
+        print(f"{distance:>9} {old:>15.0f} {new:>14.0f} {new / old:>7.1f}x {steps:>6.0f}")
+
+def bench_pool(args):
+    # Time until the first point of a move is known: generate on the spot vs. take from a filled pool
+    pool = PathPool(size=args.size, refresh='keep', seed=0)
+    pool.fill()
+    rng = np.random.default_rng(0)
+    print(f"{'distance':>9} {'direct ms':>10} {'pool ms':>8} {'speedup':>8}")
+    for distance in args.distances:
+        direct = timeit(lambda: [wind_mouse_path(100, 100, 100 + distance, 100, rng=rng) for _ in range(args.paths)], args.repeat) / args.paths
+        pooled = timeit(lambda: [pool.path(100, 100, 100 + distance, 100) for _ in range(args.paths)], args.repeat) / args.paths
+        print(f"{distance:>9} {direct * 1000.0:>10.3f} {pooled * 1000.0:>8.3f} {direct / pooled:>7.1f}x")
+    stats = pool.stats()
+    print(f"pool: {stats['paths']} paths, {stats['bytes'] / 1024:.0f} KiB")
+
+def path_stats(xs, ys, start, dest):
+    # Points, path length over straight distance, max distance from the straight line, peak over mean step
+    px = np.concatenate(([start[0]], xs)).astype(np.float64)
+    py = np.concatenate(([start[1]], ys)).astype(np.float64)
+    steps = np.hypot(np.diff(px), np.diff(py))
+    dx, dy = dest[0] - start[0], dest[1] - start[1]
+    dist = np.hypot(dx, dy)
+    deviation = np.abs((px - start[0]) * dy - (py - start[1]) * dx) / dist
+    return len(xs), steps.sum() / dist, deviation.max(), steps.max() / steps.mean()
+
+def bench_models(args):
+    # Generation cost and path shape of each motion model
+    rng = np.random.default_rng(0)
+    print(f"{'model':>10} {'distance':>9} {'us/path':>8} {'points':>7} {'length':>7} {'max dev px':>11} {'peak/mean':>10}")
+    for name, model in MOTION_MODELS.items():
+        for distance in args.distances:
+            start, dest = (100, 100), (100 + distance, 100 + distance // 3)
+            cost = timeit(lambda: [model(*start, *dest, rng=rng) for _ in range(args.paths)], args.repeat) / args.paths
+            stats = np.array([path_stats(*model(*start, *dest, rng=rng), start, dest) for _ in range(args.paths)])
+            points, length, deviation, peak = stats.mean(axis=0)
+            print(f"{name:>10} {distance:>9} {cost * 1e6:>8.1f} {points:>7.0f} {length:>7.3f} {deviation:>11.1f} {peak:>10.2f}")
+
+# One of each action type, with the fields the editor writes
+DISPATCH_MACRO = [
+    {'type': 'loop_start', 'name': 'main', 'min_loops': 1, 'max_loops': 1, 'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+    {'type': 'key_action', 'key': 'a', 'min_delay': 0.1, 'max_delay': 0.2, 'comment': ''},
+    {'type': 'mouse_move', 'min_x': 100, 'max_x': 200, 'min_y': 100, 'max_y': 200, 'min_delay': 0.1, 'max_delay': 0.2, 'comment': ''},
+    {'type': 'color_check', 'x': 5, 'y': 5, 'expected_colors': ['#4b0057', '#ffffff'], 'tolerance': 10, 'on_fail': 'continue',
+     'on_success_press': 'b', 'hold_min_ms': 1, 'hold_max_ms': 10, 'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+    {'type': 'if_color_start', 'x': 5, 'y': 5, 'expected_color': '#4b0057', 'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+    {'type': 'mouse_to_color', 'min_x': 0, 'max_x': 1920, 'min_y': 0, 'max_y': 1080, 'expected_colors': ['#4b0057'], 'on_fail': 'continue',
+     'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+    {'type': 'else', 'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+    {'type': 'wait', 'on_end': 'continue', 'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+    {'type': 'if_end', 'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+    {'type': 'trajectory', 'trajectory': [[0.0, 10, 10], [0.01, 11, 12]], 'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+    {'type': 'loop_end', 'name': 'main', 'min_delay': 0.0, 'max_delay': 0.0, 'comment': ''},
+]
+
+def legacy_dispatch(action, pixel):
+    # The per-action work of the dict-based playback loop: defaults read with get, colors
+    # parsed from hex, closures rebuilt, and the if/elif chain over the type
+    delay = random.uniform(action.get('min_delay', 0.0), action.get('max_delay', 0.0))
+    if action['type'] == 'key_action':
+        return action['key']
+    elif action['type'] == 'mouse_move':
+        return (action['min_x'], action['max_x'], action['min_y'], action['max_y'], action.get('motion_model', 'windmouse'))
+    elif action['type'] == 'color_check':
+        expected_colors = action.get('expected_colors', [action.get('expected_color', '#000000')])
+        expected_rgb_list = [tuple(int(hex_color[j:j+2], 16) for j in (1, 3, 5)) for hex_color in expected_colors]
+        tolerance = action.get('tolerance', 0)
+        def colors_close(c1, c2, tol):
+            return sum((a - b) ** 2 for a, b in zip(c1, c2)) ** 0.5 <= tol
+        if any(colors_close(pixel, expected, tolerance) for expected in expected_rgb_list):
+            return action.get('on_success_press', None), action.get('hold_min_ms', 1) / 1000.0, action.get('hold_max_ms', 10) / 1000.0
+        return action.get('on_fail', 'abort')
+    elif action['type'] == 'mouse_to_color':
+        bbox = (action.get('min_x', 0), action.get('min_y', 0), action.get('max_x', 1920), action.get('max_y', 1080))
+        return (bbox, action.get('expected_colors', ['#ffffff']), action.get('selection_mode', 'random'), action.get('best_across_colors', False),
+                action.get('tolerance', 0), action.get('pyramid_min_size', 0), action.get('roi_tracking', False), action.get('on_fail', 'continue'))
+    elif action['type'] == 'trajectory':
+        points = np.array(action.get('trajectory', []), dtype=np.float64).reshape(-1, 3)
+        return points[:, 0], points[:, 1].astype(np.int32), points[:, 2].astype(np.int32)
+    elif action['type'] == 'loop_start':
+        return random.randint(action.get('min_loops', 1), action.get('max_loops', 1))
+    elif action['type'] == 'loop_end':
+        return action.get('name', '')
+    elif action['type'] == 'wait':
+        return delay, action.get('on_end', 'continue')
+    elif action['type'] == 'if_color_start':
+        expected_hex = action.get('expected_color')
+        return pixel == tuple(int(expected_hex[j:j+2], 16) for j in (1, 3, 5))
+    elif action['type'] == 'else':
+        return None
+    elif action['type'] == 'if_end':
+        return None
+
+# The same work on decoded actions through a table of bench-only handlers. The engine's real
+# handlers are coroutines that also plan, sleep and capture, so the dict vs. decoded speedup
+# is an upper bound for the interpreter; bench_dispatch times the real engine separately.
+DECODED_HANDLERS = {
+    'key_action': lambda a, pixel: a.key,
+    'mouse_move': lambda a, pixel: (a.min_x, a.max_x, a.min_y, a.max_y, a.motion_model),
+    'color_check': lambda a, pixel: (a.on_success_press, a.hold_min, a.hold_max) if a.matches_rgb(pixel) else a.on_fail,
+    'mouse_to_color': lambda a, pixel: (a.bbox, a.expected_colors, a.selection_mode, a.best_across_colors, a.tolerance, a.pyramid_min_size, a.roi_tracking, a.on_fail),
+    'trajectory': lambda a, pixel: (a.times, a.xs, a.ys),
+    'loop_start': lambda a, pixel: random.randint(a.min_loops, a.max_loops),
+    'loop_end': lambda a, pixel: a.name,
+    'wait': lambda a, pixel: a.on_end,
+    'if_color_start': lambda a, pixel: pixel == a.expected,
+    'else': lambda a, pixel: None,
+    'if_end': lambda a, pixel: None,
+}
+
+def decoded_dispatch(instruction, pixel):
+    action = instruction.action
+    random.uniform(action.min_delay, action.max_delay)
+    return DECODED_HANDLERS[instruction.op](action, pixel)
+
+# Capture and input stubs, so the real engine can be timed on steps that do no I/O of their own
+class StubCapture(CaptureBackend):
+    name = 'stub'
+
+    def _grab(self, bbox):
+        return np.zeros((bbox[3] - bbox[1], bbox[2] - bbox[0], 3), dtype=np.uint8)
+
+    def _get_pixel(self, x, y):
+        return (75, 0, 87)
+
+class StubInput:
+    position = (0, 0)
+
+    def press(self, item):
+        pass
+
+    def release(self, item):
+        pass
+
+# Zero-delay control flow: every step goes through the engine's planning, dispatch and sleep calls
+ENGINE_MACRO = [
+    {'type': 'loop_start', 'name': 'main', 'min_loops': 1, 'max_loops': 1},
+    {'type': 'if_color_start', 'x': 5, 'y': 5, 'expected_color': '#4b0057'},
+    {'type': 'wait', 'on_end': 'continue'},
+    {'type': 'else'},
+    {'type': 'wait', 'on_end': 'continue'},
+    {'type': 'if_end'},
+    {'type': 'loop_end', 'name': 'main'},
+]
+
+def engine_step_time(loops, repeat):
+    # Best seconds per step of the real PlaybackEngine over ENGINE_MACRO repeated loops times
+    from engine import PlaybackConfig, PlaybackEngine  # needs pynput, which the other benchmarks do not
+    os.environ['MACRO_RUN_LOG'] = ''  # keep benchmark runs out of the playback run log
+    macro = [dict(action, min_delay=0.0, max_delay=0.0) for action in ENGINE_MACRO]
+    macro[0].update(min_loops=loops, max_loops=loops)
+    engine = PlaybackEngine(StubInput(), StubInput(), StubCapture())
+    try:
+        best = float('inf')
+        for _ in range(repeat):
+            result = engine.play(macro, PlaybackConfig(seed=0))
+            best = min(best, result.seconds / result.steps)
+        return best
+    finally:
+        engine.close()
+
+def bench_dispatch(args):
+    # Interpreter overhead per action, without the input, capture and sleeps the actions do;
+    # the dict/decoded columns run bench-only handlers, the engine line the real playback loop
+    pixel = (75, 0, 87)
+    macro = DISPATCH_MACRO * args.copies
+    program = compile_macro(macro)
+    legacy = timeit(lambda: [legacy_dispatch(action, pixel) for action in macro], args.repeat) / len(macro)
+    decoded = timeit(lambda: [decoded_dispatch(instruction, pixel) for instruction in program], args.repeat) / len(program)
+    compiled = timeit(lambda: compile_macro(macro), args.repeat) / len(macro)
+    print(f"{'dict + if/elif us':>18} {'decoded + table us':>19} {'max speedup':>12} {'decode us':>10}")
+    print(f"{legacy * 1e6:>18.2f} {decoded * 1e6:>19.2f} {legacy / decoded:>11.1f}x {compiled * 1e6:>10.2f}")
+    print(f"{'type':>15} {'dict us':>8} {'decoded us':>11}")
+    for action, instruction in zip(DISPATCH_MACRO, program):
+        legacy = timeit(lambda: [legacy_dispatch(action, pixel) for _ in range(args.copies)], args.repeat) / args.copies
+        decoded = timeit(lambda: [decoded_dispatch(instruction, pixel) for _ in range(args.copies)], args.repeat) / args.copies
+        print(f"{action['type']:>15} {legacy * 1e6:>8.2f} {decoded * 1e6:>11.2f}")
+    engine = engine_step_time(args.copies, args.repeat)
+    print(f"real engine, stub backends: {engine * 1e6:.2f} us per zero-delay control-flow step")
+
+def main():
+    parser = argparse.ArgumentParser(description="Macro playback micro-benchmarks")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement (best is reported)")
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('components', help="mouse_to_color scan time vs. number of blobs")
+    p.add_argument('--blobs', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    p.set_defaults(func=bench_components)
+    p = sub.add_parser('pyramid', help="full-resolution vs. coarse-to-fine mouse_to_color scan")
+    p.add_argument('--blobs', type=int, nargs='+', default=[0, 1, 20, 200, 2000])
+    p.add_argument('--min-size', type=int, nargs='+', default=[4, 6])
+    p.set_defaults(func=bench_pyramid)
+    p = sub.add_parser('paths', help="WindMouse paths generated per second by move distance")
+    p.add_argument('--distances', type=int, nargs='+', default=[100, 800, 2000])
+    p.add_argument('--paths', type=int, default=200, help="Paths per timed run")
+    p.set_defaults(func=bench_paths)
+    p = sub.add_parser('pool', help="move start latency with and without the path pool")
+    p.add_argument('--distances', type=int, nargs='+', default=[100, 800, 2000])
+    p.add_argument('--paths', type=int, default=200, help="Paths per timed run")
+    p.add_argument('--size', type=int, default=32, help="Pool paths per distance bucket")
+    p.set_defaults(func=bench_pool)
+    p = sub.add_parser('models', help="generation cost and path statistics per motion model")
+    p.add_argument('--distances', type=int, nargs='+', default=[100, 800, 2000])
+    p.add_argument('--paths', type=int, default=200, help="Paths per timed run")
+    p.set_defaults(func=bench_models)
+    p = sub.add_parser('dispatch', help="per-action interpreter overhead: dict actions vs. decoded actions and handler table")
+    p.add_argument('--copies', type=int, default=500, help="Copies of the sample macro per timed run")
+    p.set_defaults(func=bench_dispatch)
+    args = parser.parse_args()
+    random.seed(0)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import platform
+import threading
+import contextlib
+
+import numpy as np
+from PIL import ImageGrab
+
+# Screen capture backends. Every backend returns regions as (height, width, 3) uint8 RGB
+# arrays and single pixels as (r, g, b) tuples, and keeps per-grab latency statistics so
+# backends can be compared on the same machine.
+
+class CaptureBackend:
+    name = 'base'
+
+    def __init__(self):
+        self.grab_count = 0
+        self.total_grab_time = 0.0
+        self.last_grab_time = 0.0
+        self.max_grab_time = 0.0
+
+    def _record(self, started):
+        elapsed = time.perf_counter() - started
+        self.grab_count += 1
+        self.total_grab_time += elapsed
+        self.last_grab_time = elapsed
+        if elapsed > self.max_grab_time:
+            self.max_grab_time = elapsed
+
+    def grab(self, bbox):
+        started = time.perf_counter()
+        arr = self._grab(bbox)
+        self._record(started)
+        return arr
+
+    def get_pixel(self, x, y):
+        started = time.perf_counter()
+        color = self._get_pixel(x, y)
+        self._record(started)
+        return color
+
+    def _grab(self, bbox):
+        raise NotImplementedError
+
+    def _get_pixel(self, x, y):
+        arr = self._grab((x, y, x + 1, y + 1))
+        return tuple(int(c) for c in arr[0, 0])
+
+    def stats(self):
+        mean = self.total_grab_time / self.grab_count if self.grab_count else 0.0
+        return {
+            'backend': self.name,
+            'grabs': self.grab_count,
+            'mean_ms': mean * 1000.0,
+            'last_ms': self.last_grab_time * 1000.0,
+            'max_ms': self.max_grab_time * 1000.0,
+        }
+
+    def reset_stats(self):
+        self.grab_count = 0
+        self.total_grab_time = 0.0
+        self.last_grab_time = 0.0
+        self.max_grab_time = 0.0
+
+    def close(self):
+        pass
+
+
+class PILCaptureBackend(CaptureBackend):
+    name = 'pil'
+    xdisplay = None  # X display to grab instead of $DISPLAY, on X11
+
+    def _grab(self, bbox):
+        im = ImageGrab.grab(bbox=bbox, xdisplay=self.xdisplay)
+        if im.mode != 'RGB':
+            im = im.convert('RGB')
+        return np.asarray(im)
+
+    def _get_pixel(self, x, y):
+        return ImageGrab.grab(bbox=(x, y, x + 1, y + 1), xdisplay=self.xdisplay).convert('RGB').getpixel((0, 0))
+
+
+class GDICaptureBackend(PILCaptureBackend):
+    # Keeps the screen DC open for single pixel reads; regions still go through PIL's BitBlt.
+    name = 'gdi'
+
+    def __init__(self):
+        super().__init__()
+        self.user32 = ctypes.windll.user32
+        self.gdi32 = ctypes.windll.gdi32
+        self.hdc = self.user32.GetDC(0)
+
+    def _get_pixel(self, x, y):
+        color = self.gdi32.GetPixel(self.hdc, x, y)
+        return (color & 0xff, (color >> 8) & 0xff, (color >> 16) & 0xff)
+
+    def close(self):
+        if self.hdc:
+            self.user32.ReleaseDC(0, self.hdc)
+            self.hdc = None
+
+
+# Xlib / XShm structures (only the leading XImage fields are read)
+class XImage(ctypes.Structure):
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+        ('red_mask', ctypes.c_ulong),
+        ('green_mask', ctypes.c_ulong),
+        ('blue_mask', ctypes.c_ulong),
+        ('obdata', ctypes.c_void_p),
+    ]
+
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+class XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('resourceid', ctypes.c_ulong),
+        ('serial', ctypes.c_ulong),
+        ('error_code', ctypes.c_ubyte),
+        ('request_code', ctypes.c_ubyte),
+        ('minor_code', ctypes.c_ubyte),
+    ]
+
+
+XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(XErrorEvent))
+
+ZPixmap = 2
+AllPlanes = ctypes.c_ulong(-1).value
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+SHMAT_FAILED = ctypes.c_void_p(-1).value  # shmat's (void *) -1
+
+# Xlib's default error handler exits the process, so requests that can fail for reasons
+# outside our control (a server that cannot share memory with us) run under trap_x_errors.
+# The handler is process-wide: trapped requests are serialized and the previous handler
+# is put back after each. An error another thread's connection reports while a trap is
+# installed is recorded too, so each trap starts by dropping what its display has pending.
+x_errors = {}  # display pointer -> error code of the first error trapped on it
+x_error_lock = threading.Lock()
+x_threads_initialized = False
+
+def init_x_threads(xlib):
+    '''
+    Call XInitThreads once per process, before the first display is opened: the
+    backends' connections are used from the playback and GUI threads, which Xlib only
+    allows once it has been told. (libX11 1.8 and later does this by itself.)
+    '''
+    global x_threads_initialized
+    with x_error_lock:
+        if not x_threads_initialized:
+            xlib.XInitThreads()
+            x_threads_initialized = True
+
+@XErrorHandler
+def record_x_error(display, event):
+    x_errors.setdefault(display, event.contents.error_code)
+    return 0
+
+@contextlib.contextmanager
+def trap_x_errors(xlib, display, sync=False):
+    # Raises OSError after the block if a request made in it failed; sync=True waits for the errors of requests without a reply
+    with x_error_lock:
+        x_errors.pop(display, None)
+        previous = xlib.XSetErrorHandler(record_x_error)
+        try:
+            yield
+            if sync:
+                xlib.XSync(display, 0)
+        finally:
+            xlib.XSetErrorHandler(previous)
+            code = x_errors.pop(display, None)
+    if code is not None:
+        raise OSError(f"X error {code}")
+
+
+class X11CaptureBackend(CaptureBackend):
+    '''
+    Persistent X display connection. With use_shm the pixels are fetched with
+    XShmGetImage into shared memory segments that are kept per region size and
+    reused, so a grab is a single request with no image allocation on either side.
+    When shared memory fails (a remote X session, a container without the host's IPC
+    namespace) grabs fall back to XGetImage, and when that fails too, to PIL.
+    '''
+    name = 'x11'
+    max_segments = 8
+
+    def __init__(self, display_name=None, use_shm=True):
+        super().__init__()
+        self.xdisplay = display_name  # for the PIL fallback
+        self.use_pil = False
+        xlib_path = ctypes.util.find_library('X11')
+        if not xlib_path:
+            raise OSError("libX11 not found")
+        self.xlib = ctypes.cdll.LoadLibrary(xlib_path)
+        self._declare_xlib()
+        init_x_threads(self.xlib)
+        name = display_name.encode() if display_name else None
+        self.display = self.xlib.XOpenDisplay(name)
+        if not self.display:
+            raise OSError(f"Cannot open X display {display_name or os.environ.get('DISPLAY', '')}")
+        screen = self.xlib.XDefaultScreen(self.display)
+        self.root = self.xlib.XDefaultRootWindow(self.display)
+        self.visual = self.xlib.XDefaultVisual(self.display, screen)
+        self.depth = self.xlib.XDefaultDepth(self.display, screen)
+        self.screen_width = self.xlib.XDisplayWidth(self.display, screen)
+        self.screen_height = self.xlib.XDisplayHeight(self.display, screen)
+        self.segments = {}  # (w, h) -> (XImage*, XShmSegmentInfo), most recently used last
+        self.xext = None
+        self.libc = None
+        if use_shm:
+            try:
+                self._init_shm()
+                self._segment(1, 1)  # attach one segment now: a server that cannot share memory refuses it here
+            except OSError:
+                self._disable_shm()
+        if self.xext is not None:
+            self.name = 'xshm'
+
+    def _declare_xlib(self):
+        x = self.xlib
+        x.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x.XOpenDisplay.restype = ctypes.c_void_p
+        x.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x.XDefaultRootWindow.restype = ctypes.c_ulong
+        x.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XDefaultVisual.restype = ctypes.c_void_p
+        x.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int,
+                                ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong, ctypes.c_int]
+        x.XGetImage.restype = ctypes.POINTER(XImage)
+        x.XDestroyImage.argtypes = [ctypes.POINTER(XImage)]
+        x.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XSetErrorHandler.argtypes = [XErrorHandler]
+        x.XSetErrorHandler.restype = XErrorHandler
+
+    def _init_shm(self):
+        xext_path = ctypes.util.find_library('Xext')
+        libc_path = ctypes.util.find_library('c')
+        if not xext_path or not libc_path:
+            raise OSError("libXext or libc not found")
+        xext = ctypes.cdll.LoadLibrary(xext_path)
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo),
+                                         ctypes.c_uint, ctypes.c_uint]
+        xext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmGetImage.restype = ctypes.c_int
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        if not xext.XShmQueryExtension(self.display):
+            raise OSError("MIT-SHM extension not available")
+        libc = ctypes.CDLL(libc_path, use_errno=True)
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+        self.xext = xext
+        self.libc = libc
+
+    def _segment(self, width, height):
+        key = (width, height)
+        seg = self.segments.pop(key, None)
+        if seg is None:
+            if len(self.segments) >= self.max_segments:
+                oldest = next(iter(self.segments))
+                self._release_segment(self.segments.pop(oldest))
+            info = XShmSegmentInfo()
+            ximage = self.xext.XShmCreateImage(self.display, self.visual, self.depth, ZPixmap,
+                                               None, ctypes.byref(info), width, height)
+            if not ximage:
+                raise OSError("XShmCreateImage failed")
+            size = ximage.contents.bytes_per_line * height
+            info.shmid = self.libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+            if info.shmid < 0:
+                errno = ctypes.get_errno()
+                self._destroy_image(ximage)
+                raise OSError(errno, "shmget failed")
+            shmaddr = self.libc.shmat(info.shmid, None, 0)
+            if shmaddr is None or shmaddr == SHMAT_FAILED:
+                errno = ctypes.get_errno()
+                self.libc.shmctl(info.shmid, IPC_RMID, None)
+                self._destroy_image(ximage)
+                raise OSError(errno, "shmat failed")
+            info.shmaddr = shmaddr
+            ximage.contents.data = shmaddr
+            info.readOnly = 0
+            try:
+                with trap_x_errors(self.xlib, self.display, sync=True):
+                    if not self.xext.XShmAttach(self.display, ctypes.byref(info)):
+                        raise OSError("XShmAttach failed")
+            except OSError:
+                # The server never attached, so only our side needs undoing
+                self.libc.shmdt(shmaddr)
+                self._destroy_image(ximage)
+                raise
+            finally:
+                # Mark for removal now; the segment lives until both sides detach
+                self.libc.shmctl(info.shmid, IPC_RMID, None)
+            seg = (ximage, info)
+        self.segments[key] = seg
+        return seg
+
+    def _destroy_image(self, ximage):
+        # XDestroyImage would free() the shm data and our segment info, so detach them first
+        ximage.contents.data = None
+        ximage.contents.obdata = None
+        self.xlib.XDestroyImage(ximage)
+
+    def _release_segment(self, seg):
+        ximage, info = seg
+        try:
+            with trap_x_errors(self.xlib, self.display, sync=True):
+                self.xext.XShmDetach(self.display, ctypes.byref(info))
+        except OSError:
+            pass  # the server side is gone already; ours is released below either way
+        self._destroy_image(ximage)
+        self.libc.shmdt(info.shmaddr)
+
+    def _disable_shm(self):
+        # Stop using shared memory on this connection: grabs go through XGetImage from now on
+        if self.xext is not None:
+            for seg in self.segments.values():
+                self._release_segment(seg)
+        self.segments.clear()
+        self.xext = None
+        self.name = 'x11'
+
+    def _to_rgb(self, ximage, width, height):
+        img = ximage.contents
+        if img.bits_per_pixel != 32:
+            raise OSError(f"Unsupported X image format ({img.bits_per_pixel} bpp)")
+        buf = (ctypes.c_uint8 * (img.bytes_per_line * height)).from_address(img.data)
+        bgra = np.frombuffer(buf, dtype=np.uint8).reshape(height, img.bytes_per_line // 4, 4)
+        return bgra[:, :width, 2::-1].copy()
+
+    def _in_screen(self, bbox):
+        x1, y1, x2, y2 = bbox
+        return 0 <= x1 < x2 <= self.screen_width and 0 <= y1 < y2 <= self.screen_height
+
+    def _grab(self, bbox):
+        if self.use_pil or not self._in_screen(bbox):
+            # Out-of-screen requests raise X errors that abort the process; let PIL handle them
+            return PILCaptureBackend._grab(self, bbox)
+        x1, y1, x2, y2 = bbox
+        width, height = x2 - x1, y2 - y1
+        if self.xext is not None:
+            try:
+                ximage, info = self._segment(width, height)
+                with trap_x_errors(self.xlib, self.display):
+                    if not self.xext.XShmGetImage(self.display, self.root, ximage, x1, y1, AllPlanes):
+                        raise OSError("XShmGetImage failed")
+                return self._to_rgb(ximage, width, height)
+            except OSError:
+                self._disable_shm()
+        try:
+            with trap_x_errors(self.xlib, self.display):
+                ximage = self.xlib.XGetImage(self.display, self.root, x1, y1, width, height, AllPlanes, ZPixmap)
+            if not ximage:
+                raise OSError("XGetImage failed")
+            try:
+                return self._to_rgb(ximage, width, height)
+            finally:
+                self.xlib.XDestroyImage(ximage)
+        except OSError:
+            self.use_pil = True
+            self.name = 'pil'
+            return PILCaptureBackend._grab(self, bbox)
+
+    def close(self):
+        if self.display:
+            for seg in self.segments.values():
+                self._release_segment(seg)
+            self.segments.clear()
+            self.xlib.XCloseDisplay(self.display)
+            self.display = None
+
+
+class FrameCache:
+    '''
+    Serves pixel and region reads from recent captures so actions that run a few
+    milliseconds apart over overlapping areas share one grab. A request is served from
+    the newest cached frame that covers it and is at most max_age_ms old; max_age_ms=0
+    disables caching. A pixel miss grabs the pixel_block x pixel_block tile around it
+    (pixel_block=0 grabs the whole screen when its size is known), so nearby probes are
+    answered from that one capture. Pass fresh=True to force a new grab.
+    '''
+    def __init__(self, backend, max_age_ms=0, pixel_block=256, max_frames=4):
+        self.backend = backend
+        self.max_age_ms = max_age_ms
+        self.pixel_block = pixel_block
+        self.max_frames = max_frames
+        self.frames = []  # (captured_at, bbox, arr), newest last
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, bbox):
+        now = time.perf_counter()
+        x1, y1, x2, y2 = bbox
+        for captured_at, (fx1, fy1, fx2, fy2), arr in reversed(self.frames):
+            if (now - captured_at) * 1000.0 > self.max_age_ms:
+                break  # older frames are staler still
+            if fx1 <= x1 and fy1 <= y1 and x2 <= fx2 and y2 <= fy2:
+                return arr[y1 - fy1:y2 - fy1, x1 - fx1:x2 - fx1]
+        return None
+
+    def _store(self, bbox, arr):
+        arr.flags.writeable = False
+        self.frames.append((time.perf_counter(), bbox, arr))
+        if len(self.frames) > self.max_frames:
+            del self.frames[0]
+
+    def _grab_fresh(self, bbox):
+        arr = self.backend.grab(bbox)
+        if self.max_age_ms > 0:
+            self._store(bbox, arr)
+        return arr
+
+    def grab(self, bbox, fresh=False):
+        bbox = tuple(int(v) for v in bbox)
+        if self.max_age_ms > 0 and not fresh:
+            arr = self._lookup(bbox)
+            if arr is not None:
+                self.hits += 1
+                return arr
+        self.misses += 1
+        return self._grab_fresh(bbox)
+
+    def _pixel_bbox(self, x, y):
+        width = getattr(self.backend, 'screen_width', None)
+        height = getattr(self.backend, 'screen_height', None)
+        if self.pixel_block <= 0 and width and height:
+            return (0, 0, width, height)
+        block = max(self.pixel_block, 1)
+        x1 = max(0, x - block // 2)
+        y1 = max(0, y - block // 2)
+        x2 = x1 + block
+        y2 = y1 + block
+        if width and height:
+            x2 = min(x2, width)
+            y2 = min(y2, height)
+        return (x1, y1, x2, y2)
+
+    def get_pixel(self, x, y, fresh=False):
+        x, y = int(x), int(y)
+        if self.max_age_ms <= 0 or fresh:
+            self.misses += 1
+            return self.backend.get_pixel(x, y)
+        arr = self._lookup((x, y, x + 1, y + 1))
+        if arr is not None:
+            self.hits += 1
+            return tuple(int(c) for c in arr[0, 0])
+        self.misses += 1
+        x1, y1, x2, y2 = self._pixel_bbox(x, y)
+        if not (x1 <= x < x2 and y1 <= y < y2):
+            return self.backend.get_pixel(x, y)
+        arr = self._grab_fresh((x1, y1, x2, y2))
+        return tuple(int(c) for c in arr[y - y1, x - x1])
+
+    def invalidate(self):
+        self.frames = []
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats['cache_hits'] = self.hits
+        stats['cache_misses'] = self.misses
+        stats['max_age_ms'] = self.max_age_ms
+        return stats
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.backend.reset_stats()
+
+    def close(self):
+        self.invalidate()
+        self.backend.close()
+
+
+CAPTURE_BACKENDS = {
+    'pil': PILCaptureBackend,
+    'gdi': GDICaptureBackend,
+    'x11': lambda display_name=None: X11CaptureBackend(display_name, use_shm=False),
+    'xshm': X11CaptureBackend,
+}
+
+# Backends that can capture an X display other than $DISPLAY
+DISPLAY_BACKENDS = ('x11', 'xshm')
+
+
+def create_capture_backend(name=None, display=None):
+    '''
+    Build a capture backend by name ('pil', 'gdi', 'x11', 'xshm' or 'auto').
+    The MACRO_CAPTURE_BACKEND environment variable overrides the default of 'auto'.
+    'auto' picks GDI on Windows, XShm on X11 and falls back to PIL if that fails.
+    display (e.g. ':1') captures that X display instead of $DISPLAY, which only the X11
+    backends can do; 'auto' then means 'xshm'.
+    '''
+    name = name or os.environ.get('MACRO_CAPTURE_BACKEND', 'auto')
+    if display:
+        if name == 'auto':
+            name = 'xshm'  # uses plain XGetImage by itself when MIT-SHM is missing
+        if name not in DISPLAY_BACKENDS:
+            raise ValueError(f"Capture backend '{name}' cannot capture display {display}; use one of {', '.join(DISPLAY_BACKENDS)}.")
+        return CAPTURE_BACKENDS[name](display)
+    if name != 'auto':
+        return CAPTURE_BACKENDS[name]()
+    system = platform.system()
+    candidates = []
+    if system == 'Windows':
+        candidates.append('gdi')
+    elif system == 'Linux' and os.environ.get('DISPLAY'):
+        candidates.append('xshm')
+    for candidate in candidates:
+        try:
+            return CAPTURE_BACKENDS[candidate]()
+        except (OSError, AttributeError):
+            continue
+    return PILCaptureBackend()
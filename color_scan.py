@@ -0,0 +1,449 @@
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.ndimage as ndimage
+
+# Color matching and connected-component search used by mouse_to_color.
+# Frames are (height, width, 3) uint8 RGB arrays as returned by the capture backends.
+
+def hex_to_rgb(hex_color):
+    return tuple(int(hex_color[j:j+2], 16) for j in (1, 3, 5))
+
+def pack_rgb(arr):
+    # Pack an RGB frame into one uint32 per pixel (0x00RRGGBB)
+    arr = np.asarray(arr)
+    return (arr[..., 0].astype(np.uint32) << 16) | (arr[..., 1].astype(np.uint32) << 8) | arr[..., 2]
+
+def pack_colors(hex_colors):
+    # One uint32 (0x00RRGGBB) per hex color string; an already packed array is returned as is
+    if isinstance(hex_colors, np.ndarray):
+        return hex_colors
+    return np.array([(r << 16) | (g << 8) | b for r, g, b in map(hex_to_rgb, hex_colors)], dtype=np.uint32)
+
+class ColorLUTCache:
+    '''
+    LRU cache of 2^24-entry RGB lookup tables, one per (color set, tolerance).
+    Each table maps a packed RGB value to 1 + the index of the first color within
+    tolerance (Euclidean distance in RGB space), 0 for no match. A uint8 table is
+    16 MB, so the cache is bounded by total bytes and evicts the least recently used.
+    '''
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.luts = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, packed_colors, tolerance):
+        key = (tuple(int(c) for c in packed_colors), tolerance)
+        with self.lock:
+            lut = self.luts.get(key)
+            if lut is not None:
+                self.luts.move_to_end(key)
+                self.hits += 1
+                return lut
+            self.misses += 1
+        lut = build_color_lut(packed_colors, tolerance)
+        with self.lock:
+            self.luts[key] = lut
+            self.luts.move_to_end(key)
+            while len(self.luts) > 1 and self.nbytes() > self.max_bytes:
+                self.luts.popitem(last=False)
+                self.evictions += 1
+        return lut
+
+    def nbytes(self):
+        return sum(lut.nbytes for lut in self.luts.values())
+
+    def clear(self):
+        with self.lock:
+            self.luts.clear()
+
+    def stats(self):
+        return {'entries': len(self.luts), 'bytes': self.nbytes(), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+def build_color_lut(packed_colors, tolerance):
+    dtype = np.uint8 if len(packed_colors) < 255 else np.uint16
+    lut = np.zeros(1 << 24, dtype=dtype)
+    cube = lut.reshape(256, 256, 256)
+    tol2 = tolerance * tolerance
+    t = int(tolerance)
+    for k, packed in enumerate(packed_colors):
+        r0, g0, b0 = int(packed) >> 16, (int(packed) >> 8) & 0xff, int(packed) & 0xff
+        g_lo, g_hi = max(0, g0 - t), min(255, g0 + t) + 1
+        b_lo, b_hi = max(0, b0 - t), min(255, b0 + t) + 1
+        dg2 = (np.arange(g_lo, g_hi) - g0)[:, None] ** 2
+        db2 = (np.arange(b_lo, b_hi) - b0)[None, :] ** 2
+        plane_d2 = dg2 + db2
+        # Walk the sphere one red slice at a time; earlier colors keep priority
+        for r in range(max(0, r0 - t), min(255, r0 + t) + 1):
+            inside = plane_d2 <= tol2 - (r - r0) ** 2
+            block = cube[r, g_lo:g_hi, b_lo:b_hi]
+            block[inside & (block == 0)] = k + 1
+    return lut
+
+
+color_lut_cache = ColorLUTCache()
+
+
+def color_index_map(arr, packed_colors, tolerance=0):
+    '''
+    Match every pixel against the whole color set in one pass.
+    Returns an array holding 1 + the index of the matched color, 0 where nothing matches.
+    If a color is listed twice its pixels are attributed to the first occurrence.
+    With a tolerance the match goes through a cached RGB lookup table, which costs
+    the same as exact matching once the table is built.
+    '''
+    if not len(packed_colors):
+        return np.zeros(arr.shape[:2], dtype=np.uint8)
+    packed = pack_rgb(arr)
+    if tolerance > 0:
+        return color_lut_cache.get(packed_colors, tolerance)[packed]
+    dtype = np.uint8 if len(packed_colors) < 255 else np.uint16
+    if len(packed_colors) == 1:
+        return (packed == packed_colors[0]).astype(dtype)
+    order = np.argsort(packed_colors, kind='stable')
+    sorted_colors = packed_colors[order]
+    pos = np.searchsorted(sorted_colors, packed)
+    np.minimum(pos, len(sorted_colors) - 1, out=pos)
+    hit = sorted_colors[pos] == packed
+    return np.where(hit, order[pos] + 1, 0).astype(dtype)
+
+PYRAMID_MAX_TILES = 64
+
+def pyramid_tiles(arr1, packed_colors, tolerance=0, min_size=4, arr2=None):
+    '''
+    Coarse-to-fine color matching for large, mostly empty regions.
+    The frame is split into min_size x min_size cells and colors are first matched on
+    one pixel per cell, so any target containing a min_size x min_size square is
+    guaranteed to be hit; thinner targets may be skipped. Only hit cells and their
+    neighbours are then matched at full resolution, growing cell by cell until every
+    matched pixel is surrounded by evaluated cells, so found components are complete.
+    Returns a list of (y0, x0, index1, index2) tiles covering the evaluated cells; no
+    component crosses a tile boundary. index2 (for arr2) is evaluated on the same cells,
+    which include every pixel adjacent to a frame-1 component.
+    '''
+    stride = max(1, int(min_size))
+    height, width = arr1.shape[:2]
+    cells_h = -(-height // stride)
+    cells_w = -(-width // stride)
+    dtype = np.uint8 if len(packed_colors) < 255 else np.uint16
+    ring = np.ones((3, 3), dtype=bool)
+    # Padded to whole cells so per-cell reductions are plain reshapes
+    index1 = np.zeros((cells_h * stride, cells_w * stride), dtype=dtype)
+    evaluated = np.zeros((cells_h, cells_w), dtype=bool)
+    matched = color_index_map(arr1[::stride, ::stride], packed_colors, tolerance) > 0
+    wanted = ndimage.binary_dilation(matched, structure=ring)
+    while True:
+        new = wanted & ~evaluated
+        if not new.any():
+            break
+        new_labeled, num_new = ndimage.label(new, structure=ring)
+        if num_new > PYRAMID_MAX_TILES:
+            # Busy screen: one full-resolution pass is cheaper than many small ones
+            index1[:height, :width] = color_index_map(arr1, packed_colors, tolerance)
+            evaluated[:] = True
+            break
+        for sy, sx in ndimage.find_objects(new_labeled):
+            y0, y1 = sy.start * stride, min(height, sy.stop * stride)
+            x0, x1 = sx.start * stride, min(width, sx.stop * stride)
+            index1[y0:y1, x0:x1] = color_index_map(arr1[y0:y1, x0:x1], packed_colors, tolerance)
+            evaluated[sy, sx] = True
+            cells = index1[sy.start * stride:sy.stop * stride, sx.start * stride:sx.stop * stride]
+            cells = cells.reshape(sy.stop - sy.start, stride, sx.stop - sx.start, stride)
+            matched[sy, sx] = cells.any(axis=(1, 3))
+        wanted = ndimage.binary_dilation(matched, structure=ring)
+    groups, num_groups = ndimage.label(evaluated, structure=ring)
+    if num_groups > PYRAMID_MAX_TILES or evaluated.all():
+        # Busy screen: per-tile overhead would outweigh the savings, use one tile
+        index2 = color_index_map(arr2, packed_colors, tolerance) if arr2 is not None else None
+        return [(0, 0, index1[:height, :width], index2)]
+    tiles = []
+    for g, (sy, sx) in enumerate(ndimage.find_objects(groups), 1):
+        y0, y1 = sy.start * stride, min(height, sy.stop * stride)
+        x0, x1 = sx.start * stride, min(width, sx.stop * stride)
+        in_group = np.repeat(np.repeat(groups[sy, sx] == g, stride, axis=0), stride, axis=1)[:y1 - y0, :x1 - x0]
+        tile1 = np.where(in_group, index1[y0:y1, x0:x1], 0).astype(dtype)
+        tile2 = None
+        if arr2 is not None:
+            tile2 = np.where(in_group, color_index_map(arr2[y0:y1, x0:x1], packed_colors, tolerance), 0).astype(dtype)
+        tiles.append((y0, x0, tile1, tile2))
+    return tiles
+
+def stationary_labels(labeled1, num_features, mask2):
+    '''
+    Labels of frame-1 components that are unchanged in frame 2 (same pixel set).
+    Components are paired in bulk with a histogram over (label1, label2) pixel pairs:
+    a component is stationary when all its pixels fall into a single frame-2
+    component of exactly the same size, which also makes the centers of mass equal.
+    '''
+    labeled2, num2 = ndimage.label(mask2)
+    if num2 == 0:
+        return np.empty(0, dtype=np.intp)
+    in1 = labeled1 > 0
+    pair_keys = labeled1[in1].astype(np.int64) * (num2 + 1) + labeled2[in1]
+    keys, counts = np.unique(pair_keys, return_counts=True)
+    l1 = keys // (num2 + 1)
+    l2 = keys % (num2 + 1)
+    sizes1 = np.bincount(labeled1.ravel(), minlength=num_features + 1)
+    sizes2 = np.bincount(labeled2.ravel(), minlength=num2 + 1)
+    same = (l2 > 0) & (counts == sizes1[l1]) & (counts == sizes2[l2])
+    return l1[same].astype(np.intp)
+
+def component_stats(labeled, num_features):
+    '''
+    Per-component statistics for labels 1..num_features, computed in one pass over the label image.
+    Arrays are indexed by label (index 0 is the background).
+    '''
+    flat = labeled.ravel()
+    width = labeled.shape[1]
+    # Only labeled pixels contribute, so mostly empty frames cost little
+    nz = np.flatnonzero(flat)
+    labels = flat[nz]
+    sizes = np.bincount(labels, minlength=num_features + 1)
+    safe = np.maximum(sizes, 1)
+    return {
+        'sizes': sizes,
+        'cx': np.bincount(labels, weights=nz % width, minlength=num_features + 1) / safe,
+        'cy': np.bincount(labels, weights=nz // width, minlength=num_features + 1) / safe,
+        'slices': [None] + ndimage.find_objects(labeled, num_features),
+    }
+
+def component_pixels(labeled, stats, lbl):
+    # Pixel index arrays of one component, scanning only its bounding box
+    sl_y, sl_x = stats['slices'][lbl]
+    ys, xs = np.nonzero(labeled[sl_y, sl_x] == lbl)
+    return xs + sl_x.start, ys + sl_y.start
+
+def find_color_target(arr1, hex_colors, arr2=None, selection_mode='random', cursor=(0, 0), best_across_colors=False, tolerance=0, pyramid_min_size=0, rng=random, index_maps=None):
+    '''
+    Pick one connected component of any of hex_colors in arr1 (hex strings, or already
+    packed with pack_colors).
+    With arr2 given only components that did not move between the two frames count.
+    cursor is the mouse position relative to the region, used by closest/furthest.
+    By default the first color (in list order) with a valid component wins; with
+    best_across_colors the selection mode is applied to the components of all colors.
+    tolerance is the Euclidean RGB distance a pixel may be from a color (0 = exact).
+    pyramid_min_size > 0 enables the coarse-to-fine search (see pyramid_tiles).
+    rng draws the 'random' selection (the random module or a random.Random).
+    index_maps is (index1, index2) as already computed by color_index_map for arr1 and
+    arr2 (index2 None without arr2); the frames are then not matched again.
+    Returns (xs, ys) pixel index arrays of the chosen component, or None.
+    '''
+    packed_colors = pack_colors(hex_colors)
+    n_colors = len(packed_colors)
+    if index_maps is not None:
+        tiles = [(0, 0) + tuple(index_maps)]
+    elif pyramid_min_size > 0:
+        tiles = pyramid_tiles(arr1, packed_colors, tolerance, pyramid_min_size, arr2)
+    else:
+        index1 = color_index_map(arr1, packed_colors, tolerance)
+        index2 = color_index_map(arr2, packed_colors, tolerance) if arr2 is not None else None
+        tiles = [(0, 0, index1, index2)]
+    # Colors without a single matching pixel are skipped without labeling
+    counts = [np.bincount(tile[2].ravel(), minlength=n_colors + 1) for tile in tiles]
+    candidates = []  # (labeled, stats, labels, dists, y0, x0) per color and tile
+    for k in range(n_colors):
+        for (y0, x0, index1, index2), tile_counts in zip(tiles, counts):
+            if tile_counts[k + 1] == 0:
+                continue
+            labeled1, num_features = ndimage.label(index1 == k + 1)
+            if index2 is not None:
+                valid_labels = stationary_labels(labeled1, num_features, index2 == k + 1)
+            else:
+                valid_labels = np.arange(1, num_features + 1)
+            if not len(valid_labels):
+                continue
+            stats = component_stats(labeled1, num_features)
+            if selection_mode in ['closest', 'furthest']:
+                rel_cx, rel_cy = cursor[0] - x0, cursor[1] - y0
+                dists = np.hypot(stats['cx'][valid_labels] - rel_cx, stats['cy'][valid_labels] - rel_cy)
+            else:
+                dists = np.zeros(len(valid_labels))
+            candidates.append((labeled1, stats, valid_labels, dists, y0, x0))
+        if candidates and not best_across_colors:
+            break
+    if not candidates:
+        return None
+    all_dists = np.concatenate([c[3] for c in candidates])
+    if selection_mode == 'closest':
+        pick = int(np.argmin(all_dists))
+    elif selection_mode == 'furthest':
+        pick = int(np.argmax(all_dists))
+    else:
+        pick = rng.randrange(len(all_dists))
+    for labeled, stats, labels, dists, y0, x0 in candidates:
+        if pick < len(labels):
+            xs, ys = component_pixels(labeled, stats, int(labels[pick]))
+            return xs + x0, ys + y0
+        pick -= len(labels)
+
+def pick_target_point(xs, ys, border_margin_percent=20, margin_mode='box', rng=random):
+    '''
+    Pick the click point inside a component given by pixel index arrays, keeping
+    border_margin_percent away from its edges.
+    'box' measures the margin against the component's bounding box (per axis);
+    'distance' uses the Euclidean distance transform of the component mask, which
+    respects the actual outline of non-rectangular blobs.
+    rng draws the point among the eligible pixels.
+    Returns (x, y) in the same coordinates as xs, ys.
+    '''
+    comp_min_x, comp_max_x = int(xs.min()), int(xs.max())
+    comp_min_y, comp_max_y = int(ys.min()), int(ys.max())
+    percent = border_margin_percent / 100.0
+    threshold = min(1.0, 2 * percent)  # Fixed to match expected margin
+    if margin_mode == 'distance':
+        # Component mask cropped to its bounding box, padded so edges count as border
+        mask = np.zeros((comp_max_y - comp_min_y + 3, comp_max_x - comp_min_x + 3), dtype=bool)
+        mask[ys - comp_min_y + 1, xs - comp_min_x + 1] = True
+        depth = ndimage.distance_transform_edt(mask)[ys - comp_min_y + 1, xs - comp_min_x + 1]
+        norm = depth / depth.max()
+        inner = np.flatnonzero(norm >= threshold)
+        pick = inner[rng.randrange(len(inner))]
+        return int(xs[pick]), int(ys[pick])
+    comp_width = comp_max_x - comp_min_x + 1
+    comp_height = comp_max_y - comp_min_y + 1
+    if threshold == 1.0:  # Equivalent to old special case for 50%
+        # Pick closest to center
+        comp_center_x = (comp_min_x + comp_max_x) / 2
+        comp_center_y = (comp_min_y + comp_max_y) / 2
+        pick = int(np.argmin(np.hypot(xs - comp_center_x, ys - comp_center_y)))
+        return int(xs[pick]), int(ys[pick])
+    dist_x = np.minimum(xs - comp_min_x, comp_max_x - xs)
+    dist_y = np.minimum(ys - comp_min_y, comp_max_y - ys)
+    min_norm = np.minimum(2 * dist_x / comp_width, 2 * dist_y / comp_height)
+    inner = np.flatnonzero(min_norm >= threshold)
+    if not len(inner):
+        # Fallback: points with the max achievable min_norm
+        inner = np.flatnonzero(min_norm == min_norm.max())
+    pick = inner[rng.randrange(len(inner))]
+    return int(xs[pick]), int(ys[pick])
+
+class RegionTracker:
+    '''
+    Remembers where a mouse_to_color action last found its target and proposes
+    search windows around that spot, smallest first, before the full region is
+    scanned (see tracked_color_target). Keeps per-action hit/miss counts.
+    '''
+    def __init__(self, min_radius=64, growth=4, levels=2):
+        self.min_radius = min_radius
+        self.growth = growth
+        self.levels = levels
+        self.last_center = None
+        self.last_extent = 0
+        self.hits = 0      # every match inside a window, only it labeled
+        self.misses = 0    # full region labeled
+        self.labeled_area = 0
+
+    def windows(self, region):
+        if self.last_center is None:
+            return []
+        min_x, min_y, max_x, max_y = region
+        cx, cy = self.last_center
+        radius = max(self.min_radius, 2 * self.last_extent)
+        windows = []
+        for _ in range(self.levels):
+            window = (max(min_x, int(cx - radius)), max(min_y, int(cy - radius)),
+                      min(max_x, int(cx + radius) + 1), min(max_y, int(cy + radius) + 1))
+            if window[0] >= window[2] or window[1] >= window[3]:
+                break
+            if window == region:
+                break
+            windows.append(window)
+            radius *= self.growth
+        return windows
+
+    def record(self, xs, ys, region, window=None):
+        # window is the window the target was found in, None when the full region was scanned
+        x1, y1, x2, y2 = window or region
+        if window is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.labeled_area += (x2 - x1) * (y2 - y1)
+        if xs is not None:
+            self.last_center = (float(xs.mean()), float(ys.mean()))
+            self.last_extent = int(max(xs.max() - xs.min(), ys.max() - ys.min())) + 1
+
+    def stats(self):
+        scans = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / scans if scans else 0.0,
+            'mean_labeled_area': self.labeled_area / scans if scans else 0.0,  # matching always covers the region
+        }
+
+
+def tracked_color_target(tracker, region, arr1, hex_colors, arr2=None, selection_mode='random', cursor=(0, 0), best_across_colors=False, tolerance=0, rng=random):
+    '''
+    find_color_target over region, the screen area (x1, y1, x2, y2) of arr1 and arr2.
+    Colors are always matched over the whole region; only the labeling is windowed, to
+    the smallest of tracker's windows that holds every matching pixel.
+    A match outside the window could be the closest, furthest or random pick, so when
+    one exists the whole region is labeled: the result is always the full-region pick.
+    cursor and the returned (xs, ys) are screen coordinates; the scan is recorded in tracker.
+    '''
+    min_x, min_y = region[:2]
+    window = None
+    index_maps = None
+    windows = tracker.windows(region)
+    if windows:
+        packed_colors = pack_colors(hex_colors)
+        index1 = color_index_map(arr1, packed_colors, tolerance)
+        index2 = color_index_map(arr2, packed_colors, tolerance) if arr2 is not None else None
+        index_maps = (index1, index2)
+        matched = index1 > 0
+        if index2 is not None:
+            # Frame-2 matches decide which components are stationary, so they must be inside too
+            matched |= index2 > 0
+        ys, xs = np.nonzero(matched)
+        if len(xs):
+            x1, y1 = int(xs.min()) + min_x, int(ys.min()) + min_y
+            x2, y2 = int(xs.max()) + min_x + 1, int(ys.max()) + min_y + 1
+            window = next((w for w in windows if w[0] <= x1 and w[1] <= y1 and x2 <= w[2] and y2 <= w[3]), None)
+    x1, y1, x2, y2 = window or region
+    crop = (slice(y1 - min_y, y2 - min_y), slice(x1 - min_x, x2 - min_x))
+    if index_maps is not None:
+        index_maps = tuple(None if m is None else m[crop] for m in index_maps)
+    target = find_color_target(arr1[crop], hex_colors, None if arr2 is None else arr2[crop], selection_mode,
+                               (cursor[0] - x1, cursor[1] - y1), best_across_colors, tolerance, 0, rng, index_maps)
+    if target is None:
+        tracker.record(None, None, region, window)
+        return None
+    xs, ys = target[0] + x1, target[1] + y1
+    tracker.record(xs, ys, region, window)
+    return xs, ys
+
+
+POINT_MODES = ['all', 'any', 'at_least']
+
+def points_bbox(points):
+    # Smallest capture region (x1, y1, x2, y2) that covers every (x, y) point
+    pts = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    return (int(pts[:, 0].min()), int(pts[:, 1].min()), int(pts[:, 0].max()) + 1, int(pts[:, 1].max()) + 1)
+
+def points_match(arr, origin, points, colors, tolerance=0, mode='all', min_matches=1):
+    '''
+    Check many pixels of one capture at once. arr is the frame whose top-left pixel is
+    at screen position origin; a point matches if it is within tolerance of any of the
+    colors, given as hex strings or an already parsed (N, 3) int32 RGB array.
+    mode 'all' needs every point, 'any' at least one, 'at_least' min_matches.
+    Returns (matched, number of matching points).
+    '''
+    pts = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    pixels = np.asarray(arr)[pts[:, 1] - origin[1], pts[:, 0] - origin[0]].astype(np.int32)
+    if not isinstance(colors, np.ndarray):
+        colors = np.array([hex_to_rgb(c) for c in colors], dtype=np.int32)
+    dist2 = ((pixels[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2)
+    count = int((dist2 <= tolerance * tolerance).any(axis=1).sum())
+    if mode == 'all':
+        return count == len(pts), count
+    if mode == 'any':
+        return count > 0, count
+    return count >= min_matches, count
@@ -0,0 +1,932 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import traceback
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pynput.keyboard import Key
+from pynput.mouse import Button
+
+from capture import FrameCache, create_capture_backend
+from color_scan import RegionTracker, find_color_target, pick_target_point, points_match, tracked_color_target
+from inputs import create_input_backend
+from motion import MOTION_MODELS, MoveReport, MoveTimingStats, create_path_pool, path_steps, timed_path_steps
+from latency import calibrate_latency, load_latency_profile, max_move_hz
+from prefetch import Prefetcher
+from program import compile_macro
+from seeding import PlaybackRandom, append_run_log, global_streams
+from timing import Sleeper
+
+# Macro playback without any GUI: PlaybackEngine plays a list of action dicts (the
+# macro file format) on a thread of its own and reports through callbacks. index.py is
+# one client; `python -m engine macro.json` plays a macro from the command line.
+#
+# Playback itself is written as coroutines: every sleep, capture and move goes through
+# an engine's sleep() and blocking() hooks. PlaybackEngine runs them on its own thread
+# with blocking, sub-millisecond sleeps; AsyncPlaybackEngine runs them as a task on
+# the caller's event loop, so many engines can share one loop and stop is a cancel.
+
+# How a playback runs. repeat_mode is 'Loops' (repeat_value times through the macro)
+# or 'Minutes' (until repeat_value minutes have passed); speed is a percentage (1-200)
+# applied to delays and move durations; seed None draws a new one; frame_cache_ms is
+# the max age of reused captures (0 = off); mouse_rate_hz caps cursor updates during
+# moves (0 = no cap); start_delay is waited before the first action.
+PlaybackConfig = namedtuple('PlaybackConfig', ['repeat_mode', 'repeat_value', 'speed', 'seed', 'frame_cache_ms', 'mouse_rate_hz', 'start_delay'],
+                            defaults=('Loops', 1.0, 100.0, None, 0.0, 1000.0, 0.0))
+
+REPEAT_MODES = ('Loops', 'Minutes')
+
+def check_config(config):
+    # Raises ValueError for a config playback cannot run with
+    if config.repeat_mode not in REPEAT_MODES:
+        raise ValueError(f"Repeat mode must be one of {', '.join(REPEAT_MODES)}.")
+    if not config.repeat_value > 0:
+        raise ValueError("Repeat value must be a positive number.")
+    if not 1 <= config.speed <= 200:
+        raise ValueError("Speed must be between 1 and 200.")
+    if config.seed is not None and (int(config.seed) != config.seed or config.seed < 0):
+        raise ValueError("Seed must be empty (random) or a non-negative whole number.")
+    if not config.frame_cache_ms >= 0:
+        raise ValueError("Frame cache age must be 0 (off) or a positive number of milliseconds.")
+    if not config.mouse_rate_hz >= 0:
+        raise ValueError("Mouse rate must be 0 (no limit) or a positive number of updates per second.")
+    if not config.start_delay >= 0:
+        raise ValueError("Start delay must be 0 or a positive number of seconds.")
+
+# How a playback ended, passed to on_end. reason is 'finished' (all repeats done),
+# 'aborted' (an action's on_fail/on_end stopped it; title and message explain why),
+# 'stopped' (stop() was called) or 'error' (an action raised, e.g. a capture failed;
+# message names the exception); status is the one-line summary for a status bar.
+# stop_latency_s is the time from stop() to the playback having ended, None unless stopped.
+PlaybackResult = namedtuple('PlaybackResult', ['reason', 'title', 'message', 'status', 'seed', 'steps', 'seconds', 'stop_latency_s'],
+                            defaults=(None,))
+
+# A human_move worked out in advance: every random choice and path, ready to be played
+MoveSegment = namedtuple('MoveSegment', ['start', 'xs', 'ys', 'seconds'])
+MovePlan = namedtuple('MovePlan', ['duration', 'dest', 'segments', 'pause', 'model'])
+
+# Seconds per pixel range for mouse_move, applied within the action's delay
+MIN_SEC_PER_PX = 0.000500000001
+MAX_SEC_PER_PX = 0.000800000001
+
+# Everything random about one action: its delay and, for mouse_move, where and how it moves
+ActionPlan = namedtuple('ActionPlan', ['delay', 'dest', 'pause_before', 'pause_after', 'move'])
+
+def action_end_pos(action, plan, start):
+    # Where the cursor will be after the action, None if that depends on the screen
+    if action.type == 'mouse_to_color':
+        return None
+    if action.type == 'trajectory':
+        return (int(action.xs[-1]), int(action.ys[-1])) if len(action.xs) else start
+    if plan.move is None:
+        return start
+    if plan.move.segments and len(plan.move.segments[-1].xs):
+        last = plan.move.segments[-1]
+        return (int(last.xs[-1]), int(last.ys[-1]))
+    return tuple(round(v) for v in plan.move.dest)
+
+class PlaybackState:
+    # What the action handlers of one playback pass read and update
+    __slots__ = ('i', 'loop_stack', 'current_pos', 'plan', 'streams', 'time_multiplier')
+
+    def __init__(self, current_pos, time_multiplier):
+        self.i = 0
+        self.loop_stack = []  # remaining repetitions of the open loops, innermost last
+        self.current_pos = current_pos
+        self.plan = None  # ActionPlan of the action being run
+        self.streams = global_streams
+        self.time_multiplier = time_multiplier
+
+    def restart(self):
+        # on_fail/on_end 'restart': start over from the first action
+        self.loop_stack.clear()
+        return 0
+
+# Action handlers by op: engine coroutines handler(state, instruction) that run the
+# action after its delay and return the index of the next instruction. Stopping goes
+# through engine.active, which the playback loop checks before every action (and, for
+# AsyncPlaybackEngine, by cancelling the task at whatever it is awaiting).
+ACTION_HANDLERS = {
+    'key_action': 'run_key_action',
+    'mouse_move': 'run_mouse_move',
+    'color_check': 'run_color_check',
+    'mouse_to_color': 'run_mouse_to_color',
+    'trajectory': 'run_trajectory',
+    'loop_start': 'run_loop_start',
+    'loop_end': 'run_loop_end',
+    'wait': 'run_wait',
+    'if_color_start': 'run_if_color_start',
+    'else': 'run_else',
+    'if_end': 'run_marker',
+}
+
+class PlaybackEngine:
+    '''
+    Plays macros: start(actions, config) compiles the action dicts and runs them on a
+    playback thread; stop() ends a playback from any thread. on_status(text) is called
+    with progress messages and on_end(result) once with the PlaybackResult, both on the
+    playback thread. seed, steps and result describe the current or last playback.
+
+    An engine owns its playback state, so several can play at once in one process,
+    each with its own controllers and capture backend (see inputs.py and capture.py
+    for ones bound to an X display). The controllers and capture backend default to
+    this desktop's. A path_pool passed in is shared, not owned: close() releases the
+    rest of what the engine holds but leaves the pool to its owner. To play on an
+    asyncio event loop instead of a thread, see AsyncPlaybackEngine.
+    '''
+    prefetch_wait = True  # a plan still being prefetched is waited for rather than planned again inline
+    spin_sleeps = True  # sleeps go through Sleeper, which spins their tail and so needs calibrating
+
+    def __init__(self, mouse_controller=None, kb_controller=None, capture_backend=None, path_pool=None, latency=None,
+                 on_status=None, on_end=None, prefetch_depth=2):
+        if mouse_controller is None or kb_controller is None:
+            default_mouse, default_kb = create_input_backend()
+            mouse_controller = mouse_controller or default_mouse
+            kb_controller = kb_controller or default_kb
+        self.mouse_controller = mouse_controller
+        self.kb_controller = kb_controller
+        self.frame_cache = FrameCache(capture_backend or create_capture_backend())  # Shares recent captures between actions; max age set per playback
+        self.owns_path_pool = path_pool is None
+        self.path_pool = path_pool or create_path_pool()  # Pre-generated WindMouse paths (see motion.py), filled in the background
+        self.path_pool.start()
+        self.latency = latency or load_latency_profile()  # Measured injection latency of this host (see latency.py), zero until calibrated
+        self.on_status = on_status
+        self.on_end = on_end
+        self.event = threading.Event()  # Set by stop() to wake any sleep in progress
+        self.sleeper = Sleeper(self.event)
+        if self.spin_sleeps:
+            self.sleeper.calibrate()
+        self.move_timing = MoveTimingStats()  # Planned vs actual human_move durations for the current playback
+        self.prefetcher = Prefetcher(depth=prefetch_depth)  # Plans the next actions' delays and paths during the current delay
+        self.region_trackers = {}  # id(action dict) -> RegionTracker for mouse_to_color actions with roi_tracking
+        self.pressed_items = []  # List of (controller, key_or_button)
+        self.handlers = {op: getattr(self, name) for op, name in ACTION_HANDLERS.items()}
+        self.mouse_rate_hz = 1000.0  # Max cursor position updates per second during moves, 0 = every path point
+        self.generate_paths = False  # WindMouse paths generated from the playback's stream instead of taken from the pool
+        self.active = False
+        self.thread = None
+        self.aborted = None  # (title, message, status) of an abort by the running macro
+        self.seed = None
+        self.steps = 0  # actions executed so far
+        self.result = None  # PlaybackResult of the last playback that ended
+        self.stop_requested = None  # perf_counter() of the stop() call ending the current playback
+        self.stop_latencies = deque(maxlen=1000)  # seconds from stop() to the playback having ended
+
+    def status(self, text):
+        if self.on_status:
+            self.on_status(text)
+
+    def is_active(self):
+        return self.active
+
+    def move_mouse_to(self, x, y):
+        self.mouse_controller.position = (x, y)
+
+    async def sleep(self, duration):
+        # Blocks on the engine's event (set by stop) and spins only for the final sub-millisecond tail
+        if duration <= 0 or not self.active:
+            return
+        self.sleeper.sleep(duration)
+
+    async def blocking(self, func, *args):
+        # Run a blocking call (capture, labeling, planning, path generation); this thread is the engine's own, so directly
+        return func(*args)
+
+    def get_pixel_color(self, x, y, fresh=False):
+        # fresh=True bypasses the frame cache for reads that must reflect the screen right now
+        return self.frame_cache.get_pixel(x, y, fresh)
+
+    def grab_region(self, bbox, fresh=False):
+        # (height, width, 3) RGB array of the screen region, read-only when served from the frame cache
+        return self.frame_cache.grab(bbox, fresh)
+
+    def calibrate_latency(self, samples=200):
+        # Measure this host's input latency (the cursor jitters by a pixel and Shift is tapped) and use it from now on
+        self.latency = calibrate_latency(self.move_mouse_to, lambda: self.mouse_controller.position,
+                                         lambda: self.kb_controller.press(Key.shift), lambda: self.kb_controller.release(Key.shift), samples)
+        return self.latency
+
+    def record_move(self, planned, started, points, skipped, limited=0):
+        report = MoveReport(planned, time.perf_counter() - started, points, skipped, limited)
+        self.move_timing.record(report)
+        return report
+
+    def model_path(self, model, start_x, start_y, dest_x, dest_y, streams=global_streams):
+        # WindMouse paths come from the pool; the closed-form models are cheap enough to evaluate on the spot.
+        # The pool's contents depend on when its fill worker ran, so a playback given a seed generates its
+        # WindMouse paths from its own stream instead: the same seed then gives the same paths and timing.
+        if model == 'windmouse' and not self.generate_paths:
+            return self.path_pool.path(start_x, start_y, dest_x, dest_y, streams.paths)
+        return MOTION_MODELS[model](start_x, start_y, dest_x, dest_y, rng=streams.paths)
+
+    def plan_human_move(self, start_x, start_y, dest_x, dest_y, duration, streams=global_streams, model='windmouse'):
+        if duration <= 0:
+            return MovePlan(duration, (dest_x, dest_y), [], 0.0, model)
+        # Paths come from the motion model (WindMouse: the pool, with G_0=9, W_0=3, M_0=15, D_0=12)
+        # Decide if to introduce a "miss" for more human-like behavior (30% chance)
+        miss_prob = 0.3
+        min_sec_per_px = 0.0005  # Hardcoded min sec per px for check
+        do_miss = streams.motion.random() < miss_prob
+        if do_miss:
+            # Compute a temporary target near the destination for overshoot/miss
+            angle = streams.motion.uniform(0, 2 * np.pi)
+            miss_dist = streams.motion.uniform(20, 100)  # Reduced range for miss_dist
+            temp_x = dest_x + miss_dist * np.cos(angle)
+            temp_y = dest_y + miss_dist * np.sin(angle)
+            # Compute distances
+            dist_main = np.hypot(temp_x - start_x, temp_y - start_y)
+            dist_corr = np.hypot(temp_x - dest_x, temp_y - dest_y)
+            total_dist = dist_main + dist_corr
+            # Check if duration allows for miss without going too fast
+            if duration >= min_sec_per_px * total_dist:
+                # Proceed with miss
+                # Determine pause at miss
+                pause = 0
+                if duration > 0.2:
+                    max_pause = duration - min_sec_per_px * total_dist
+                    pause = streams.motion.uniform(0.1, 0.15) if max_pause >= 0.15 else streams.motion.uniform(0, max_pause)
+                remaining = duration - pause
+                main_duration = remaining * (dist_main / total_dist) if total_dist > 0 else remaining
+                xs, ys = self.model_path(model, start_x, start_y, temp_x, temp_y, streams)
+                # The correction starts where the main move should leave the cursor
+                miss_pos = (int(xs[-1]), int(ys[-1])) if len(xs) else (round(start_x), round(start_y))
+                cxs, cys = self.model_path(model, miss_pos[0], miss_pos[1], dest_x, dest_y, streams)
+                return MovePlan(duration, (dest_x, dest_y), [MoveSegment((start_x, start_y), xs, ys, main_duration), MoveSegment(miss_pos, cxs, cys, None)], pause, model)
+        # If no miss or miss not allowed, normal movement
+        xs, ys = self.model_path(model, start_x, start_y, dest_x, dest_y, streams)
+        if not len(xs):
+            return MovePlan(duration, (dest_x, dest_y), [], 0.0, model)
+        return MovePlan(duration, (dest_x, dest_y), [MoveSegment((start_x, start_y), xs, ys, duration)], 0.0, model)
+
+    async def play_steps(self, steps):
+        # Drive a motion.path_steps/timed_path_steps generator with this engine's sleep; returns its MoveReport
+        while True:
+            try:
+                remaining = next(steps)
+            except StopIteration as done:
+                return done.value
+            await self.sleep(remaining)
+
+    async def play_path(self, xs, ys, duration):
+        return await self.play_steps(path_steps(xs, ys, duration, self.move_mouse_to, self.is_active,
+                                                max_hz=max_move_hz(self.latency, self.mouse_rate_hz), lead=self.latency.move_s))
+
+    async def run_move_plan(self, plan, streams=global_streams):
+        # Returns a MoveReport with the planned and actual duration (also added to move_timing)
+        started = time.perf_counter()
+        if not plan.segments:
+            self.mouse_controller.position = plan.dest
+            return self.record_move(plan.duration, started, 1 if plan.duration <= 0 else 0, 0)
+        first = plan.segments[0]
+        main = await self.play_path(first.xs, first.ys, first.seconds)
+        if len(plan.segments) == 1:
+            return self.record_move(plan.duration, started, main.points, main.skipped, main.limited)
+        # Pause at miss, until the pause's deadline so it absorbs any overrun of the main move
+        await self.sleep(started + first.seconds + plan.pause - time.perf_counter())
+        if not self.active:
+            return self.record_move(plan.duration, started, main.points, main.skipped, main.limited)
+        # Now correct to actual dest with whatever is left of the move's budget
+        correction = plan.segments[1]
+        xs, ys = correction.xs, correction.ys
+        current_x, current_y = self.mouse_controller.position  # Get actual end after main move
+        if (current_x, current_y) != correction.start:
+            xs, ys = await self.blocking(self.model_path, plan.model, current_x, current_y, plan.dest[0], plan.dest[1], streams)
+        result = await self.play_path(xs, ys, max(0.0, started + plan.duration - time.perf_counter()))
+        return self.record_move(plan.duration, started, main.points + result.points, main.skipped + result.skipped, main.limited + result.limited)
+
+    async def human_move(self, start_x, start_y, dest_x, dest_y, duration, streams=global_streams, model='windmouse'):
+        plan = await self.blocking(self.plan_human_move, start_x, start_y, dest_x, dest_y, duration, streams, model)
+        return await self.run_move_plan(plan, streams)
+
+    def plan_action(self, action, start, time_multiplier, streams=global_streams):
+        # action is a decoded action (see program.py)
+        delay = streams.delays.uniform(action.min_delay, action.max_delay) * time_multiplier
+        if action.type != 'mouse_move':
+            return ActionPlan(delay, None, 0.0, 0.0, None)
+        min_x = action.min_x
+        max_x = action.max_x
+        min_y = action.min_y
+        max_y = action.max_y
+        cx, cy = start
+        if min_x <= cx <= max_x and min_y <= cy <= max_y:
+            dest_x = cx
+            dest_y = cy
+        else:
+            dest_x = streams.positions.uniform(min_x, max_x)
+            dest_y = streams.positions.uniform(min_y, max_y)
+        dist = np.hypot(dest_x - cx, dest_y - cy)
+        if dist <= 0:
+            return ActionPlan(delay, (dest_x, dest_y), 0.0, 0.0, None)
+        max_possible_sec_per_px = delay / dist
+        if max_possible_sec_per_px >= MIN_SEC_PER_PX:
+            low = MIN_SEC_PER_PX
+            high = min(MAX_SEC_PER_PX, max_possible_sec_per_px)
+            sec_per_px = streams.delays.uniform(low, high)
+            move_time = dist * sec_per_px
+            total_pause = delay - move_time
+            pause_before = streams.delays.uniform(0, total_pause)
+            pause_after = total_pause - pause_before
+        else:
+            move_time = delay
+            pause_before = 0
+            pause_after = 0
+        return ActionPlan(delay, (dest_x, dest_y), pause_before, pause_after, self.plan_human_move(cx, cy, dest_x, dest_y, move_time, streams, action.motion_model))
+
+    async def check_color_points(self, action, tolerance, fresh=False):
+        # Multi-point color check of a decoded color_check/if_color_start, answered from one capture of the points' bounding box
+        bbox = action.points_bbox
+        arr = await self.blocking(self.grab_region, bbox, fresh)
+        matched, _ = points_match(arr, bbox[:2], action.points, action.colors, tolerance, action.point_mode, action.min_matches)
+        return matched
+
+    async def grab_frames(self, action, bbox, fresh=False):
+        # (arr1, arr2) of bbox, arr2 grabbed 0.1 s later for stationary_only and None otherwise; None if stopped meanwhile
+        arr1 = await self.blocking(self.grab_region, bbox, fresh)
+        if not action.stationary_only:
+            return arr1, None
+        await self.sleep(0.1)
+        if not self.active:
+            return None
+        return arr1, await self.blocking(self.grab_region, bbox, True)
+
+    async def scan_region(self, action, bbox, cursor, fresh=False, streams=global_streams):
+        # (xs, ys) screen coordinates of the chosen color mass in bbox, or None
+        frames = await self.grab_frames(action, bbox, fresh)
+        if frames is None:
+            return None
+        arr1, arr2 = frames
+        rel_cursor = (cursor[0] - bbox[0], cursor[1] - bbox[1])
+        target = await self.blocking(find_color_target, arr1, action.expected_colors, arr2, action.selection_mode, rel_cursor,
+                                     action.best_across_colors, action.tolerance, action.pyramid_min_size, streams.selection)
+        if target is None:
+            return None
+        xs, ys = target
+        return xs + bbox[0], ys + bbox[1]
+
+    async def scan_for_color(self, action, bbox, cursor, fresh=False, streams=global_streams):
+        # The pyramid samples a grid anchored to the scanned area, so a window would sample other pixels than the region
+        if not action.roi_tracking or action.pyramid_min_size > 0:
+            return await self.scan_region(action, bbox, cursor, fresh, streams)
+        # Keyed by the editor's dict, so the action details can show the tracker's stats
+        tracker = self.region_trackers.setdefault(id(action.source), RegionTracker())
+        frames = await self.grab_frames(action, bbox, fresh)
+        if frames is None:
+            return None
+        return await self.blocking(tracked_color_target, tracker, bbox, frames[0], action.expected_colors, frames[1], action.selection_mode,
+                                   cursor, action.best_across_colors, action.tolerance, streams.selection)
+
+    async def perform_key_action(self, key, hold_min=0.001, hold_max=0.3, streams=global_streams):
+        items = []
+        def get_key(kstr):
+            if kstr.startswith('Key.'):
+                return Key.__dict__.get(kstr.split('.')[-1])
+            return kstr if len(kstr) == 1 else None  # Assume single char or Key
+        if key.startswith('mouse.'):
+            button_name = key[6:]
+            button = Button.__dict__.get(button_name)
+            items = [(self.mouse_controller, button)]
+        elif ' + ' in key:
+            modifier_str, main_key_str = key.split(' + ')
+            modifier = get_key(modifier_str)
+            main_key = get_key(main_key_str)
+            items = [(self.kb_controller, modifier), (self.kb_controller, main_key)]
+        else:
+            key_obj = get_key(key)
+            items = [(self.kb_controller, key_obj)]
+        hold_duration = streams.delays.uniform(hold_min, hold_max)
+        # The hold ends when the last release lands: time spent pressing is measured, releasing comes from the latency profile
+        started = time.perf_counter()
+        for ctrl, itm in items:
+            if itm is not None:
+                ctrl.press(itm)
+                self.pressed_items.append((ctrl, itm))
+        await self.sleep(started + hold_duration - self.latency.release_s * len(items) - time.perf_counter())
+        for ctrl, itm in reversed(items):
+            if itm is not None:
+                ctrl.release(itm)
+            if (ctrl, itm) in self.pressed_items:
+                self.pressed_items.remove((ctrl, itm))
+
+    def abort(self, title, message, status):
+        # End the playback from inside an action; reported through on_end as 'aborted'
+        self.aborted = (title, message, status)
+        self.active = False
+
+    async def run_key_action(self, state, instruction):
+        await self.perform_key_action(instruction.action.key, streams=state.streams)
+        return state.i + 1
+
+    async def run_mouse_move(self, state, instruction):
+        plan = state.plan
+        if plan.move is not None:
+            await self.sleep(plan.pause_before)
+            if not self.active:
+                return state.i
+            await self.run_move_plan(plan.move, state.streams)
+            await self.sleep(plan.pause_after)
+        else:
+            await self.sleep(plan.delay)
+        state.current_pos = self.mouse_controller.position  # Update after move
+        return state.i + 1
+
+    async def run_color_check(self, state, instruction):
+        action = instruction.action
+        if action.check_at_mouse:
+            x, y = self.mouse_controller.position
+        else:
+            x, y = action.x, action.y
+
+        async def color_matches(fresh=False):
+            if action.points is not None:
+                return await self.check_color_points(action, action.tolerance, fresh)
+            return action.matches_rgb(await self.blocking(self.get_pixel_color, x, y, fresh))
+
+        async def press_on_success():
+            if action.on_success_press:
+                await self.perform_key_action(action.on_success_press, hold_min=action.hold_min, hold_max=action.hold_max, streams=state.streams)
+
+        match = await color_matches()
+        if match:
+            # Re-check immediately before action for accuracy
+            match = await color_matches(fresh=True)  # Near-instant second grab, never from the cache
+            if not match:
+                # Brief retry loop (3 attempts over ~100ms)
+                for _ in range(3):
+                    await self.sleep(0.03)
+                    match = await color_matches(fresh=True)
+                    if match:
+                        break
+        if match:
+            await press_on_success()
+            return state.i + 1
+        if action.on_fail == 'wait':
+            self.status("Waiting for color match...")
+            while self.active:
+                if await color_matches(fresh=True):
+                    await press_on_success()
+                    break
+                await self.sleep(0.1)
+        elif action.on_fail == 'abort':
+            self.abort("Color Mismatch", "Color check failed. Playback stopped.", "Playback stopped due to color mismatch.")
+        elif action.on_fail == 'restart':
+            return state.restart()
+        return state.i + 1
+
+    async def run_mouse_to_color(self, state, instruction):
+        action = instruction.action
+        streams = state.streams
+        target = await self.scan_for_color(action, action.bbox, state.current_pos, streams=streams)
+        if not self.active:
+            return state.i
+        if target is None:
+            if action.on_fail == 'wait':
+                self.status("Waiting for color in region...")
+                while self.active:
+                    target = await self.scan_for_color(action, action.bbox, self.mouse_controller.position, fresh=True, streams=streams)
+                    if target is not None:
+                        break
+                    await self.sleep(0.1)
+                if not self.active:
+                    return state.i
+            elif action.on_fail == 'abort':
+                self.abort("Color Not Found", "Color not found in region. Playback stopped.", "Playback stopped due to color not found.")
+                return state.i
+            elif action.on_fail == 'restart':
+                return state.restart()
+            else:
+                self.status("Color not found in region, continuing.")
+                return state.i + 1
+        # Apply border margin to the chosen component
+        xs, ys = target
+        dest_x, dest_y = await self.blocking(pick_target_point, xs, ys, action.border_margin_percent, action.border_margin_mode, streams.positions)
+        move_duration = streams.delays.uniform(action.min_move_delay, action.max_move_delay) * state.time_multiplier
+        await self.human_move(state.current_pos[0], state.current_pos[1], dest_x, dest_y, move_duration, streams, action.motion_model)
+        state.current_pos = self.mouse_controller.position
+        return state.i + 1
+
+    async def run_trajectory(self, state, instruction):
+        action = instruction.action
+        self.move_timing.record(await self.play_steps(timed_path_steps(action.xs, action.ys, action.times * state.time_multiplier, self.move_mouse_to, self.is_active,
+                                                                       max_hz=max_move_hz(self.latency, self.mouse_rate_hz), lead=self.latency.move_s)))
+        state.current_pos = self.mouse_controller.position
+        return state.i + 1
+
+    async def run_loop_start(self, state, instruction):
+        action = instruction.action
+        state.loop_stack.append(state.streams.selection.randint(action.min_loops, action.max_loops))
+        return state.i + 1
+
+    async def run_loop_end(self, state, instruction):
+        # Nesting was checked by compile_macro, so the innermost open loop is this one's
+        if state.loop_stack[-1] > 1:
+            state.loop_stack[-1] -= 1
+            return instruction.target + 1
+        state.loop_stack.pop()
+        return state.i + 1
+
+    async def run_wait(self, state, instruction):
+        await self.sleep(state.plan.delay)
+        if not self.active:
+            return state.i
+        on_end = instruction.action.on_end
+        if on_end == 'abort':
+            self.abort("Wait Ended", "Wait completed. Playback aborted.", "Playback aborted after wait.")
+        elif on_end == 'restart':
+            return state.restart()
+        elif on_end == 'wait':
+            self.status("Infinite wait started. Stop manually.")
+            while self.active:
+                await self.sleep(0.1)  # Check every 0.1s to allow stop
+        return state.i + 1
+
+    async def run_if_color_start(self, state, instruction):
+        action = instruction.action
+        if action.points is not None:
+            condition = await self.check_color_points(action, 0)
+        else:
+            if action.check_at_mouse:
+                x, y = self.mouse_controller.position
+            else:
+                x, y = action.x, action.y
+            condition = await self.blocking(self.get_pixel_color, x, y) == action.expected
+        # Otherwise execution continues after the else or if_end
+        return state.i + 1 if condition else instruction.target + 1
+
+    async def run_else(self, state, instruction):
+        # Reached from the end of the if branch: skip the else branch
+        return instruction.target + 1
+
+    async def run_marker(self, state, instruction):
+        return state.i + 1  # if_end, and types this version has no handler for, do nothing
+
+    def prepare(self, actions, config, program=None):
+        # Reset the engine for a new playback; returns (program, run_random, time_multiplier) for run()
+        if self.active:
+            raise RuntimeError("Playback is already running.")
+        check_config(config)
+        if program is None:
+            program = compile_macro(actions)
+        run_random = PlaybackRandom(config.seed)
+        self.seed = run_random.seed
+        self.steps = 0
+        time_multiplier = 100.0 / config.speed
+        self.mouse_rate_hz = config.mouse_rate_hz
+        self.generate_paths = config.seed is not None
+        self.active = True
+        self.aborted = None
+        self.stop_requested = None
+        self.event.clear()
+        self.pressed_items = []
+        self.frame_cache.max_age_ms = config.frame_cache_ms
+        self.frame_cache.invalidate()
+        self.frame_cache.reset_stats()
+        self.move_timing.reset()
+        self.sleeper.reset_stats()
+
+        def plan_ahead(index, start, step):
+            action = program[index].action
+            plan = self.plan_action(action, start, time_multiplier, run_random.step(step, 'plan'))
+            return plan, action_end_pos(action, plan, start)
+        self.prefetcher.reset(plan_ahead)
+        self.region_trackers.clear()
+        if config.start_delay > 0:
+            self.status(f"Playback starting in {config.start_delay:g} seconds... (seed {run_random.seed})")
+        else:
+            self.status(f"Playback started (seed {run_random.seed}).")
+        return program, run_random, time_multiplier
+
+    def start(self, actions, config=PlaybackConfig(), program=None):
+        '''
+        Compile actions and start playing them on a new thread; returns the seed. Raises
+        ValueError for an invalid config or macro and RuntimeError if already playing.
+        program is compile_macro(actions) if already done: playback only reads it, so
+        engines playing the same macro can share one.
+        '''
+        program, run_random, time_multiplier = self.prepare(actions, config, program)
+        # The playback coroutine gets an event loop of its own on this thread, where nothing else runs
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(program, len(actions), config, run_random, time_multiplier),))
+        self.thread.daemon = True
+        self.thread.start()
+        return run_random.seed
+
+    async def run(self, program, action_count, config, run_random, time_multiplier):
+        playback_start = time.time()
+        step = 0  # ordinal of the executed action, keys its random streams
+        state = None
+        error = None
+        cancel = None
+        try:
+            await self.sleep(config.start_delay)
+            playback_start = time.time()
+            state = PlaybackState(self.mouse_controller.position, time_multiplier)
+            rep = 0
+            total_seconds = config.repeat_value * 60 if config.repeat_mode == "Minutes" else float('inf')
+            while self.active:
+                state.loop_stack = []
+                i = 0
+                while i < len(program) and self.active:
+                    if time.time() - playback_start >= total_seconds:
+                        break
+                    instruction = program[i]
+                    action_started = time.perf_counter()  # the delay counts from here, so reading the cursor and planning are part of it
+                    plan = self.prefetcher.take(i, tuple(self.mouse_controller.position), step, wait=self.prefetch_wait)
+                    if plan is None:
+                        plan = await self.blocking(self.plan_action, instruction.action, state.current_pos, time_multiplier, run_random.step(step, 'plan'))
+                    # Plan the next actions on the worker thread while this one sleeps
+                    self.prefetcher.schedule(i, action_end_pos(instruction.action, plan, state.current_pos), len(program), step)
+                    state.i = i
+                    state.plan = plan
+                    state.streams = run_random.step(step)
+                    step += 1
+                    self.steps = step
+                    await self.sleep(action_started + plan.delay - time.perf_counter())
+                    if not self.active:
+                        break
+                    i = await self.handlers.get(instruction.op, self.run_marker)(state, instruction)
+                rep += 1
+                if config.repeat_mode == "Loops" and rep >= config.repeat_value:
+                    break
+                if time.time() - playback_start >= total_seconds:
+                    break
+        except asyncio.CancelledError as e:
+            # The task was cancelled at whatever it was awaiting. stop()'s own cancel ends here; one from the
+            # task's owner or its loop shutting down is reported as a stop, then passed on to them
+            if self.active:
+                cancel = e
+                self.active = False
+                self.release_pressed()
+            else:
+                asyncio.current_task().uncancel()
+        except Exception as e:
+            # An action raised: end the playback as if stopped, but report why
+            traceback.print_exc()
+            where = f"action {state.i + 1}" if state is not None else "playback start"
+            error = f"{type(e).__name__} in {where}: {e}"
+            self.active = False
+            self.release_pressed()
+        result = None
+        try:
+            seconds = time.time() - playback_start
+            if error is not None:
+                result = PlaybackResult('error', "Playback Error", f"Playback stopped by an error: {error}",
+                                        "Playback stopped due to an error.", run_random.seed, step, seconds)
+            elif self.active:
+                result = PlaybackResult('finished', "Finished", "Playback finished.", f"Ready. Seed {run_random.seed}. {self.stats_text()}", run_random.seed, step, seconds)
+            elif self.aborted:
+                result = PlaybackResult('aborted', *self.aborted, run_random.seed, step, seconds)
+            else:
+                stop_latency = None
+                if self.stop_requested is not None:
+                    stop_latency = time.perf_counter() - self.stop_requested
+                    self.stop_latencies.append(stop_latency)
+                result = PlaybackResult('stopped', None, None, "Playback stopped.", run_random.seed, step, seconds, stop_latency)
+            append_run_log({'seed': run_random.seed, 'actions': action_count, 'steps': step, 'speed': config.speed,
+                            'repeat_mode': config.repeat_mode, 'repeat_value': config.repeat_value, 'seconds': seconds, 'result': result.reason,
+                            'error': error, 'stop_latency_s': result.stop_latency_s, 'paths': 'generated' if self.generate_paths else 'pool',
+                            'moves': self.move_timing.stats(), 'capture': self.frame_cache.stats(), 'latency': self.latency._asdict()})
+        finally:
+            # Whatever happened above, the engine is idle again and on_end hears about it
+            self.active = False
+            self.pressed_items.clear()
+            if result is None:
+                result = PlaybackResult('error', "Playback Error", "Playback ended with an error.", "Playback stopped due to an error.",
+                                        run_random.seed, step, time.time() - playback_start)
+            self.result = result
+            if self.on_end:
+                self.on_end(result)
+        if cancel is not None:
+            raise cancel
+
+    def release_pressed(self):
+        for controller, item in self.pressed_items:
+            controller.release(item)
+        self.pressed_items.clear()
+
+    def stop(self, timeout=1.0):
+        # Stop the playback, release held keys and wait up to timeout for the thread; False if nothing was playing
+        if not self.active:
+            return False
+        self.stop_requested = time.perf_counter()
+        self.active = False
+        self.event.set()
+        self.release_pressed()
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=timeout)
+        return True
+
+    def wait(self, timeout=None):
+        # Block until the playback thread has ended; False on timeout
+        if self.thread:
+            self.thread.join(timeout)
+            return not self.thread.is_alive()
+        return True
+
+    def play(self, actions, config=PlaybackConfig()):
+        # start() and wait for the end; returns the PlaybackResult
+        results = []
+        on_end = self.on_end
+        def record_result(result):
+            results.append(result)
+            if on_end:
+                on_end(result)
+        self.on_end = record_result
+        try:
+            self.start(actions, config)
+            while not self.wait(0.1):
+                pass
+        finally:
+            self.on_end = on_end
+        return results[0] if results else None
+
+    def roi_stats_text(self):
+        if not self.region_trackers:
+            return ""
+        hits = sum(t.hits for t in self.region_trackers.values())
+        misses = sum(t.misses for t in self.region_trackers.values())
+        return f" ROI: {hits}/{hits + misses} window hits."
+
+    def move_stats_text(self):
+        stats = self.move_timing.stats()
+        if not stats['moves']:
+            return ""
+        return f" Moves: {stats['moves']}, planned {stats['planned_s']:.2f} s, actual {stats['actual_s']:.2f} s, mean overrun {stats['mean_overrun_ms']:.1f} ms, {stats['skipped']} late points coalesced, {stats['limited']} points over the rate limit coalesced."
+
+    def sleep_stats_text(self):
+        stats = self.sleeper.stats()
+        if not stats['sleeps']:
+            return ""
+        return f" Sleep overshoot: mean {stats['mean_overshoot_us']:.0f} us, p99 {stats['p99_overshoot_us']:.0f} us."
+
+    def prefetch_stats_text(self):
+        stats = self.prefetcher.stats()
+        if not stats['hits'] and not stats['invalidated']:
+            return ""
+        return f" Prefetch: {stats['hits']} used, {stats['invalidated']} invalidated, {stats['misses']} planned inline."
+
+    def capture_stats_text(self):
+        stats = self.frame_cache.stats()
+        text = f"Capture [{stats['backend']}]: {stats['grabs']} grabs, mean {stats['mean_ms']:.2f} ms, max {stats['max_ms']:.2f} ms"
+        if stats['max_age_ms'] > 0:
+            text += f", {stats['cache_hits']} cache hits"
+        return text
+
+    def stop_stats_text(self):
+        if not self.stop_latencies:
+            return ""
+        latencies = np.array(self.stop_latencies) * 1000
+        return f" Stop latency: {len(latencies)} stops, mean {latencies.mean():.2f} ms, max {latencies.max():.2f} ms."
+
+    def stats_text(self):
+        return f"{self.capture_stats_text()}{self.roi_stats_text()}{self.move_stats_text()}{self.sleep_stats_text()}{self.prefetch_stats_text()}{self.stop_stats_text()}"
+
+    def close(self):
+        self.stop()
+        self.frame_cache.close()
+        if self.owns_path_pool:
+            self.path_pool.close()
+        self.sleeper.close()
+        self.prefetcher.close()
+        for controller in (self.mouse_controller, self.kb_controller):
+            if hasattr(controller, 'close'):
+                controller.close()
+
+class AsyncPlaybackEngine(PlaybackEngine):
+    '''
+    A PlaybackEngine whose playback is a task on the running asyncio event loop instead
+    of a thread, so one loop can play many macros. Sleeps, moves and the on_fail 'wait'
+    polls are awaited; captures, color labeling, action planning, path generation and
+    click point picking run on the engine's own worker thread, so the loop only awaits
+    and drives the controllers. stop() cancels the task, which ends at whatever it is awaiting, so stopping
+    does not depend on a loop noticing a flag: the latency is that of the loop (reported
+    per stop in PlaybackResult.stop_latency_s and stats_text()). Sleeps are as precise
+    as the event loop's timers, about a millisecond, not the threaded engine's spin.
+    start() and stop() must be called on the loop's thread; on_status and on_end are
+    called there too.
+    '''
+    prefetch_wait = False  # never block the loop on the planning thread: plan on the executor instead
+    spin_sleeps = False  # sleeps are the loop's timers; the Sleeper only keeps their overshoot stats
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='playback-worker')
+        self.task = None
+
+    async def sleep(self, duration):
+        if duration <= 0 or not self.active:
+            return
+        deadline = time.perf_counter() + duration
+        await asyncio.sleep(duration)
+        self.sleeper.record(time.perf_counter() - deadline)
+
+    async def blocking(self, func, *args):
+        # Cancelling the await ends the playback at once; a call in flight still completes on the worker thread
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def start(self, actions, config=PlaybackConfig(), program=None):
+        '''
+        Compile actions and start playing them as a task on the running event loop;
+        returns the seed. Raises like PlaybackEngine.start, and RuntimeError when called
+        outside a running loop.
+        '''
+        loop = asyncio.get_running_loop()
+        program, run_random, time_multiplier = self.prepare(actions, config, program)
+        self.task = loop.create_task(self.run(program, len(actions), config, run_random, time_multiplier))
+        return run_random.seed
+
+    def stop(self, timeout=None):
+        # Cancel the playback and release held keys; False if nothing was playing. timeout is
+        # not used: the task ends on the loop's next iteration, so await wait() for it.
+        if not self.active:
+            return False
+        self.stop_requested = time.perf_counter()
+        self.active = False
+        self.release_pressed()
+        self.task.cancel()
+        return True
+
+    async def wait(self, timeout=None):
+        # Until the playback task has ended; False on timeout
+        if self.task is None or self.task.done():
+            return True
+        done, _ = await asyncio.wait([self.task], timeout=timeout)
+        return bool(done)
+
+    async def play(self, actions, config=PlaybackConfig()):
+        # start() and await the end; returns the PlaybackResult
+        self.start(actions, config)
+        try:
+            await self.wait()
+        except asyncio.CancelledError:
+            self.stop()  # the caller was cancelled (a timeout, a task group): the playback ends with it
+            raise
+        return self.result
+
+    def close(self):
+        self.stop()
+        self.executor.shutdown(wait=True)  # a capture in flight finishes before its backend is closed
+        super().close()
+
+
+def add_playback_arguments(parser):
+    # The command line options of PlaybackConfig and the backends, shared by the engine and supervisor CLIs
+    parser.add_argument('macro', help="Macro JSON file, as saved by the editor")
+    repeat = parser.add_mutually_exclusive_group()
+    repeat.add_argument('--loops', type=float, default=1.0, help="Times to play the macro (default 1)")
+    repeat.add_argument('--minutes', type=float, help="Play the macro repeatedly for this many minutes")
+    parser.add_argument('--speed', type=float, default=100.0, help="Playback speed in percent, 1-200 (default 100)")
+    parser.add_argument('--seed', type=int, help="Seed for reproducible playback (default: a new one, printed)")
+    parser.add_argument('--frame-cache-ms', type=float, default=0.0, help="Reuse captures up to this many milliseconds old (default 0, off)")
+    parser.add_argument('--mouse-rate', type=float, default=1000.0, help="Max cursor updates per second during moves, 0 = no limit (default 1000)")
+    parser.add_argument('--delay', type=float, default=3.0, help="Seconds to wait before the first action (default 3)")
+    parser.add_argument('--capture-backend', help="Capture backend: pil, gdi, x11, xshm or auto (default: MACRO_CAPTURE_BACKEND or auto)")
+    parser.add_argument('--input-backend', help="Input backend: pynput or xtest (default: MACRO_INPUT_BACKEND, or xtest with a display)")
+
+def load_macro_file(parser, path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot load {path}: {e}")
+
+def config_from_args(args):
+    if args.minutes is not None:
+        return PlaybackConfig('Minutes', args.minutes, args.speed, args.seed, args.frame_cache_ms, args.mouse_rate, args.delay)
+    return PlaybackConfig('Loops', args.loops, args.speed, args.seed, args.frame_cache_ms, args.mouse_rate, args.delay)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m engine', description="Play a macro file without the GUI. Ctrl+C stops playback.")
+    add_playback_arguments(parser)
+    parser.add_argument('--display', help="X display to play on, e.g. :1 (default: $DISPLAY)")
+    parser.add_argument('--asyncio', action='store_true', help="Play as a task on an asyncio event loop instead of a thread")
+    args = parser.parse_args(argv)
+    actions = load_macro_file(parser, args.macro)
+    config = config_from_args(args)
+    try:
+        mouse_controller, kb_controller = create_input_backend(args.input_backend, args.display)
+        capture_backend = create_capture_backend(args.capture_backend, args.display)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    engine_class = AsyncPlaybackEngine if args.asyncio else PlaybackEngine
+    engine = engine_class(mouse_controller, kb_controller, capture_backend, on_status=print)
+    try:
+        result = asyncio.run(engine.play(actions, config)) if args.asyncio else engine.play(actions, config)
+    except ValueError as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        engine.stop()
+        result = None
+    finally:
+        engine.close()
+    if result is None:
+        print("Playback stopped.")
+        return 1
+    print(f"{result.title}: {result.message}" if result.reason in ('aborted', 'error') else result.status)
+    return 0 if result.reason == 'finished' else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,170 +1,66 @@
 import json
 import time
-import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, Menu, Spinbox
 from pynput import keyboard, mouse
-from pynput.keyboard import Controller as KeyboardController, Key
 from pynput.keyboard import GlobalHotKeys
-from pynput.mouse import Controller as MouseController, Button
-import random  # For seeding randomness
+from pynput.mouse import Button
 import copy
-import ctypes
-import platform
 
-# Required libraries
-import numpy as np
-from PIL import ImageGrab
-import scipy.ndimage as ndimage
+from capture import create_capture_backend
+from color_scan import POINT_MODES
+from engine import PlaybackConfig, PlaybackEngine
+from latency import save_latency_profile
+from motion import MOTION_MODELS
+from program import compile_macro
 
-# WindMouse constants and function
-sqrt3 = np.sqrt(3)
-sqrt5 = np.sqrt(5)
-
-def wind_mouse(start_x, start_y, dest_x, dest_y, G_0=9, W_0=3, M_0=15, D_0=12, move_mouse=lambda x,y: None):
+def merge_dense_moves(actions, min_points=2):
     '''
-    WindMouse algorithm. Calls the move_mouse kwarg with each new step.
-    Released under the terms of the GPLv3 license.
-    G_0 - magnitude of the gravitational force
-    W_0 - magnitude of the wind force fluctuations
-    M_0 - maximum step size (velocity clip threshold)
-    D_0 - distance where wind behavior changes from random to damped
+    Replace every run of at least min_points exact-point mouse_move actions with a fixed
+    delay (what non-sparse recording makes of mouse motion) by one trajectory action.
+    The run's first delay becomes the trajectory's delay and the others its point times,
+    so the timing is unchanged. Returns the new action list.
     '''
-    current_x, current_y = start_x, start_y
-    v_x = v_y = W_x = W_y = 0
-    while (dist := np.hypot(dest_x - start_x, dest_y - start_y)) >= 1:
-        W_mag = min(W_0, dist)
-        if dist >= D_0:
-            W_x = W_x / sqrt3 + (2 * np.random.random() - 1) * W_mag / sqrt5
-            W_y = W_y / sqrt3 + (2 * np.random.random() - 1) * W_mag / sqrt5
+    merged = []
+    run = []
+    def flush():
+        if len(run) >= min_points:
+            t = 0.0
+            points = []
+            for k, action in enumerate(run):
+                if k:
+                    t += action.get('min_delay', 0.0)
+                points.append([round(t, 4), action['min_x'], action['min_y']])
+            merged.append({'type': 'trajectory', 'min_delay': run[0].get('min_delay', 0.0), 'max_delay': run[0].get('max_delay', 0.0), 'trajectory': points, 'comment': ''})
         else:
-            W_x /= sqrt3
-            W_y /= sqrt3
-            if M_0 < 3:
-                M_0 = np.random.random() * 3 + 3
-            else:
-                M_0 /= sqrt5
-        v_x += W_x + G_0 * (dest_x - start_x) / dist
-        v_y += W_y + G_0 * (dest_y - start_y) / dist
-        v_mag = np.hypot(v_x, v_y)
-        if v_mag > M_0:
-            v_clip = M_0 / 2 + np.random.random() * M_0 / 2
-            v_x = (v_x / v_mag) * v_clip
-            v_y = (v_y / v_mag) * v_clip
-        start_x += v_x
-        start_y += v_y
-        move_x = int(np.round(start_x))
-        move_y = int(np.round(start_y))
-        if current_x != move_x or current_y != move_y:
-            move_mouse(current_x := move_x, current_y := move_y)
-    return current_x, current_y
-
-def human_move(start_x, start_y, dest_x, dest_y, duration, seed=42):
-    if duration <= 0:
-        mouse_controller.position = (dest_x, dest_y)
-        return
-    # Use fixed parameters for consistency, but allow slight variation if desired
-    G_0 = 9
-    W_0 = 3
-    M_0 = 15
-    D_0 = 12
-    # Decide if to introduce a "miss" for more human-like behavior (30% chance)
-    miss_prob = 0.3
-    min_sec_per_px = 0.0005  # Hardcoded min sec per px for check
-    do_miss = random.random() < miss_prob
-    if do_miss:
-        # Compute a temporary target near the destination for overshoot/miss
-        angle = random.uniform(0, 2 * np.pi)
-        miss_dist = random.uniform(20, 100)  # Reduced range for miss_dist
-        temp_x = dest_x + miss_dist * np.cos(angle)
-        temp_y = dest_y + miss_dist * np.sin(angle)
-        # Compute distances
-        dist_main = np.hypot(temp_x - start_x, temp_y - start_y)
-        dist_corr = np.hypot(temp_x - dest_x, temp_y - dest_y)
-        total_dist = dist_main + dist_corr
-        # Check if duration allows for miss without going too fast
-        if duration >= min_sec_per_px * total_dist:
-            # Proceed with miss
-            # Determine pause at miss
-            pause = 0
-            if duration > 0.2:
-                max_pause = duration - min_sec_per_px * total_dist
-                pause = random.uniform(0.1, 0.15) if max_pause >= 0.15 else random.uniform(0, max_pause)
-            remaining = duration - pause
-            main_duration = remaining * (dist_main / total_dist) if total_dist > 0 else remaining
-            correction_duration = remaining * (dist_corr / total_dist) if total_dist > 0 else 0
-            # Move to temp target
-            path = []
-            def collect(x, y):
-                path.append((x, y))
-            wind_mouse(start_x, start_y, temp_x, temp_y, G_0=G_0, W_0=W_0, M_0=M_0, D_0=D_0, move_mouse=collect)
-            if path:
-                num_steps = len(path)
-                step_time = main_duration / num_steps if num_steps > 0 else 0
-                for px, py in path:
-                    if not playback_active:
-                        break
-                    mouse_controller.position = (px, py)
-                    interruptible_sleep(step_time)
-            # Pause at miss
-            interruptible_sleep(pause)
-            if not playback_active:
-                return
-            # Now correct to actual dest
-            current_x, current_y = mouse_controller.position  # Get actual end after main move
-            path = []
-            wind_mouse(current_x, current_y, dest_x, dest_y, G_0=G_0, W_0=W_0, M_0=M_0, D_0=D_0, move_mouse=collect)
-            if path:
-                num_steps = len(path)
-                step_time = correction_duration / num_steps if num_steps > 0 else 0
-                for px, py in path:
-                    if not playback_active:
-                        break
-                    mouse_controller.position = (px, py)
-                    interruptible_sleep(step_time)
-            return
-    # If no miss or miss not allowed, normal movement
-    path = []
-    def collect(x, y):
-        path.append((x, y))
-    wind_mouse(start_x, start_y, dest_x, dest_y, G_0=G_0, W_0=W_0, M_0=M_0, D_0=D_0, move_mouse=collect)
-    if not path:
-        mouse_controller.position = (dest_x, dest_y)
-        return
-    num_steps = len(path)
-    step_time = duration / num_steps if num_steps > 0 else 0
-    for px, py in path:
-        if not playback_active:
-            break
-        mouse_controller.position = (px, py)
-        interruptible_sleep(step_time)
-
-def interruptible_sleep(duration):
-    if duration <= 0:
-        return
-    start = time.time()
-    end_time = start + duration
-    while time.time() < end_time and playback_active:
-        remaining = end_time - time.time()
-        if remaining > 0:
-            time.sleep(min(0.001, remaining))
-
-def get_pixel_color(x, y):
-    if platform.system() == 'Windows':
-        user32 = ctypes.windll.user32
-        gdi32 = ctypes.windll.gdi32
-        hdc = user32.GetDC(0)  # Screen DC
-        color = gdi32.GetPixel(hdc, x, y)
-        user32.ReleaseDC(0, hdc)
-        r = color & 0xff
-        g = (color >> 8) & 0xff
-        b = (color >> 16) & 0xff
-        return (r, g, b)
-    else:
-        # Fallback to PIL
-        return ImageGrab.grab(bbox=(x, y, x+1, y+1)).getpixel((0, 0))
+            merged.extend(run)
+        run.clear()
+    for action in actions:
+        if (action['type'] == 'mouse_move' and action['min_x'] == action['max_x'] and action['min_y'] == action['max_y']
+                and action.get('min_delay', 0.0) == action.get('max_delay', 0.0) and not action.get('comment')):
+            run.append(action)
+        else:
+            flush()
+            merged.append(action)
+    flush()
+    return merged
+
+def format_points(points):
+    return '; '.join(f"{x},{y}" for x, y in points)
+
+def parse_points(text):
+    points = []
+    for part in text.split(';'):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            x, y = (int(v) for v in part.split(','))
+        except ValueError:
+            raise ValueError("Points must be 'x,y' pairs separated by semicolons.")
+        points.append([x, y])
+    return points
 
-# Global variables
 actions = []  # List to store recorded/edited actions
 start_time = None
 recording = False
@@ -175,12 +71,7 @@ selected_idx = None
 press_times = {}  # Track press times for timestamp
 capture_listener_kb = None
 capture_listener_mouse = None
-playback_active = False  # Track playback state
-playback_thread = None  # Track playback thread
 hotkey_listener = None  # Global hotkey listener
-pressed_items = []  # List of (controller, key_or_button)
-repeat_mode = "Loops"  # Default repeat mode
-repeat_value = 1.0  # Default repeat value (loops or minutes)
 prev_target = None
 potential_source = None
 drag_initiated = False
@@ -194,11 +85,26 @@ last_ts = None
 copied_actions = []  # Clipboard for copied actions
 drag_start_pos = None  # For detecting drag during clicks in recording
 drag_rect = None
-playback_event = threading.Event()  # For better interruptible sleep
 
-# Controllers
-kb_controller = KeyboardController()
-mouse_controller = MouseController()
+def on_engine_status(text):
+    root.after(0, lambda: update_status(text))
+
+def on_engine_end(result):
+    def show():
+        if result.reason == 'aborted' or result.reason == 'finished':
+            messagebox.showinfo(result.title, result.message)
+        elif result.reason == 'error':
+            messagebox.showerror(result.title, result.message)
+        update_status(result.status)
+        update_ui_for_playback()
+        if engine.region_trackers:
+            update_tree()
+    root.after(0, show)
+
+# Plays the macro (see engine.py): controllers, screen capture, path pool, latency profile and playback thread
+engine = PlaybackEngine(on_status=on_engine_status, on_end=on_engine_end)
+# Color picking has its own capture connection, so it never shares the playback thread's
+picker_capture = create_capture_backend()
 
 # Action types
 ACTION_TYPES = ['key_action', 'mouse_move', 'color_check', 'loop_start', 'loop_end', 'mouse_to_color', 'wait', 'if_color_start', 'else', 'if_end']
@@ -209,6 +115,9 @@ ON_FAIL_OPTIONS = ['continue', 'wait', 'abort', 'restart']
 # Selection modes for mouse_to_color
 SELECTION_MODES = ['random', 'closest', 'furthest']
 
+# Border margin modes for mouse_to_color: bounding box per axis or distance to the blob outline
+BORDER_MARGIN_MODES = ['box', 'distance']
+
 # Tooltip class for user-friendly hints (modified to use a fixed label at the bottom)
 class Tooltip:
     def __init__(self, widget, text):
@@ -234,6 +143,17 @@ def update_tree():
         tag = 'even' if idx % 2 == 0 else 'odd'
         tree.insert("", tk.END, iid=str(idx), values=(delay_str, action['type'], details, comment), tags=(tag,))
 
+def points_text(action):
+    points = action.get('points')
+    if points:
+        mode = action.get('point_mode', 'all')
+        if mode == 'at_least':
+            return f"at least {action.get('min_matches', 1)} of {len(points)} points"
+        return f"at {mode} of {len(points)} points"
+    if action.get('check_at_mouse', False):
+        return "at mouse"
+    return f"at ({action.get('x', 0)}, {action.get('y', 0)})"
+
 def get_action_details(action):
     if action['type'] == 'key_action':
         key = action.get('key', '')
@@ -247,7 +167,9 @@ def get_action_details(action):
         max_x = action.get('max_x', 0)
         min_y = action.get('min_y', 0)
         max_y = action.get('max_y', 0)
-        return f"Position: ({min_x}-{max_x}, {min_y}-{max_y})"
+        model = action.get('motion_model', 'windmouse')
+        model_str = f" model: {model}" if model != 'windmouse' else ""
+        return f"Position: ({min_x}-{max_x}, {min_y}-{max_y}){model_str}"
     elif action['type'] == 'color_check':
         colors = action.get('expected_colors', ['#000000'])
         color_str = ', '.join(colors)
@@ -256,12 +178,7 @@ def get_action_details(action):
         success_str = f" on_success_press: {on_success_press}" if on_success_press else ""
         tolerance = action.get('tolerance', 0)
         tol_str = f" tolerance: {tolerance}" if tolerance > 0 else ""
-        if action.get('check_at_mouse', False):
-            pos = "at mouse"
-        else:
-            x = action.get('x', 0)
-            y = action.get('y', 0)
-            pos = f"at ({x}, {y})"
+        pos = points_text(action)
         return f"Expected Colors: {color_str} {pos} on_fail: {on_fail}{success_str}{tol_str}"
     elif action['type'] == 'loop_start':
         name = action.get('name', '')
@@ -276,14 +193,34 @@ def get_action_details(action):
         color_str = ', '.join(colors)
         on_fail = action.get('on_fail', 'continue')
         border_margin = action.get('border_margin_percent', 20)
+        if action.get('border_margin_mode', 'box') != 'box':
+            border_margin = f"{border_margin}% ({action['border_margin_mode']})"
+        else:
+            border_margin = f"{border_margin}%"
         selection_mode = action.get('selection_mode', 'random')
         stationary_only = action.get('stationary_only', False)
         stat_str = " (stationary only)" if stationary_only else ""
+        if action.get('best_across_colors', False):
+            stat_str += " (best across colors)"
+        tolerance = action.get('tolerance', 0)
+        if tolerance > 0:
+            stat_str += f" tolerance: {tolerance}"
+        pyramid_min_size = action.get('pyramid_min_size', 0)
+        if pyramid_min_size > 0:
+            stat_str += f" pyramid: {pyramid_min_size}px"
+        if action.get('roi_tracking', False):
+            stat_str += " (roi tracking)"
+            tracker = engine.region_trackers.get(id(action))
+            if tracker is not None:
+                roi = tracker.stats()
+                stat_str += f" roi hits: {roi['hits']}/{roi['hits'] + roi['misses']}"
+        if action.get('motion_model', 'windmouse') != 'windmouse':
+            stat_str += f" model: {action['motion_model']}"
         min_x = action.get('min_x', 0)
         max_x = action.get('max_x', 0)
         min_y = action.get('min_y', 0)
         max_y = action.get('max_y', 0)
-        return f"Move to colors {color_str}{stat_str} in region ({min_x}-{max_x}, {min_y}-{max_y}) on_fail: {on_fail} border_margin: {border_margin}% selection_mode: {selection_mode}"
+        return f"Move to colors {color_str}{stat_str} in region ({min_x}-{max_x}, {min_y}-{max_y}) on_fail: {on_fail} border_margin: {border_margin} selection_mode: {selection_mode}"
     elif action['type'] == 'wait':
         min_d = action.get('min_delay', 0.0)
         max_d = action.get('max_delay', 0.0)
@@ -291,17 +228,17 @@ def get_action_details(action):
         return f"Wait {min_d:.3f}-{max_d:.3f}s then {on_end}"
     elif action['type'] == 'if_color_start':
         color = action.get('expected_color', '#000000')
-        if action.get('check_at_mouse', False):
-            pos = "at mouse"
-        else:
-            x = action.get('x', 0)
-            y = action.get('y', 0)
-            pos = f"at ({x}, {y})"
+        pos = points_text(action)
         return f"If Color: {color} {pos}"
     elif action['type'] == 'else':
         return "Else"
     elif action['type'] == 'if_end':
         return "End If"
+    elif action['type'] == 'trajectory':
+        points = action.get('trajectory', [])
+        if not points:
+            return "Trajectory: empty"
+        return f"Trajectory: {len(points)} points over {points[-1][0]:.2f} s, ({points[0][1]}, {points[0][2]}) -> ({points[-1][1]}, {points[-1][2]})"
     return ""
 
 def on_press(key):
@@ -433,7 +370,7 @@ def start_recording():
     if recording:
         messagebox.showwarning("Already Recording", "Recording is already in progress.")
         return
-    if playback_active:
+    if engine.active:
         messagebox.showwarning("Playback Active", "Cannot record while playback is running.")
         return
     if actions and messagebox.askyesno("Unsaved Actions", "Current actions will be cleared. Save first?"):
@@ -522,8 +459,33 @@ def stop_recording():
         # Remove timestamp
         for action in actions:
             del action['timestamp']
+        if not sparse_recording:
+            # Mouse motion events become trajectories played against their recorded times
+            actions[:] = merge_dense_moves(actions)
     update_tree()
 
+def merge_dense_moves_in_macro():
+    global actions
+    before = len(actions)
+    actions = merge_dense_moves(actions)
+    update_tree()
+    update_status(f"Merged {before - len(actions)} mouse moves into trajectories." if before != len(actions) else "No dense mouse moves to merge.")
+    clear_editor()
+
+def calibrate_input_latency():
+    if engine.active or recording:
+        messagebox.showwarning("Busy", "Stop playback or recording before calibrating.")
+        return
+    update_status("Calibrating input latency (the cursor jitters by a pixel and Shift is tapped)...")
+    root.update()
+    latency = engine.calibrate_latency()
+    try:
+        save_latency_profile(latency)
+    except OSError as e:
+        messagebox.showerror("Error", f"Failed to save latency profile: {e}")
+    update_status(f"Input latency of {latency.host}: move {latency.move_s * 1e6:.0f} us, position read {latency.read_s * 1e6:.0f} us, "
+                  f"press {latency.press_s * 1e6:.0f} us, release {latency.release_s * 1e6:.0f} us; expect timing within {latency.jitter_s * 1e3:.2f} ms per event.")
+
 def new_macro():
     global actions, current_filename
     if actions and messagebox.askyesno("Unsaved Changes", "Create new will clear current actions. Save first?"):
@@ -548,6 +510,11 @@ def load_macro():
         update_status("Macro loaded.")
     except Exception as e:
         messagebox.showerror("Error", f"Failed to load: {e}")
+        return
+    try:
+        compile_macro(actions)
+    except ValueError as e:
+        messagebox.showwarning("Invalid Macro", f"The macro loaded but cannot be played until this is fixed:\n{e}")
 
 def save_macro():
     global current_filename
@@ -561,61 +528,13 @@ def save_macro():
         current_filename = filename
         messagebox.showinfo("Saved", f"Macro saved to {filename}")
 
-def find_next_if_part(current_i, part):
-    level = 0
-    for j in range(current_i + 1, len(actions)):
-        a_type = actions[j]['type']
-        if a_type == 'if_color_start':
-            level += 1
-        elif a_type == 'if_end':
-            if level == 0:
-                if part == 'end':
-                    return j
-            level -= 1 if level > 0 else 0
-        elif a_type == 'else':
-            if level == 0 and part == 'else':
-                return j
-    return -1
-
-def perform_key_action(key, hold_min=0.001, hold_max=0.3):
-    items = []
-    def get_key(kstr):
-        if kstr.startswith('Key.'):
-            return Key.__dict__.get(kstr.split('.')[-1])
-        return kstr if len(kstr) == 1 else None  # Assume single char or Key
-    if key.startswith('mouse.'):
-        button_name = key[6:]
-        button = Button.__dict__.get(button_name)
-        items = [(mouse_controller, button)]
-    elif ' + ' in key:
-        modifier_str, main_key_str = key.split(' + ')
-        modifier = get_key(modifier_str)
-        main_key = get_key(main_key_str)
-        items = [(kb_controller, modifier), (kb_controller, main_key)]
-    else:
-        key_obj = get_key(key)
-        items = [(kb_controller, key_obj)]
-    for ctrl, itm in items:
-        if itm is not None:
-            ctrl.press(itm)
-            pressed_items.append((ctrl, itm))
-    hold_duration = random.uniform(hold_min, hold_max)
-    interruptible_sleep(hold_duration)
-    for ctrl, itm in reversed(items):
-        if itm is not None:
-            ctrl.release(itm)
-        if (ctrl, itm) in pressed_items:
-            pressed_items.remove((ctrl, itm))
-
 def playback_macro():
-    global playback_active, playback_thread, pressed_items, repeat_mode, repeat_value
     if not actions:
         messagebox.showwarning("No Actions", "No actions to playback.")
         return
     if recording:
         messagebox.showwarning("Recording Active", "Cannot play back while recording.")
         return
-    repeat_mode = mode_var.get()
     try:
         repeat_value = float(repeat_var.get())
         if repeat_value <= 0:
@@ -630,513 +549,66 @@ def playback_macro():
     except ValueError:
         messagebox.showerror("Invalid Speed", "Speed must be between 1 and 200.")
         return
-    time_multiplier = 100.0 / speed_perc
-    playback_active = True
-    playback_event.clear()
-    pressed_items = []
-    update_status("Playback starting in 3 seconds...")
-    root.update()
-    interruptible_sleep(3)
-    root.after(0, update_ui_for_playback)
-
-    def run_playback():
-        global playback_active
-        playback_start = time.time()
-        current_pos = mouse_controller.position
-        rep = 0
-        total_seconds = repeat_value * 60 if repeat_mode == "Minutes" else float('inf')
-        min_sec_per_px = 0.000500000001
-        max_sec_per_px = 0.000800000001
-        while playback_active:
-            loop_stack = []
-            i = 0
-            while i < len(actions) and playback_active:
-                if time.time() - playback_start >= total_seconds:
-                    break
-                action = actions[i]
-                delay = random.uniform(action.get('min_delay', 0.0), action.get('max_delay', 0.0)) * time_multiplier
-                interruptible_sleep(delay)
-                if not playback_active:
-                    break
-                if action['type'] == 'key_action':
-                    perform_key_action(action['key'])
-                elif action['type'] == 'mouse_move':
-                    min_x = action['min_x']
-                    max_x = action['max_x']
-                    min_y = action['min_y']
-                    max_y = action['max_y']
-                    cx, cy = current_pos
-                    if min_x <= cx <= max_x and min_y <= cy <= max_y:
-                        dest_x = cx
-                        dest_y = cy
-                    else:
-                        dest_x = random.uniform(min_x, max_x)
-                        dest_y = random.uniform(min_y, max_y)
-                    dist = np.hypot(dest_x - current_pos[0], dest_y - current_pos[1])
-                    if dist > 0:
-                        max_possible_sec_per_px = delay / dist if dist > 0 else 0
-                        if max_possible_sec_per_px >= min_sec_per_px:
-                            low = min_sec_per_px
-                            high = min(max_sec_per_px, max_possible_sec_per_px)
-                            sec_per_px = random.uniform(low, high)
-                            move_time = dist * sec_per_px
-                            total_pause = delay - move_time
-                            pause_before = random.uniform(0, total_pause)
-                            pause_after = total_pause - pause_before
-                        else:
-                            move_time = delay
-                            pause_before = 0
-                            pause_after = 0
-                        interruptible_sleep(pause_before)
-                        if not playback_active:
-                            break
-                        human_move(current_pos[0], current_pos[1], dest_x, dest_y, move_time)
-                        interruptible_sleep(pause_after)
-                    else:
-                        interruptible_sleep(delay)
-                    current_pos = mouse_controller.position  # Update after move
-                elif action['type'] == 'color_check':
-                    if action.get('check_at_mouse', False):
-                        x, y = mouse_controller.position
-                    else:
-                        x = action.get('x', 0)
-                        y = action.get('y', 0)
-                    expected_colors = action.get('expected_colors', [action.get('expected_color', '#000000')])
-                    expected_rgb_list = [tuple(int(hex_color[j:j+2], 16) for j in (1, 3, 5)) for hex_color in expected_colors]
-                    tolerance = action.get('tolerance', 0)
-
-                    def colors_close(c1, c2, tol):
-                        return sum((a - b) ** 2 for a, b in zip(c1, c2)) ** 0.5 <= tol
-
-                    actual_color = get_pixel_color(x, y)
-                    match = any(colors_close(actual_color, expected, tolerance) for expected in expected_rgb_list)
-                    if match:
-                        # Re-check immediately before action for accuracy
-                        actual_color = get_pixel_color(x, y)  # Near-instant second grab
-                        match = any(colors_close(actual_color, expected, tolerance) for expected in expected_rgb_list)
-                        if match:
-                            on_success_press = action.get('on_success_press', None)
-                            if on_success_press:
-                                hold_min_ms = action.get('hold_min_ms', 1)
-                                hold_max_ms = action.get('hold_max_ms', 10)
-                                hold_min = hold_min_ms / 1000.0
-                                hold_max = hold_max_ms / 1000.0
-                                perform_key_action(on_success_press, hold_min=hold_min, hold_max=hold_max)
-                        else:
-                            # Optional: Brief retry loop (e.g., 3 attempts over 100ms)
-                            for _ in range(3):
-                                interruptible_sleep(0.03)
-                                actual_color = get_pixel_color(x, y)
-                                match = any(colors_close(actual_color, expected, tolerance) for expected in expected_rgb_list)
-                                if match:
-                                    on_success_press = action.get('on_success_press', None)
-                                    if on_success_press:
-                                        hold_min_ms = action.get('hold_min_ms', 1)
-                                        hold_max_ms = action.get('hold_max_ms', 10)
-                                        hold_min = hold_min_ms / 1000.0
-                                        hold_max = hold_max_ms / 1000.0
-                                        perform_key_action(on_success_press, hold_min=hold_min, hold_max=hold_max)
-                                    break
-                            else:
-                                # Handle as fail
-                                on_fail = action.get('on_fail', 'abort')
-                                if on_fail == 'continue':
-                                    pass
-                                elif on_fail == 'wait':
-                                    root.after(0, lambda: update_status("Waiting for color match..."))
-                                    while playback_active:
-                                        actual_color = get_pixel_color(x, y)
-                                        match = any(colors_close(actual_color, expected, tolerance) for expected in expected_rgb_list)
-                                        if match:
-                                            on_success_press = action.get('on_success_press', None)
-                                            if on_success_press:
-                                                hold_min_ms = action.get('hold_min_ms', 1)
-                                                hold_max_ms = action.get('hold_max_ms', 10)
-                                                hold_min = hold_min_ms / 1000.0
-                                                hold_max = hold_max_ms / 1000.0
-                                                perform_key_action(on_success_press, hold_min=hold_min, hold_max=hold_max)
-                                            break
-                                        interruptible_sleep(0.1)
-                                    if not playback_active:
-                                        break
-                                elif on_fail == 'abort':
-                                    playback_active = False
-                                    root.after(0, lambda: messagebox.showinfo("Color Mismatch", "Color check failed. Playback stopped."))
-                                    root.after(0, lambda: update_status("Playback stopped due to color mismatch."))
-                                    root.after(0, update_ui_for_playback)
-                                    break
-                                elif on_fail == 'restart':
-                                    loop_stack = []
-                                    i = 0
-                                    continue
-                    else:
-                        on_fail = action.get('on_fail', 'abort')
-                        if on_fail == 'continue':
-                            pass
-                        elif on_fail == 'wait':
-                            root.after(0, lambda: update_status("Waiting for color match..."))
-                            while playback_active:
-                                actual_color = get_pixel_color(x, y)
-                                match = any(colors_close(actual_color, expected, tolerance) for expected in expected_rgb_list)
-                                if match:
-                                    on_success_press = action.get('on_success_press', None)
-                                    if on_success_press:
-                                        hold_min_ms = action.get('hold_min_ms', 1)
-                                        hold_max_ms = action.get('hold_max_ms', 10)
-                                        hold_min = hold_min_ms / 1000.0
-                                        hold_max = hold_max_ms / 1000.0
-                                        perform_key_action(on_success_press, hold_min=hold_min, hold_max=hold_max)
-                                    break
-                                interruptible_sleep(0.1)
-                            if not playback_active:
-                                break
-                        elif on_fail == 'abort':
-                            playback_active = False
-                            root.after(0, lambda: messagebox.showinfo("Color Mismatch", "Color check failed. Playback stopped."))
-                            root.after(0, lambda: update_status("Playback stopped due to color mismatch."))
-                            root.after(0, update_ui_for_playback)
-                            break
-                        elif on_fail == 'restart':
-                            loop_stack = []
-                            i = 0
-                            continue
-                elif action['type'] == 'mouse_to_color':
-                    min_x = action.get('min_x', 0)
-                    max_x = action.get('max_x', 1920)
-                    min_y = action.get('min_y', 0)
-                    max_y = action.get('max_y', 1080)
-                    bbox = (min_x, min_y, max_x, max_y)
-                    stationary_only = action.get('stationary_only', False)
-                    if stationary_only:
-                        im1 = ImageGrab.grab(bbox=bbox)
-                        interruptible_sleep(0.1)
-                        if not playback_active:
-                            break
-                        im2 = ImageGrab.grab(bbox=bbox)
-                    else:
-                        im1 = ImageGrab.grab(bbox=bbox)
-                        im2 = None
-                    width, height = im1.size
-                    arr1 = np.array(im1)
-                    arr2 = np.array(im2) if im2 else None
-                    matching = []
-                    for hex_color in action.get('expected_colors', ['#ffffff']):
-                        expected = tuple(int(hex_color[j:j+2], 16) for j in (1, 3, 5))
-                        mask1 = np.all(arr1 == expected, axis=-1)
-                        labeled1, num_features = ndimage.label(mask1)
-                        if num_features == 0:
-                            continue
-                        stationary_labels = []
-                        if stationary_only:
-                            mask2 = np.all(arr2 == expected, axis=-1)
-                            labeled2, num2 = ndimage.label(mask2)
-                            for lbl in range(1, num_features + 1):
-                                comp_mask1 = (labeled1 == lbl)
-                                size1 = np.sum(comp_mask1)
-                                overlap_sum = np.sum(comp_mask1 & mask2)
-                                overlap = overlap_sum / size1 if size1 > 0 else 0
-                                if overlap == 1.0:
-                                    overlapping_labels = np.unique(labeled2[comp_mask1])
-                                    overlapping_labels = overlapping_labels[overlapping_labels > 0]
-                                    if overlapping_labels.size > 0:
-                                        overlaps = [np.sum(comp_mask1 & (labeled2 == l2)) for l2 in overlapping_labels]
-                                        max_ol_idx = np.argmax(overlaps)
-                                        l2_max = overlapping_labels[max_ol_idx]
-                                        size2 = np.sum(labeled2 == l2_max)
-                                        if size1 == size2:
-                                            com1 = ndimage.center_of_mass(comp_mask1)
-                                            com2 = ndimage.center_of_mass(labeled2 == l2_max)
-                                            dist = np.hypot(com1[0] - com2[0], com1[1] - com2[1])
-                                            if dist == 0:
-                                                stationary_labels.append(lbl)
-                        else:
-                            stationary_labels = list(range(1, num_features + 1))
-                        if not stationary_labels:
-                            continue
-                        valid_labels = stationary_labels
-                        mode = action.get('selection_mode', 'random')
-                        cx, cy = current_pos
-                        rel_cx = cx - min_x
-                        rel_cy = cy - min_y
-                        if mode in ['closest', 'furthest']:
-                            centers = []
-                            for lbl in valid_labels:
-                                ys, xs = np.where(labeled1 == lbl)
-                                mean_x = np.mean(xs)
-                                mean_y = np.mean(ys)
-                                dist = np.hypot(mean_x - rel_cx, mean_y - rel_cy)
-                                centers.append((lbl, dist))
-                            if not centers:
-                                continue
-                            if mode == 'closest':
-                                chosen_lbl = min(centers, key=lambda cd: cd[1])[0]
-                            else:
-                                chosen_lbl = max(centers, key=lambda cd: cd[1])[0]
-                        else:
-                            chosen_lbl = random.choice(valid_labels)
-                        ys, xs = np.where(labeled1 == chosen_lbl)
-                        matching = [(min_x + int(x), min_y + int(y)) for x, y in zip(xs, ys)]
-                        if matching:
-                            break
-                    if not matching:
-                        on_fail = action.get('on_fail', 'continue')
-                        if on_fail == 'continue':
-                            update_status("Color not found in region, continuing.")
-                            i += 1
-                            continue
-                        elif on_fail == 'wait':
-                            root.after(0, lambda: update_status("Waiting for color in region..."))
-                            while playback_active:
-                                if stationary_only:
-                                    im1 = ImageGrab.grab(bbox=bbox)
-                                    interruptible_sleep(0.1)
-                                    if not playback_active:
-                                        break
-                                    im2 = ImageGrab.grab(bbox=bbox)
-                                else:
-                                    im1 = ImageGrab.grab(bbox=bbox)
-                                    im2 = None
-                                arr1 = np.array(im1)
-                                arr2 = np.array(im2) if im2 else None
-                                matching = []
-                                for hex_color in action.get('expected_colors', ['#ffffff']):
-                                    expected = tuple(int(hex_color[j:j+2], 16) for j in (1, 3, 5))
-                                    mask1 = np.all(arr1 == expected, axis=-1)
-                                    labeled1, num_features = ndimage.label(mask1)
-                                    if num_features == 0:
-                                        continue
-                                    stationary_labels = []
-                                    if stationary_only:
-                                        mask2 = np.all(arr2 == expected, axis=-1)
-                                        labeled2, num2 = ndimage.label(mask2)
-                                        for lbl in range(1, num_features + 1):
-                                            comp_mask1 = (labeled1 == lbl)
-                                            size1 = np.sum(comp_mask1)
-                                            overlap_sum = np.sum(comp_mask1 & mask2)
-                                            overlap = overlap_sum / size1 if size1 > 0 else 0
-                                            if overlap == 1.0:
-                                                overlapping_labels = np.unique(labeled2[comp_mask1])
-                                                overlapping_labels = overlapping_labels[overlapping_labels > 0]
-                                                if overlapping_labels.size > 0:
-                                                    overlaps = [np.sum(comp_mask1 & (labeled2 == l2)) for l2 in overlapping_labels]
-                                                    max_ol_idx = np.argmax(overlaps)
-                                                    l2_max = overlapping_labels[max_ol_idx]
-                                                    size2 = np.sum(labeled2 == l2_max)
-                                                    if size1 == size2:
-                                                        com1 = ndimage.center_of_mass(comp_mask1)
-                                                        com2 = ndimage.center_of_mass(labeled2 == l2_max)
-                                                        dist = np.hypot(com1[0] - com2[0], com1[1] - com2[1])
-                                                        if dist == 0:
-                                                            stationary_labels.append(lbl)
-                                    else:
-                                        stationary_labels = list(range(1, num_features + 1))
-                                    if not stationary_labels:
-                                        continue
-                                    valid_labels = stationary_labels
-                                    mode = action.get('selection_mode', 'random')
-                                    rel_cx = mouse_controller.position[0] - min_x
-                                    rel_cy = mouse_controller.position[1] - min_y
-                                    if mode in ['closest', 'furthest']:
-                                        centers = []
-                                        for lbl in valid_labels:
-                                            ys, xs = np.where(labeled1 == lbl)
-                                            mean_x = np.mean(xs)
-                                            mean_y = np.mean(ys)
-                                            dist = np.hypot(mean_x - rel_cx, mean_y - rel_cy)
-                                            centers.append((lbl, dist))
-                                        if not centers:
-                                            continue
-                                        if mode == 'closest':
-                                            chosen_lbl = min(centers, key=lambda cd: cd[1])[0]
-                                        else:
-                                            chosen_lbl = max(centers, key=lambda cd: cd[1])[0]
-                                    else:
-                                        chosen_lbl = random.choice(valid_labels)
-                                    ys, xs = np.where(labeled1 == chosen_lbl)
-                                    matching = [(min_x + int(x), min_y + int(y)) for x, y in zip(xs, ys)]
-                                    if matching:
-                                        break
-                                if matching:
-                                    break
-                                interruptible_sleep(0.1)
-                            if not playback_active:
-                                break
-                        elif on_fail == 'abort':
-                            playback_active = False
-                            root.after(0, lambda: messagebox.showinfo("Color Not Found", "Color not found in region. Playback stopped."))
-                            root.after(0, lambda: update_status("Playback stopped due to color not found."))
-                            root.after(0, update_ui_for_playback)
-                            break
-                        elif on_fail == 'restart':
-                            loop_stack = []
-                            i = 0
-                            continue
-                    # Apply border margin to (possibly chosen) matching pixels
-                    if matching:
-                        all_x = [p[0] for p in matching]
-                        all_y = [p[1] for p in matching]
-                        comp_min_x = min(all_x)
-                        comp_max_x = max(all_x)
-                        comp_min_y = min(all_y)
-                        comp_max_y = max(all_y)
-                        comp_width = comp_max_x - comp_min_x + 1
-                        comp_height = comp_max_y - comp_min_y + 1
-                        comp_center_x = (comp_min_x + comp_max_x) / 2
-                        comp_center_y = (comp_min_y + comp_max_y) / 2
-                        border_margin_percent = action.get('border_margin_percent', 20)
-                        percent = border_margin_percent / 100.0
-                        threshold = min(1.0, 2 * percent)  # Fixed to match expected margin
-                        if threshold == 1.0:  # Equivalent to old special case for 50%
-                            # Pick closest to center
-                            distances = [(np.hypot(x - comp_center_x, y - comp_center_y), (x, y)) for x, y in matching]
-                            dest_x, dest_y = min(distances, key=lambda d: d[0])[1]
-                        else:
-                            # Collect points meeting the threshold
-                            inner_matching = []
-                            for x, y in matching:
-                                dist_x = min(x - comp_min_x, comp_max_x - x)
-                                dist_y = min(y - comp_min_y, comp_max_y - y)
-                                norm_x = (2 * dist_x / comp_width) if comp_width > 0 else 0.0
-                                norm_y = (2 * dist_y / comp_height) if comp_height > 0 else 0.0
-                                min_norm = min(norm_x, norm_y)
-                                if min_norm >= threshold:
-                                    inner_matching.append((x, y))
-
-                            if inner_matching:
-                                dest_x, dest_y = random.choice(inner_matching)
-                            else:
-                                # Fallback: Find max achievable min_norm and pick random from those points
-                                max_min_norm = -1.0
-                                candidates = []
-                                for x, y in matching:
-                                    dist_x = min(x - comp_min_x, comp_max_x - x)
-                                    dist_y = min(y - comp_min_y, comp_max_y - y)
-                                    norm_x = (2 * dist_x / comp_width) if comp_width > 0 else 0.0
-                                    norm_y = (2 * dist_y / comp_height) if comp_height > 0 else 0.0
-                                    min_norm = min(norm_x, norm_y)
-                                    if min_norm > max_min_norm:
-                                        max_min_norm = min_norm
-                                        candidates = [(x, y)]
-                                    elif min_norm == max_min_norm:
-                                        candidates.append((x, y))
-                                if candidates:
-                                    dest_x, dest_y = random.choice(candidates)
-                                else:
-                                    # Rare edge case: no points (shouldn't happen if matching non-empty)
-                                    dest_x, dest_y = random.choice(matching)
-                    move_duration = random.uniform(action.get('min_move_delay', 0.2), action.get('max_move_delay', 0.5)) * time_multiplier
-                    human_move(current_pos[0], current_pos[1], dest_x, dest_y, move_duration)
-                    current_pos = mouse_controller.position
-                elif action['type'] == 'loop_start':
-                    loops = random.randint(action.get('min_loops', 1), action.get('max_loops', 1))
-                    loop_stack.append({'start': i, 'remaining': loops, 'name': action.get('name', '')})
-                elif action['type'] == 'loop_end':
-                    if not loop_stack or loop_stack[-1]['name'] != action.get('name', ''):
-                        playback_active = False
-                        root.after(0, lambda: update_status("Mismatched loop names. Playback stopped."))
-                        root.after(0, update_ui_for_playback)
-                        break
-                    current_loop = loop_stack[-1]
-                    if current_loop['remaining'] > 1:
-                        current_loop['remaining'] -= 1
-                        i = current_loop['start']
-                    else:
-                        loop_stack.pop()
-                elif action['type'] == 'wait':
-                    interruptible_sleep(delay)
-                    if not playback_active:
-                        break
-                    on_end = action.get('on_end', 'continue')
-                    if on_end == 'continue':
-                        pass
-                    elif on_end == 'abort':
-                        playback_active = False
-                        root.after(0, lambda: messagebox.showinfo("Wait Ended", "Wait completed. Playback aborted."))
-                        root.after(0, lambda: update_status("Playback aborted after wait."))
-                        root.after(0, update_ui_for_playback)
-                        break
-                    elif on_end == 'restart':
-                        loop_stack = []
-                        i = 0
-                        continue
-                    elif on_end == 'wait':
-                        root.after(0, lambda: update_status("Infinite wait started. Stop manually."))
-                        while playback_active:
-                            interruptible_sleep(0.1)  # Check every 0.1s to allow stop
-                elif action['type'] == 'if_color_start':
-                    if action.get('check_at_mouse', False):
-                        x, y = mouse_controller.position
-                    else:
-                        x = action.get('x', 0)
-                        y = action.get('y', 0)
-                    expected_hex = action.get('expected_color')
-                    expected = tuple(int(expected_hex[j:j+2], 16) for j in (1, 3, 5))
-                    # Optimized: Grab single pixel bbox for faster capture
-                    actual_color = get_pixel_color(x, y)
-                    condition = actual_color == expected
-                    if not condition:
-                        else_i = find_next_if_part(i, 'else')
-                        if else_i != -1:
-                            i = else_i
-                        else:
-                            end_i = find_next_if_part(i, 'end')
-                            if end_i != -1:
-                                i = end_i
-                elif action['type'] == 'else':
-                    end_i = find_next_if_part(i, 'end')
-                    if end_i != -1:
-                        i = end_i
-                elif action['type'] == 'if_end':
-                    pass  # just marker
-                i += 1
-            rep += 1
-            if repeat_mode == "Loops" and rep >= repeat_value:
-                break
-            if time.time() - playback_start >= total_seconds:
-                break
-        if playback_active:
-            playback_active = False
-            root.after(0, lambda: messagebox.showinfo("Finished", "Playback finished."))
-            root.after(0, lambda: update_status("Ready"))
-            root.after(0, update_ui_for_playback)
-        pressed_items.clear()
-
-    playback_thread = threading.Thread(target=run_playback)
-    playback_thread.daemon = True
-    playback_thread.start()
+    try:
+        frame_cache_ms = float(frame_cache_var.get())
+        if frame_cache_ms < 0:
+            raise ValueError
+    except ValueError:
+        messagebox.showerror("Invalid Frame Cache", "Frame cache age must be 0 (off) or a positive number of milliseconds.")
+        return
+    try:
+        rate_hz = float(mouse_rate_var.get())
+        if rate_hz < 0:
+            raise ValueError
+    except ValueError:
+        messagebox.showerror("Invalid Mouse Rate", "Mouse rate must be 0 (no limit) or a positive number of updates per second.")
+        return
+    try:
+        seed_text = seed_var.get().strip()
+        seed = int(seed_text) if seed_text else None
+        if seed is not None and seed < 0:
+            raise ValueError
+    except ValueError:
+        messagebox.showerror("Invalid Seed", "Seed must be empty (random) or a non-negative whole number.")
+        return
+    config = PlaybackConfig(mode_var.get(), repeat_value, speed_perc, seed, frame_cache_ms, rate_hz, start_delay=3.0)
+    try:
+        engine.start(actions, config)
+    except ValueError as e:
+        messagebox.showerror("Invalid Macro", str(e))
+        return
+    update_ui_for_playback()
 
 def stop_playback():
-    global playback_active, pressed_items
-    if playback_active:
-        playback_active = False
-        playback_event.set()
-        for controller, item in pressed_items:
-            controller.release(item)
-        pressed_items.clear()
+    if engine.stop():
         update_status("Playback stopped.")
-        if playback_thread and playback_thread.is_alive():
-            playback_thread.join(timeout=1.0)
         root.after(0, update_ui_for_playback)
 
 def toggle_playback():
-    if playback_active:
+    if engine.active:
         stop_playback()
     else:
         playback_macro()
 
 def update_ui_for_playback():
-    if playback_active:
+    if engine.active:
         start_stop_btn.config(text="Stop (F1)", style='RedButton.TButton')
         record_btn.config(state=tk.DISABLED)
         repeat_entry.config(state=tk.DISABLED)
         mode_combo.config(state=tk.DISABLED)
         save_btn.config(state=tk.DISABLED)
+        frame_cache_entry.config(state=tk.DISABLED)
+        seed_entry.config(state=tk.DISABLED)
+        mouse_rate_combo.config(state=tk.DISABLED)
     else:
         start_stop_btn.config(text="Start (F1)", style='GreenButton.TButton')
         record_btn.config(state=tk.NORMAL)
         repeat_entry.config(state='normal')
         mode_combo.config(state='readonly')
         save_btn.config(state=tk.NORMAL)
+        frame_cache_entry.config(state='normal')
+        seed_entry.config(state='normal')
+        mouse_rate_combo.config(state='normal')
 
 def hotkey_f1():
     try:
@@ -1163,6 +635,7 @@ def insert_action(action_type, after_iid=None):
         new_action['max_x'] = 0
         new_action['min_y'] = 0
         new_action['max_y'] = 0
+        new_action['motion_model'] = 'windmouse'
     elif action_type == 'color_check':
         new_action['expected_colors'] = ['#ffffff']  # Default white
         new_action['x'] = 0  # Add default x
@@ -1172,6 +645,9 @@ def insert_action(action_type, after_iid=None):
         new_action['tolerance'] = 0
         new_action['hold_min_ms'] = 1
         new_action['hold_max_ms'] = 10
+        new_action['points'] = []
+        new_action['point_mode'] = 'all'
+        new_action['min_matches'] = 1
     elif action_type == 'loop_start':
         new_action['name'] = 'loop1'
         new_action['min_loops'] = 1
@@ -1188,8 +664,14 @@ def insert_action(action_type, after_iid=None):
         new_action['max_move_delay'] = 0.5
         new_action['on_fail'] = 'continue'
         new_action['border_margin_percent'] = 20
+        new_action['border_margin_mode'] = 'box'
         new_action['selection_mode'] = 'random'
         new_action['stationary_only'] = False
+        new_action['best_across_colors'] = False
+        new_action['tolerance'] = 0
+        new_action['pyramid_min_size'] = 0
+        new_action['roi_tracking'] = False
+        new_action['motion_model'] = 'windmouse'
     elif action_type == 'wait':
         new_action['on_end'] = 'continue'
     elif action_type == 'if_color_start':
@@ -1197,6 +679,9 @@ def insert_action(action_type, after_iid=None):
         new_action['x'] = 0
         new_action['y'] = 0
         new_action['check_at_mouse'] = False
+        new_action['points'] = []
+        new_action['point_mode'] = 'all'
+        new_action['min_matches'] = 1
     elif action_type in ['else', 'if_end']:
         pass
     
@@ -1341,15 +826,32 @@ def populate_editor(action):
     max_move_delay_entry.grid_remove()
     border_margin_label.grid_remove()
     border_margin_entry.grid_remove()
+    border_margin_mode_label.grid_remove()
+    border_margin_mode_combo.grid_remove()
     selection_mode_label.grid_remove()
     selection_mode_combo.grid_remove()
     stationary_only_label.grid_remove()
     stationary_only_check.grid_remove()
+    best_across_colors_label.grid_remove()
+    best_across_colors_check.grid_remove()
     on_success_press_label.grid_remove()
     on_success_press_entry.grid_remove()
     on_success_capture_btn.grid_remove()
     tolerance_label.grid_remove()
     tolerance_entry.grid_remove()
+    pyramid_min_size_label.grid_remove()
+    pyramid_min_size_entry.grid_remove()
+    roi_tracking_label.grid_remove()
+    roi_tracking_check.grid_remove()
+    motion_model_label.grid_remove()
+    motion_model_combo.grid_remove()
+    points_label.grid_remove()
+    points_entry.grid_remove()
+    add_point_btn.grid_remove()
+    point_mode_label.grid_remove()
+    point_mode_combo.grid_remove()
+    min_matches_label.grid_remove()
+    min_matches_entry.grid_remove()
     hold_min_ms_label.grid_remove()
     hold_min_ms_entry.grid_remove()
     hold_max_ms_label.grid_remove()
@@ -1379,6 +881,7 @@ def populate_editor(action):
         max_x_var.set(str(action.get('max_x', 0)))
         min_y_var.set(str(action.get('min_y', 0)))
         max_y_var.set(str(action.get('max_y', 0)))
+        motion_model_var.set(action.get('motion_model', 'windmouse'))
         min_x_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         min_x_entry.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
         max_x_label.grid(row=next_row, column=2, padx=5, pady=5, sticky=tk.E)
@@ -1395,6 +898,10 @@ def populate_editor(action):
         max_y_entry.config(state='normal')
         capture_zone_btn.config(state='normal')
         next_row += 1
+        motion_model_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
+        motion_model_combo.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
+        motion_model_combo.config(state='readonly')
+        next_row += 1
     elif action['type'] == 'color_check':
         hex_var.set(', '.join(action.get('expected_colors', [action.get('expected_color', '#ffffff')])))
         check_x_var.set(str(action.get('x', 0)))
@@ -1405,6 +912,9 @@ def populate_editor(action):
         tolerance_var.set(str(action.get('tolerance', 0)))
         hold_min_ms_var.set(str(action.get('hold_min_ms', 1)))
         hold_max_ms_var.set(str(action.get('hold_max_ms', 10)))
+        points_var.set(format_points(action.get('points', [])))
+        point_mode_var.set(action.get('point_mode', 'all'))
+        min_matches_var.set(str(action.get('min_matches', 1)))
         hex_label.config(text="Hex Colors (comma sep):")
         hex_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         hex_entry.grid(row=next_row, column=1, columnspan=3, padx=5, pady=5, sticky=tk.W)
@@ -1424,6 +934,19 @@ def populate_editor(action):
         check_at_mouse_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         check_at_mouse_check.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
         next_row += 1
+        points_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
+        points_entry.grid(row=next_row, column=1, columnspan=3, padx=5, pady=5, sticky=tk.W)
+        add_point_btn.grid(row=next_row, column=4, padx=5, pady=5)
+        points_entry.config(state='normal')
+        add_point_btn.config(state='normal')
+        next_row += 1
+        point_mode_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
+        point_mode_combo.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
+        point_mode_combo.config(state='readonly')
+        min_matches_label.grid(row=next_row, column=2, padx=5, pady=5, sticky=tk.E)
+        min_matches_entry.grid(row=next_row, column=3, padx=5, pady=5, sticky=tk.W)
+        min_matches_entry.config(state='normal')
+        next_row += 1
         on_fail_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         on_fail_combo.grid(row=next_row, column=1, columnspan=3, padx=5, pady=5, sticky=tk.W)
         on_fail_combo.config(state='readonly')
@@ -1451,6 +974,9 @@ def populate_editor(action):
         check_x_var.set(str(action.get('x', 0)))
         check_y_var.set(str(action.get('y', 0)))
         check_at_mouse_var.set(action.get('check_at_mouse', False))
+        points_var.set(format_points(action.get('points', [])))
+        point_mode_var.set(action.get('point_mode', 'all'))
+        min_matches_var.set(str(action.get('min_matches', 1)))
         hex_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         hex_entry.grid(row=next_row, column=1, columnspan=3, padx=5, pady=5, sticky=tk.W)
         capture_on_click_btn.grid(row=next_row, column=4, padx=5, pady=5)
@@ -1469,6 +995,19 @@ def populate_editor(action):
         check_at_mouse_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         check_at_mouse_check.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
         next_row += 1
+        points_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
+        points_entry.grid(row=next_row, column=1, columnspan=3, padx=5, pady=5, sticky=tk.W)
+        add_point_btn.grid(row=next_row, column=4, padx=5, pady=5)
+        points_entry.config(state='normal')
+        add_point_btn.config(state='normal')
+        next_row += 1
+        point_mode_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
+        point_mode_combo.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
+        point_mode_combo.config(state='readonly')
+        min_matches_label.grid(row=next_row, column=2, padx=5, pady=5, sticky=tk.E)
+        min_matches_entry.grid(row=next_row, column=3, padx=5, pady=5, sticky=tk.W)
+        min_matches_entry.config(state='normal')
+        next_row += 1
         toggle_coord_state()  # Apply initial state based on checkbox
     elif action['type'] == 'mouse_to_color':
         hex_var.set(', '.join(action.get('expected_colors', ['#ffffff'])))
@@ -1480,8 +1019,14 @@ def populate_editor(action):
         max_move_delay_var.set(f"{action.get('max_move_delay', 0.5):.3f}")
         on_fail_var.set(action.get('on_fail', 'continue'))
         border_margin_var.set(str(action.get('border_margin_percent', 20)))
+        border_margin_mode_var.set(action.get('border_margin_mode', 'box'))
         selection_mode_var.set(action.get('selection_mode', 'random'))
         stationary_only_var.set(action.get('stationary_only', False))
+        best_across_colors_var.set(action.get('best_across_colors', False))
+        tolerance_var.set(str(action.get('tolerance', 0)))
+        pyramid_min_size_var.set(str(action.get('pyramid_min_size', 0)))
+        roi_tracking_var.set(action.get('roi_tracking', False))
+        motion_model_var.set(action.get('motion_model', 'windmouse'))
         hex_label.config(text="Hex Colors (comma sep):")
         hex_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         hex_entry.grid(row=next_row, column=1, columnspan=3, padx=5, pady=5, sticky=tk.W)
@@ -1509,6 +1054,9 @@ def populate_editor(action):
         next_row += 1
         border_margin_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         border_margin_entry.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
+        border_margin_mode_label.grid(row=next_row, column=2, padx=5, pady=5, sticky=tk.E)
+        border_margin_mode_combo.grid(row=next_row, column=3, padx=5, pady=5, sticky=tk.W)
+        border_margin_mode_combo.config(state='readonly')
         next_row += 1
         selection_mode_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         selection_mode_combo.grid(row=next_row, column=1, columnspan=3, padx=5, pady=5, sticky=tk.W)
@@ -1516,6 +1064,22 @@ def populate_editor(action):
         next_row += 1
         stationary_only_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
         stationary_only_check.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
+        best_across_colors_label.grid(row=next_row, column=2, padx=5, pady=5, sticky=tk.E)
+        best_across_colors_check.grid(row=next_row, column=3, padx=5, pady=5, sticky=tk.W)
+        next_row += 1
+        tolerance_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
+        tolerance_entry.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
+        tolerance_entry.config(state='normal')
+        pyramid_min_size_label.grid(row=next_row, column=2, padx=5, pady=5, sticky=tk.E)
+        pyramid_min_size_entry.grid(row=next_row, column=3, padx=5, pady=5, sticky=tk.W)
+        pyramid_min_size_entry.config(state='normal')
+        next_row += 1
+        roi_tracking_label.grid(row=next_row, column=0, padx=5, pady=5, sticky=tk.E)
+        roi_tracking_check.grid(row=next_row, column=1, padx=5, pady=5, sticky=tk.W)
+        toggle_roi_state()
+        motion_model_label.grid(row=next_row, column=2, padx=5, pady=5, sticky=tk.E)
+        motion_model_combo.grid(row=next_row, column=3, padx=5, pady=5, sticky=tk.W)
+        motion_model_combo.config(state='readonly')
         next_row += 1
         hex_entry.config(state='normal')
         capture_on_click_btn.config(state='normal')
@@ -1528,6 +1092,7 @@ def populate_editor(action):
         max_move_delay_entry.config(state='normal')
         border_margin_entry.config(state='normal')
         stationary_only_check.config(state='normal')
+        best_across_colors_check.config(state='normal')
         next_row += 1
     elif action['type'] == 'loop_start':
         loop_name_var.set(action.get('name', 'loop1'))
@@ -1575,6 +1140,14 @@ def toggle_coord_state(*args):
     check_y_entry.config(state=state)
     capture_at_coord_btn.config(state=state)
 
+def toggle_roi_state(*args):
+    # The pyramid search is never windowed, so ROI tracking only applies with pyramid min size 0
+    try:
+        pyramid_min_size = int(pyramid_min_size_var.get() or 0)
+    except ValueError:
+        pyramid_min_size = 0
+    roi_tracking_check.config(state='disabled' if pyramid_min_size > 0 else 'normal')
+
 def populate_batch(remove=False):
     if remove:
         delta_min_label.grid_remove()
@@ -1612,10 +1185,18 @@ def clear_editor():
     on_fail_var.set('')
     check_at_mouse_var.set(False)
     border_margin_var.set('')
+    border_margin_mode_var.set('')
     selection_mode_var.set('')
     stationary_only_var.set(False)
+    best_across_colors_var.set(False)
     on_success_press_var.set('')
     tolerance_var.set('')
+    pyramid_min_size_var.set('')
+    roi_tracking_var.set(False)
+    motion_model_var.set('')
+    points_var.set('')
+    point_mode_var.set('')
+    min_matches_var.set('')
     hold_min_ms_var.set('')
     hold_max_ms_var.set('')
     min_delay_entry.config(state='disabled')
@@ -1642,11 +1223,20 @@ def clear_editor():
     capture_at_coord_btn.config(state='disabled')
     save_btn.config(state='disabled')
     border_margin_entry.config(state='disabled')
+    border_margin_mode_combo.config(state='disabled')
     selection_mode_combo.config(state='disabled')
     stationary_only_check.config(state='disabled')
+    best_across_colors_check.config(state='disabled')
     on_success_press_entry.config(state='disabled')
     on_success_capture_btn.config(state='disabled')
     tolerance_entry.config(state='disabled')
+    pyramid_min_size_entry.config(state='disabled')
+    roi_tracking_check.config(state='disabled')
+    motion_model_combo.config(state='disabled')
+    points_entry.config(state='disabled')
+    add_point_btn.config(state='disabled')
+    point_mode_combo.config(state='disabled')
+    min_matches_entry.config(state='disabled')
     hold_min_ms_entry.config(state='disabled')
     hold_max_ms_entry.config(state='disabled')
     # Hide type-specific widgets
@@ -1688,10 +1278,14 @@ def clear_editor():
     check_at_mouse_check.grid_remove()
     border_margin_label.grid_remove()
     border_margin_entry.grid_remove()
+    border_margin_mode_label.grid_remove()
+    border_margin_mode_combo.grid_remove()
     selection_mode_label.grid_remove()
     selection_mode_combo.grid_remove()
     stationary_only_label.grid_remove()
     stationary_only_check.grid_remove()
+    best_across_colors_label.grid_remove()
+    best_across_colors_check.grid_remove()
     delta_min_label.grid_remove()
     delta_min_entry.grid_remove()
     delta_max_label.grid_remove()
@@ -1702,6 +1296,19 @@ def clear_editor():
     on_success_capture_btn.grid_remove()
     tolerance_label.grid_remove()
     tolerance_entry.grid_remove()
+    pyramid_min_size_label.grid_remove()
+    pyramid_min_size_entry.grid_remove()
+    roi_tracking_label.grid_remove()
+    roi_tracking_check.grid_remove()
+    motion_model_label.grid_remove()
+    motion_model_combo.grid_remove()
+    points_label.grid_remove()
+    points_entry.grid_remove()
+    add_point_btn.grid_remove()
+    point_mode_label.grid_remove()
+    point_mode_combo.grid_remove()
+    min_matches_label.grid_remove()
+    min_matches_entry.grid_remove()
     hold_min_ms_label.grid_remove()
     hold_min_ms_entry.grid_remove()
     hold_max_ms_label.grid_remove()
@@ -1715,7 +1322,7 @@ def on_type_change(event):
         action['type'] = new_type
         if new_type == 'key_action':
             action['key'] = 'a'
-            keys_to_del = ['min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only']
+            keys_to_del = ['min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'border_margin_mode', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only', 'best_across_colors', 'pyramid_min_size', 'roi_tracking', 'motion_model', 'points', 'point_mode', 'min_matches', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         elif new_type == 'mouse_move':
@@ -1723,7 +1330,8 @@ def on_type_change(event):
             action['max_x'] = 0
             action['min_y'] = 0
             action['max_y'] = 0
-            keys_to_del = ['key', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only']
+            action['motion_model'] = 'windmouse'
+            keys_to_del = ['key', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'border_margin_mode', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only', 'best_across_colors', 'pyramid_min_size', 'roi_tracking', 'points', 'point_mode', 'min_matches', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         elif new_type == 'color_check':
@@ -1735,7 +1343,10 @@ def on_type_change(event):
             action['tolerance'] = 0
             action['hold_min_ms'] = 1
             action['hold_max_ms'] = 10
-            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'border_margin_percent', 'selection_mode', 'on_end', 'expected_color', 'stationary_only']
+            action['points'] = []
+            action['point_mode'] = 'all'
+            action['min_matches'] = 1
+            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'border_margin_percent', 'border_margin_mode', 'selection_mode', 'on_end', 'expected_color', 'stationary_only', 'best_across_colors', 'pyramid_min_size', 'roi_tracking', 'motion_model', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         elif new_type == 'if_color_start':
@@ -1743,7 +1354,10 @@ def on_type_change(event):
             action['x'] = 0
             action['y'] = 0
             action['check_at_mouse'] = False
-            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'border_margin_percent', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only']
+            action['points'] = []
+            action['point_mode'] = 'all'
+            action['min_matches'] = 1
+            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'border_margin_percent', 'border_margin_mode', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only', 'best_across_colors', 'pyramid_min_size', 'roi_tracking', 'motion_model', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         elif new_type == 'mouse_to_color':
@@ -1756,30 +1370,36 @@ def on_type_change(event):
             action['max_move_delay'] = 0.5
             action['on_fail'] = 'continue'
             action['border_margin_percent'] = 20
+            action['border_margin_mode'] = 'box'
             action['selection_mode'] = 'random'
             action['stationary_only'] = False
-            keys_to_del = ['key', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'check_at_mouse', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms']
+            action['best_across_colors'] = False
+            action['tolerance'] = 0
+            action['pyramid_min_size'] = 0
+            action['roi_tracking'] = False
+            action['motion_model'] = 'windmouse'
+            keys_to_del = ['key', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'check_at_mouse', 'on_end', 'on_success_press', 'hold_min_ms', 'hold_max_ms', 'points', 'point_mode', 'min_matches', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         elif new_type == 'loop_start':
             action['name'] = 'loop1'
             action['min_loops'] = 1
             action['max_loops'] = 1
-            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only']
+            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'border_margin_mode', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only', 'best_across_colors', 'pyramid_min_size', 'roi_tracking', 'motion_model', 'points', 'point_mode', 'min_matches', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         elif new_type == 'loop_end':
             action['name'] = 'loop1'
-            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only']
+            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'border_margin_mode', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only', 'best_across_colors', 'pyramid_min_size', 'roi_tracking', 'motion_model', 'points', 'point_mode', 'min_matches', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         elif new_type == 'wait':
             action['on_end'] = 'continue'
-            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'selection_mode', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only']
+            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'border_margin_mode', 'selection_mode', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only', 'best_across_colors', 'pyramid_min_size', 'roi_tracking', 'motion_model', 'points', 'point_mode', 'min_matches', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         elif new_type in ['else', 'if_end']:
-            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only']
+            keys_to_del = ['key', 'min_x', 'max_x', 'min_y', 'max_y', 'expected_color', 'x', 'y', 'name', 'min_loops', 'max_loops', 'min_move_delay', 'max_move_delay', 'on_fail', 'check_at_mouse', 'border_margin_percent', 'border_margin_mode', 'selection_mode', 'on_end', 'on_success_press', 'tolerance', 'hold_min_ms', 'hold_max_ms', 'expected_colors', 'stationary_only', 'best_across_colors', 'pyramid_min_size', 'roi_tracking', 'motion_model', 'points', 'point_mode', 'min_matches', 'trajectory']
             for k in keys_to_del:
                 action.pop(k, None)
         populate_editor(action)
@@ -1805,6 +1425,10 @@ def save_changes():
             action['max_x'] = max_x
             action['min_y'] = min_y
             action['max_y'] = max_y
+            motion_model = motion_model_var.get()
+            if motion_model not in MOTION_MODELS:
+                raise ValueError("Invalid motion model.")
+            action['motion_model'] = motion_model
         if action['type'] == 'key_action':
             action['key'] = key_var.get().strip()
             if not action['key']:
@@ -1828,6 +1452,10 @@ def save_changes():
             if on_fail not in ON_FAIL_OPTIONS:
                 raise ValueError("Invalid on_fail option.")
             action['on_fail'] = on_fail
+            tolerance = int(tolerance_var.get())
+            if tolerance < 0 or tolerance > 255:
+                raise ValueError("Tolerance must be between 0 and 255.")
+            action['tolerance'] = tolerance
             if action['type'] == 'color_check':
                 check_at_mouse = check_at_mouse_var.get()
                 action['check_at_mouse'] = check_at_mouse
@@ -1848,10 +1476,16 @@ def save_changes():
                     action['on_success_press'] = on_success_press
                 else:
                     action.pop('on_success_press', None)
-                tolerance = int(tolerance_var.get())
-                if tolerance < 0 or tolerance > 255:
-                    raise ValueError("Tolerance must be between 0 and 255.")
-                action['tolerance'] = tolerance
+                points = parse_points(points_var.get())
+                point_mode = point_mode_var.get()
+                if point_mode not in POINT_MODES:
+                    raise ValueError("Invalid point mode.")
+                min_matches = int(min_matches_var.get())
+                if point_mode == 'at_least' and not 1 <= min_matches <= max(len(points), 1):
+                    raise ValueError("Min matches must be between 1 and the number of points.")
+                action['points'] = points
+                action['point_mode'] = point_mode
+                action['min_matches'] = min_matches
                 hold_min_ms = int(hold_min_ms_var.get())
                 hold_max_ms = int(hold_max_ms_var.get())
                 if hold_min_ms < 1 or hold_max_ms < 1 or hold_min_ms > hold_max_ms or hold_max_ms > 1000:  # Cap to reasonable
@@ -1869,11 +1503,21 @@ def save_changes():
                 if border_margin < 0 or border_margin > 50:
                     raise ValueError("Border margin percent must be between 0 and 50.")
                 action['border_margin_percent'] = border_margin
+                border_margin_mode = border_margin_mode_var.get()
+                if border_margin_mode not in BORDER_MARGIN_MODES:
+                    raise ValueError("Invalid border margin mode.")
+                action['border_margin_mode'] = border_margin_mode
                 selection_mode = selection_mode_var.get()
                 if selection_mode not in SELECTION_MODES:
                     raise ValueError("Invalid selection mode.")
                 action['selection_mode'] = selection_mode
                 action['stationary_only'] = stationary_only_var.get()
+                action['best_across_colors'] = best_across_colors_var.get()
+                pyramid_min_size = int(pyramid_min_size_var.get())
+                if pyramid_min_size < 0:
+                    raise ValueError("Pyramid min size must be 0 (off) or a positive number of pixels.")
+                action['pyramid_min_size'] = pyramid_min_size
+                action['roi_tracking'] = roi_tracking_var.get()
         elif action['type'] == 'if_color_start':
             expected_color = hex_var.get().strip()
             if not expected_color.startswith('#') or len(expected_color) != 7:
@@ -1897,6 +1541,16 @@ def save_changes():
                 # Remove x/y if checking at mouse
                 action.pop('x', None)
                 action.pop('y', None)
+            points = parse_points(points_var.get())
+            point_mode = point_mode_var.get()
+            if point_mode not in POINT_MODES:
+                raise ValueError("Invalid point mode.")
+            min_matches = int(min_matches_var.get())
+            if point_mode == 'at_least' and not 1 <= min_matches <= max(len(points), 1):
+                raise ValueError("Min matches must be between 1 and the number of points.")
+            action['points'] = points
+            action['point_mode'] = point_mode
+            action['min_matches'] = min_matches
         elif action['type'] == 'loop_start':
             name = loop_name_var.get().strip()
             if not name:
@@ -2071,7 +1725,7 @@ def capture_color_on_click():
     time.sleep(3)
     def on_click(x, y, button, pressed):
         if pressed and button == Button.left:
-            color = get_pixel_color(x, y)
+            color = picker_capture.get_pixel(x, y)
             hex_color = f'#{color[0]:02x}{color[1]:02x}{color[2]:02x}'
             current_colors = hex_var.get().strip()
             if current_colors:
@@ -2088,6 +1742,26 @@ def capture_color_on_click():
     capture_listener_mouse = mouse.Listener(on_click=on_click)
     capture_listener_mouse.start()
 
+def capture_point_on_click():
+    global capture_listener_mouse
+    if capture_listener_mouse:
+        capture_listener_mouse.stop()
+    update_status("In 3 seconds, click on the screen to add a check point...")
+    root.update()
+    time.sleep(3)
+    def on_click(x, y, button, pressed):
+        if pressed and button == Button.left:
+            current_points = points_var.get().strip()
+            if current_points:
+                points_var.set(current_points + f'; {x},{y}')
+            else:
+                points_var.set(f'{x},{y}')
+            update_status("Point added.")
+            capture_listener_mouse.stop()
+            return False
+    capture_listener_mouse = mouse.Listener(on_click=on_click)
+    capture_listener_mouse.start()
+
 def capture_color_at_coord():
     try:
         x = int(check_x_var.get())
@@ -2098,7 +1772,7 @@ def capture_color_at_coord():
     update_status(f"Capturing color at ({x}, {y}) in 3 seconds...")
     root.update()
     time.sleep(3)
-    color = get_pixel_color(x, y)
+    color = picker_capture.get_pixel(x, y)
     hex_color = f'#{color[0]:02x}{color[1]:02x}{color[2]:02x}'
     hex_var.set(hex_color)
     update_status("Color captured.")
@@ -2247,7 +1921,11 @@ edit_menu = Menu(menubar, tearoff=0)
 edit_menu.add_command(label="Copy", command=copy_selected, accelerator="Ctrl+C")
 edit_menu.add_command(label="Paste", command=paste_smart, accelerator="Ctrl+V")
 edit_menu.add_command(label="Delete", command=delete_selected, accelerator="Del")
+edit_menu.add_command(label="Merge Dense Moves into Trajectories", command=merge_dense_moves_in_macro)
 menubar.add_cascade(label="Edit", menu=edit_menu)
+tools_menu = Menu(menubar, tearoff=0)
+tools_menu.add_command(label="Calibrate Input Latency", command=calibrate_input_latency)
+menubar.add_cascade(label="Tools", menu=tools_menu)
 root.config(menu=menubar)
 
 # Bind keyboard shortcuts
@@ -2318,6 +1996,27 @@ speed_spin = Spinbox(button_frame, from_=1, to=200, textvariable=speed_var, widt
 speed_spin.grid(row=0, column=12, padx=5)
 Tooltip(speed_spin, "Playback speed percentage: 100% normal, >100% faster, <100% slower.")
 
+frame_cache_label = ttk.Label(button_frame, text="Frame Cache (ms):")
+frame_cache_label.grid(row=0, column=13, padx=5)
+frame_cache_var = tk.StringVar(value="0")
+frame_cache_entry = ttk.Entry(button_frame, textvariable=frame_cache_var, width=5)
+frame_cache_entry.grid(row=0, column=14, padx=5)
+Tooltip(frame_cache_entry, "0 = every color read grabs the screen. Otherwise pixel and region reads reuse a capture that is at most this many milliseconds old; color check re-checks and wait loops always grab fresh.")
+
+seed_label = ttk.Label(button_frame, text="Seed:")
+seed_label.grid(row=0, column=15, padx=5)
+seed_var = tk.StringVar(value="")
+seed_entry = ttk.Entry(button_frame, textvariable=seed_var, width=10)
+seed_entry.grid(row=0, column=16, padx=5)
+Tooltip(seed_entry, "Empty = a new random seed each playback. Every playback's seed is shown in the status bar and written to the run log (playback_runs.jsonl, or MACRO_RUN_LOG); enter it here to replay the same delays, positions, decisions and mouse paths.")
+
+mouse_rate_label = ttk.Label(button_frame, text="Mouse Rate (Hz):")
+mouse_rate_label.grid(row=0, column=17, padx=5)
+mouse_rate_var = tk.StringVar(value="1000")
+mouse_rate_combo = ttk.Combobox(button_frame, textvariable=mouse_rate_var, values=["0", "125", "500", "1000"], width=5)
+mouse_rate_combo.grid(row=0, column=18, padx=5)
+Tooltip(mouse_rate_combo, "Max cursor position updates per second during moves. Path points beyond this rate are coalesced evenly along the path, so shape and duration stay the same. 0 = send every path point.")
+
 # Treeview for displaying actions
 columns = ("delay", "type", "details", "comment")
 tree = ttk.Treeview(root, columns=columns, show="headings", height=15, selectmode="extended")
@@ -2389,10 +2088,19 @@ on_fail_var = tk.StringVar()
 check_at_mouse_var = tk.BooleanVar(value=False)
 check_at_mouse_var.trace('w', toggle_coord_state)
 border_margin_var = tk.StringVar()
+border_margin_mode_var = tk.StringVar()
 selection_mode_var = tk.StringVar()
 stationary_only_var = tk.BooleanVar()
+best_across_colors_var = tk.BooleanVar()
 on_success_press_var = tk.StringVar()
 tolerance_var = tk.StringVar()
+pyramid_min_size_var = tk.StringVar()
+pyramid_min_size_var.trace('w', toggle_roi_state)
+roi_tracking_var = tk.BooleanVar()
+motion_model_var = tk.StringVar()
+points_var = tk.StringVar()
+point_mode_var = tk.StringVar()
+min_matches_var = tk.StringVar()
 hold_min_ms_var = tk.StringVar()
 hold_max_ms_var = tk.StringVar()
 
@@ -2492,10 +2200,29 @@ check_at_mouse_label = ttk.Label(editor_frame, text="Check at Mouse:")
 check_at_mouse_check = ttk.Checkbutton(editor_frame, variable=check_at_mouse_var)
 Tooltip(check_at_mouse_check, "If checked, check color at current mouse position instead of fixed coordinate.")
 
+points_label = ttk.Label(editor_frame, text="Points:")
+points_entry = ttk.Entry(editor_frame, textvariable=points_var, state='disabled', width=40)
+Tooltip(points_entry, "Optional list of 'x,y' points separated by semicolons. If set, all points are checked from one capture and X/Y and Check at Mouse are ignored.")
+
+add_point_btn = ttk.Button(editor_frame, text="Add Point on Click", command=capture_point_on_click, state='disabled')
+Tooltip(add_point_btn, "After 3s delay, click to append the clicked position to the points.")
+
+point_mode_label = ttk.Label(editor_frame, text="Point Mode:")
+point_mode_combo = ttk.Combobox(editor_frame, values=POINT_MODES, state='disabled', textvariable=point_mode_var)
+Tooltip(point_mode_combo, "all: every point must match, any: one point is enough, at_least: at least Min Matches points.")
+
+min_matches_label = ttk.Label(editor_frame, text="Min Matches:")
+min_matches_entry = ttk.Entry(editor_frame, textvariable=min_matches_var, state='disabled', width=10)
+Tooltip(min_matches_entry, "Number of points that must match in at_least mode.")
+
 border_margin_label = ttk.Label(editor_frame, text="Border Margin (%):")
 border_margin_entry = ttk.Entry(editor_frame, textvariable=border_margin_var, width=15)
 Tooltip(border_margin_entry, "Percentage of border margin to avoid clicking near edges (0-50).")
 
+border_margin_mode_label = ttk.Label(editor_frame, text="Margin Mode:")
+border_margin_mode_combo = ttk.Combobox(editor_frame, values=BORDER_MARGIN_MODES, state='disabled', textvariable=border_margin_mode_var, width=12)
+Tooltip(border_margin_mode_combo, "How the border margin is measured: box (bounding box of the color mass) or distance (distance to the mass outline, for irregular shapes).")
+
 selection_mode_label = ttk.Label(editor_frame, text="Selection Mode:")
 selection_mode_combo = ttk.Combobox(editor_frame, values=SELECTION_MODES, state='disabled', textvariable=selection_mode_var)
 Tooltip(selection_mode_combo, "How to select color mass: random (any component), closest (to mouse), furthest (from mouse).")
@@ -2504,6 +2231,10 @@ stationary_only_label = ttk.Label(editor_frame, text="Stationary Only:")
 stationary_only_check = ttk.Checkbutton(editor_frame, variable=stationary_only_var)
 Tooltip(stationary_only_check, "If checked, only consider non-moving color masses by comparing two snapshots.")
 
+best_across_colors_label = ttk.Label(editor_frame, text="Best Across Colors:")
+best_across_colors_check = ttk.Checkbutton(editor_frame, variable=best_across_colors_var)
+Tooltip(best_across_colors_check, "If checked, apply the selection mode to color masses of all listed colors instead of using the first color that is found.")
+
 on_success_press_label = ttk.Label(editor_frame, text="On Success Press:")
 on_success_press_entry = ttk.Entry(editor_frame, textvariable=on_success_press_var, width=15)
 Tooltip(on_success_press_entry, "Optional key or mouse button to press immediately if color matches (e.g., 'mouse.left').")
@@ -2515,6 +2246,17 @@ tolerance_label = ttk.Label(editor_frame, text="Color Tolerance (0=exact):")
 tolerance_entry = ttk.Entry(editor_frame, textvariable=tolerance_var, width=15)
 Tooltip(tolerance_entry, "Tolerance for color matching (Euclidean distance in RGB space, 0-255).")
 
+pyramid_min_size_label = ttk.Label(editor_frame, text="Pyramid Min Size (px):")
+pyramid_min_size_entry = ttk.Entry(editor_frame, textvariable=pyramid_min_size_var, width=10)
+Tooltip(pyramid_min_size_entry, "0 = scan every pixel. Otherwise scan a coarse grid first and only refine around hits; color masses at least this many pixels wide and high are always found, thinner ones may be missed.")
+
+roi_tracking_label = ttk.Label(editor_frame, text="ROI Tracking:")
+roi_tracking_check = ttk.Checkbutton(editor_frame, variable=roi_tracking_var)
+Tooltip(roi_tracking_check, "If checked, colors are still matched over the whole region, but components are only labeled in a small window around the last hit when every match lies inside it; any match outside the window makes the whole region labeled. The pick is always the same as a full-region scan. Unavailable while Pyramid Min Size is above 0.")
+motion_model_label = ttk.Label(editor_frame, text="Motion Model:")
+motion_model_combo = ttk.Combobox(editor_frame, values=list(MOTION_MODELS), state='disabled', textvariable=motion_model_var, width=12)
+Tooltip(motion_model_combo, "How the mouse path is shaped: windmouse (simulated wind and gravity, served from the path pool), min_jerk (smooth, slightly curved reach) or bezier (randomly curved cubic Bezier). min_jerk and bezier are computed in one step, whatever the distance.")
+
 hold_min_ms_label = ttk.Label(editor_frame, text="Hold Min (ms):")
 hold_min_ms_entry = ttk.Entry(editor_frame, textvariable=hold_min_ms_var, width=10)
 Tooltip(hold_min_ms_entry, "Minimum hold duration for on_success_press (ms).")
@@ -2557,10 +2299,12 @@ def on_closing():
     global hotkey_listener
     if recording:
         stop_recording()
-    if playback_active:
+    if engine.active:
         stop_playback()
     if hotkey_listener:
         hotkey_listener.stop()
+    engine.close()
+    picker_capture.close()
     root.destroy()
 
 root.protocol("WM_DELETE_WINDOW", on_closing)
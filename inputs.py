@@ -0,0 +1,166 @@
+import os
+import ctypes
+import ctypes.util
+import threading
+
+from pynput.keyboard import Controller as KeyboardController
+from pynput.mouse import Controller as MouseController
+
+from capture import init_x_threads
+
+# Input injection backends. A backend is a (mouse, keyboard) pair of controllers with
+# the part of pynput's interface playback uses: mouse.position (read and assigned),
+# mouse.press/release(button) and keyboard.press/release(key), where button is a
+# pynput Button and key a pynput Key or a single character.
+
+XK_SHIFT_L = 0xffe1
+
+class XTestInput:
+    '''
+    Input through the XTEST extension on a persistent connection to one X display, so
+    several playback engines in one process can each drive their own display (e.g.
+    Xvfb :1, :2). mouse and keyboard are the controllers; the connection is shared by
+    both and serialized with a lock, and closed by close() on either.
+    '''
+    def __init__(self, display_name=None):
+        xlib_path = ctypes.util.find_library('X11')
+        xtst_path = ctypes.util.find_library('Xtst')
+        if not xlib_path or not xtst_path:
+            raise OSError("libX11 or libXtst not found")
+        self.xlib = ctypes.cdll.LoadLibrary(xlib_path)
+        self.xtst = ctypes.cdll.LoadLibrary(xtst_path)
+        self._declare()
+        init_x_threads(self.xlib)
+        name = display_name.encode() if display_name else None
+        self.display = self.xlib.XOpenDisplay(name)
+        if not self.display:
+            raise OSError(f"Cannot open X display {display_name or os.environ.get('DISPLAY', '')}")
+        if not self.xtst.XTestQueryExtension(self.display, *(ctypes.byref(ctypes.c_int()) for _ in range(4))):
+            self.xlib.XCloseDisplay(self.display)
+            raise OSError("XTEST extension not available")
+        self.screen = self.xlib.XDefaultScreen(self.display)
+        self.root = self.xlib.XDefaultRootWindow(self.display)
+        self.shift = self.xlib.XKeysymToKeycode(self.display, XK_SHIFT_L)
+        self.lock = threading.Lock()
+        self.mouse = XTestMouse(self)
+        self.keyboard = XTestKeyboard(self)
+
+    def _declare(self):
+        x = self.xlib
+        x.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x.XOpenDisplay.restype = ctypes.c_void_p
+        x.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x.XDefaultRootWindow.restype = ctypes.c_ulong
+        x.XFlush.argtypes = [ctypes.c_void_p]
+        x.XQueryPointer.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong),
+                                    ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+                                    ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_uint)]
+        x.XKeysymToKeycode.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+        x.XKeysymToKeycode.restype = ctypes.c_ubyte
+        x.XKeycodeToKeysym.argtypes = [ctypes.c_void_p, ctypes.c_ubyte, ctypes.c_int]
+        x.XKeycodeToKeysym.restype = ctypes.c_ulong
+        t = self.xtst
+        t.XTestQueryExtension.argtypes = [ctypes.c_void_p] + [ctypes.POINTER(ctypes.c_int)] * 4
+        t.XTestFakeMotionEvent.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        t.XTestFakeButtonEvent.argtypes = [ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong]
+        t.XTestFakeKeyEvent.argtypes = [ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong]
+
+    def pointer(self):
+        root, child = ctypes.c_ulong(), ctypes.c_ulong()
+        x, y, win_x, win_y = ctypes.c_int(), ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+        mask = ctypes.c_uint()
+        with self.lock:
+            self.xlib.XQueryPointer(self.display, self.root, ctypes.byref(root), ctypes.byref(child), ctypes.byref(x), ctypes.byref(y),
+                                    ctypes.byref(win_x), ctypes.byref(win_y), ctypes.byref(mask))
+        return (x.value, y.value)
+
+    def move(self, x, y):
+        with self.lock:
+            self.xtst.XTestFakeMotionEvent(self.display, self.screen, int(x), int(y), 0)
+            self.xlib.XFlush(self.display)
+
+    def button(self, button, down):
+        with self.lock:
+            self.xtst.XTestFakeButtonEvent(self.display, int(button.value), down, 0)
+            self.xlib.XFlush(self.display)
+
+    def key(self, key, down):
+        # Characters are typed by keysym (Latin-1 and Unicode keysyms), with Shift for those on a key's shifted level
+        if isinstance(key, str):
+            code = ord(key)
+            keysym = code if code < 0x100 else 0x01000000 | code
+        else:
+            keysym = key.value.vk  # pynput's X backend keeps the keysym of Key members here
+        with self.lock:
+            keycode = self.xlib.XKeysymToKeycode(self.display, keysym)
+            if not keycode:
+                return
+            shifted = isinstance(key, str) and self.xlib.XKeycodeToKeysym(self.display, keycode, 0) != keysym
+            if shifted and down:
+                self.xtst.XTestFakeKeyEvent(self.display, self.shift, True, 0)
+            self.xtst.XTestFakeKeyEvent(self.display, keycode, down, 0)
+            if shifted and not down:
+                self.xtst.XTestFakeKeyEvent(self.display, self.shift, False, 0)
+            self.xlib.XFlush(self.display)
+
+    def close(self):
+        with self.lock:
+            if self.display:
+                self.xlib.XCloseDisplay(self.display)
+                self.display = None
+
+class XTestMouse:
+    def __init__(self, connection):
+        self.connection = connection
+
+    @property
+    def position(self):
+        return self.connection.pointer()
+
+    @position.setter
+    def position(self, pos):
+        self.connection.move(*pos)
+
+    def press(self, button):
+        self.connection.button(button, True)
+
+    def release(self, button):
+        self.connection.button(button, False)
+
+    def close(self):
+        self.connection.close()
+
+class XTestKeyboard:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def press(self, key):
+        self.connection.key(key, True)
+
+    def release(self, key):
+        self.connection.key(key, False)
+
+    def close(self):
+        self.connection.close()
+
+
+INPUT_BACKENDS = ('pynput', 'xtest')
+
+def create_input_backend(name=None, display=None):
+    '''
+    Build (mouse, keyboard) controllers by name ('pynput' or 'xtest'). The
+    MACRO_INPUT_BACKEND environment variable overrides the default, which is 'pynput'
+    unless a display is given: display (e.g. ':1') drives that X display instead of
+    $DISPLAY, which only 'xtest' can do.
+    '''
+    name = name or os.environ.get('MACRO_INPUT_BACKEND', 'xtest' if display else 'pynput')
+    if name not in INPUT_BACKENDS:
+        raise ValueError(f"Unknown input backend '{name}'; use one of {', '.join(INPUT_BACKENDS)}.")
+    if name == 'xtest':
+        connection = XTestInput(display)
+        return connection.mouse, connection.keyboard
+    if display:
+        raise ValueError(f"Input backend 'pynput' cannot drive display {display}; use xtest.")
+    return MouseController(), KeyboardController()
@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import platform
+from collections import namedtuple
+
+import numpy as np
+
+# Per-host input injection latency. Calibration times the controller calls playback makes
+# (cursor moves, cursor position reads, key press and release); the schedulers use the
+# medians to send events early enough that they land on their deadlines.
+
+LatencyProfile = namedtuple('LatencyProfile', ['host', 'measured', 'move_s', 'read_s', 'press_s', 'release_s', 'jitter_s'])
+
+def empty_profile():
+    # No compensation: what playback assumes on a host that was never calibrated
+    return LatencyProfile(platform.node(), None, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+def profile_path():
+    # MACRO_LATENCY_PROFILE, default ~/.macro_latency.json; one file holds the profiles of all hosts
+    return os.environ.get('MACRO_LATENCY_PROFILE', os.path.join(os.path.expanduser('~'), '.macro_latency.json'))
+
+def time_calls(func, samples):
+    # Seconds per call, one sample per call
+    durations = np.empty(samples)
+    for i in range(samples):
+        started = time.perf_counter()
+        func(i)
+        durations[i] = time.perf_counter() - started
+    return durations
+
+def calibrate_latency(move_to, read_position, press, release, samples=200):
+    '''
+    Time samples calls of each controller operation and return a LatencyProfile of
+    their medians. The cursor is moved one pixel back and forth around where it is and
+    put back; press/release should be given a key without side effects (e.g. shift).
+    jitter_s is the largest p90 - median spread: the timing error to expect per event
+    after compensation.
+    '''
+    x, y = read_position()
+    moves = time_calls(lambda i: move_to(x + (i & 1), y), samples)
+    move_to(x, y)
+    reads = time_calls(lambda i: read_position(), samples)
+    presses = np.empty(samples)
+    releases = np.empty(samples)
+    for i in range(samples):
+        started = time.perf_counter()
+        press()
+        pressed = time.perf_counter()
+        release()
+        presses[i] = pressed - started
+        releases[i] = time.perf_counter() - pressed
+    timings = [moves, reads, presses, releases]
+    medians = [float(np.median(t)) for t in timings]
+    jitter = max(float(np.percentile(t, 90)) - m for t, m in zip(timings, medians))
+    return LatencyProfile(platform.node(), time.strftime('%Y-%m-%dT%H:%M:%S'), *medians, jitter)
+
+def load_latency_profile(path=None):
+    # This host's profile, or empty_profile() if it was never calibrated
+    try:
+        with open(path or profile_path()) as f:
+            profiles = json.load(f)
+        return LatencyProfile(**profiles[platform.node()])
+    except (OSError, ValueError, KeyError, TypeError):
+        return empty_profile()
+
+def save_latency_profile(profile, path=None):
+    path = path or profile_path()
+    try:
+        with open(path) as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        profiles = {}
+    profiles[profile.host] = profile._asdict()
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=2)
+
+def max_move_hz(profile, limit_hz=0):
+    # The cursor update rate injection can sustain, combined with a configured limit (0 = none)
+    if profile.move_s <= 0:
+        return limit_hz
+    sustainable = 1.0 / profile.move_s
+    return min(limit_hz, sustainable) if limit_hz > 0 else sustainable
@@ -0,0 +1,465 @@
+import os
+import math
+import time
+import bisect
+import threading
+from collections import namedtuple
+from contextlib import nullcontext
+
+import numpy as np
+
+# Mouse motion generation. Paths are returned as a pair of int32 arrays (xs, ys) with
+# one entry per cursor position after the start; consecutive duplicates are dropped.
+
+SQRT3 = math.sqrt(3)
+SQRT5 = math.sqrt(5)
+RNG_BATCH = 256  # uniform draws fetched from the Generator at a time
+
+default_rng = np.random.default_rng()
+
+def uniform_stream(rng, batch=RNG_BATCH):
+    # Endless iterator over U[0, 1) floats, drawn from rng in batches
+    while True:
+        yield from rng.random(batch).tolist()
+
+def wind_mouse_path(start_x, start_y, dest_x, dest_y, G_0=9, W_0=3, M_0=15, D_0=12, rng=None):
+    '''
+    WindMouse algorithm, returning the whole trajectory as (xs, ys) int32 arrays.
+    Released under the terms of the GPLv3 license.
+    G_0 - magnitude of the gravitational force
+    W_0 - magnitude of the wind force fluctuations
+    M_0 - maximum step size (velocity clip threshold)
+    D_0 - distance where wind behavior changes from random to damped
+    The step recurrence is inherently sequential, so it runs on plain Python floats
+    with random numbers drawn in batches from rng (a numpy Generator) instead of one
+    numpy call per draw.
+    '''
+    uniform = uniform_stream(rng if rng is not None else default_rng).__next__
+    hypot = math.hypot
+    xs = []
+    ys = []
+    current_x, current_y = start_x, start_y
+    v_x = v_y = W_x = W_y = 0.0
+    while (dist := hypot(dest_x - start_x, dest_y - start_y)) >= 1:
+        W_mag = min(W_0, dist)
+        if dist >= D_0:
+            W_x = W_x / SQRT3 + (2 * uniform() - 1) * W_mag / SQRT5
+            W_y = W_y / SQRT3 + (2 * uniform() - 1) * W_mag / SQRT5
+        else:
+            W_x /= SQRT3
+            W_y /= SQRT3
+            if M_0 < 3:
+                M_0 = uniform() * 3 + 3
+            else:
+                M_0 /= SQRT5
+        v_x += W_x + G_0 * (dest_x - start_x) / dist
+        v_y += W_y + G_0 * (dest_y - start_y) / dist
+        v_mag = hypot(v_x, v_y)
+        if v_mag > M_0:
+            v_clip = M_0 / 2 + uniform() * M_0 / 2
+            v_x = (v_x / v_mag) * v_clip
+            v_y = (v_y / v_mag) * v_clip
+        start_x += v_x
+        start_y += v_y
+        move_x = round(start_x)
+        move_y = round(start_y)
+        if current_x != move_x or current_y != move_y:
+            current_x = move_x
+            current_y = move_y
+            xs.append(move_x)
+            ys.append(move_y)
+    return np.array(xs, dtype=np.int32), np.array(ys, dtype=np.int32)
+
+def wind_mouse(start_x, start_y, dest_x, dest_y, G_0=9, W_0=3, M_0=15, D_0=12, move_mouse=lambda x, y: None, rng=None):
+    # Callback form of wind_mouse_path; calls move_mouse with each new step and returns the end point
+    xs, ys = wind_mouse_path(start_x, start_y, dest_x, dest_y, G_0, W_0, M_0, D_0, rng)
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        move_mouse(x, y)
+    if len(xs):
+        return int(xs[-1]), int(ys[-1])
+    return start_x, start_y
+
+
+MoveReport = namedtuple('MoveReport', ['planned', 'actual', 'points', 'skipped', 'limited'])
+
+def limit_rate(xs, ys, duration, max_hz):
+    '''
+    Thin a path to at most max_hz points per second of duration (max_hz <= 0: no limit).
+    The points kept sit at evenly spaced indices, which play_path also spaces evenly in
+    time, and always include the last one, so the curve, its speed profile and the
+    total duration stay the same; only fewer positions are injected.
+    '''
+    n = len(xs)
+    if max_hz <= 0 or n == 0:
+        return xs, ys
+    m = max(1, int(duration * max_hz))
+    if m >= n:
+        return xs, ys
+    keep = np.arange(1, m + 1) * n // m - 1
+    return xs[keep], ys[keep]
+
+def play_path(xs, ys, duration, move_to, sleep, is_active=lambda: True, clock=time.perf_counter, max_hz=0, lead=0.0):
+    '''
+    Send a path to move_to against absolute deadlines: point k is due duration * k / n
+    after the start and the move ends duration after the start. Deadlines come from one
+    monotonic clock (perf_counter), so sleep overshoot on one step is absorbed by the
+    next instead of adding up. When the scheduler is behind, points whose deadline has
+    already passed are coalesced into the latest due one; the last point is never skipped.
+    max_hz caps the injection rate, see limit_rate. Each point is sent lead seconds
+    before its deadline, the time move_to takes to land (see latency.py).
+    Returns a MoveReport with planned vs actual duration in seconds; points is the path
+    length, skipped the points coalesced for lateness and limited those dropped by max_hz.
+    '''
+    return run_steps(path_steps(xs, ys, duration, move_to, is_active, clock, max_hz, lead), sleep)
+
+def run_steps(steps, sleep):
+    # Drive a path_steps/timed_path_steps generator, sleeping for each yielded interval; returns its MoveReport
+    while True:
+        try:
+            remaining = next(steps)
+        except StopIteration as done:
+            return done.value
+        sleep(remaining)
+
+def path_steps(xs, ys, duration, move_to, is_active=lambda: True, clock=time.perf_counter, max_hz=0, lead=0.0):
+    # play_path as a generator that yields the seconds to sleep instead of sleeping, for callers that await their sleeps
+    points = len(xs)
+    xs, ys = limit_rate(xs, ys, duration, max_hz)
+    n = len(xs)
+    started = clock()
+    if n == 0:
+        return MoveReport(duration, 0.0, 0, 0, 0)
+    step = duration / n
+    k = 0
+    skipped = 0
+    while k < n and is_active():
+        due = min(int((clock() - started + lead) / step), n - 1) if step > 0 else n - 1
+        if due > k:
+            skipped += due - k
+            k = due
+        move_to(int(xs[k]), int(ys[k]))
+        k += 1
+        remaining = started + k * step - (lead if k < n else 0.0) - clock()
+        if remaining > 0:
+            yield remaining
+    return MoveReport(duration, clock() - started, points, skipped, points - n)
+
+def play_timed_path(xs, ys, times, move_to, sleep, is_active=lambda: True, clock=time.perf_counter, max_hz=0, lead=0.0):
+    '''
+    Send a recorded trajectory to move_to with point k due times[k] seconds after the
+    start (times ascending). As in play_path, points whose deadline has already passed
+    are coalesced into the latest due one and the last point is never skipped; max_hz
+    keeps only the last point of every 1 / max_hz slot, and points are sent lead seconds
+    early as in play_path.
+    Returns a MoveReport; planned is times[-1].
+    '''
+    return run_steps(timed_path_steps(xs, ys, times, move_to, is_active, clock, max_hz, lead), sleep)
+
+def timed_path_steps(xs, ys, times, move_to, is_active=lambda: True, clock=time.perf_counter, max_hz=0, lead=0.0):
+    # play_timed_path as a generator, see path_steps
+    points = len(xs)
+    if max_hz > 0 and points > 1:
+        slot = np.floor(times * max_hz)
+        keep = np.empty(points, dtype=bool)
+        keep[-1] = True
+        np.not_equal(slot[:-1], slot[1:], out=keep[:-1])
+        xs, ys, times = xs[keep], ys[keep], times[keep]
+    n = len(xs)
+    started = clock()
+    if n == 0:
+        return MoveReport(0.0, 0.0, 0, 0, 0)
+    xs, ys, times = xs.tolist(), ys.tolist(), times.tolist()
+    k = 0
+    skipped = 0
+    while k < n:
+        remaining = started + times[k] - lead - clock()
+        if remaining > 0:
+            yield remaining
+        if not is_active():
+            break
+        due = min(max(bisect.bisect_right(times, clock() - started + lead) - 1, k), n - 1)
+        skipped += due - k
+        move_to(xs[due], ys[due])
+        k = due + 1
+    return MoveReport(times[-1], clock() - started, points, skipped, points - n)
+
+class MoveTimingStats:
+    # Planned vs actual move durations over a playback
+    def __init__(self):
+        self.reset()
+
+    def record(self, report):
+        self.moves += 1
+        self.planned += report.planned
+        self.actual += report.actual
+        self.points += report.points
+        self.skipped += report.skipped
+        self.limited += report.limited
+        overrun = report.actual - report.planned
+        if overrun > self.max_overrun:
+            self.max_overrun = overrun
+
+    def stats(self):
+        return {
+            'moves': self.moves,
+            'planned_s': self.planned,
+            'actual_s': self.actual,
+            'mean_overrun_ms': (self.actual - self.planned) / self.moves * 1000.0 if self.moves else 0.0,
+            'max_overrun_ms': self.max_overrun * 1000.0,
+            'points': self.points,
+            'skipped': self.skipped,
+            'limited': self.limited,
+        }
+
+    def reset(self):
+        self.moves = 0
+        self.planned = 0.0
+        self.actual = 0.0
+        self.points = 0
+        self.skipped = 0
+        self.limited = 0
+        self.max_overrun = 0.0
+
+
+def end_at_dest(xs, ys, dest_x, dest_y):
+    # WindMouse stops within a pixel of dest; finish on the rounded dest like pooled paths do
+    end_x, end_y = round(dest_x), round(dest_y)
+    if not len(xs) or (xs[-1] == end_x and ys[-1] == end_y):
+        return xs, ys
+    return np.append(xs, np.int32(end_x)), np.append(ys, np.int32(end_y))
+
+def place_on_line(along, across, start_x, start_y, dest_x, dest_y):
+    # Map coordinates along / across the start -> dest line to screen coordinates
+    dist = math.hypot(dest_x - start_x, dest_y - start_y)
+    cos_a = (dest_x - start_x) / dist
+    sin_a = (dest_y - start_y) / dist
+    return along * cos_a - across * sin_a + start_x, along * sin_a + across * cos_a + start_y
+
+def finish_path(fx, fy, start_x, start_y, dest_x, dest_y):
+    # Round float samples to pixels, end exactly on the rounded dest and drop repeats created by rounding, including points still on the start pixel
+    xs = np.rint(fx).astype(np.int32)
+    ys = np.rint(fy).astype(np.int32)
+    xs[-1] = round(dest_x)
+    ys[-1] = round(dest_y)
+    keep = np.empty(len(xs), dtype=bool)
+    keep[0] = xs[0] != round(start_x) or ys[0] != round(start_y)
+    np.not_equal(xs[1:], xs[:-1], out=keep[1:])
+    keep[1:] |= ys[1:] != ys[:-1]
+    return xs[keep], ys[keep]
+
+
+PATH_POOL_BUCKETS = (128, 256, 512, 1024, 2048, 4096)  # bucket distances in px; shorter moves are cheap to generate directly
+PATH_POOL_REFRESH = ['keep', 'replace']
+
+class PathPool:
+    '''
+    Pre-generated WindMouse trajectories, normalized to a unit move along +x and
+    grouped by distance bucket. path() picks one from the bucket nearest to the
+    requested distance, randomly mirrors it, resamples it to the step count of that
+    distance, then scales and rotates it onto start -> dest and adds perpendicular jitter that fades out at both ends. Moves
+    shorter than min_distance, or to an empty bucket, are generated on the spot.
+
+    size       - paths kept per bucket
+    refresh    - 'keep' reuses paths forever, 'replace' discards a path once used
+                 and has the background worker generate a new one
+    max_bytes  - cap on the memory held by all stored paths
+    jitter_px  - standard deviation of the perpendicular jitter in pixels
+
+    Every path ends exactly on the rounded dest, so where a move leaves the cursor
+    does not depend on which path it got. path() takes an optional rng (numpy
+    Generator) for its own draws, so seeded playback decides picks, mirroring and
+    jitter from its stream; the pool's contents still come from the fill worker.
+    '''
+    def __init__(self, size=32, refresh='replace', max_bytes=16 * 1024 * 1024, jitter_px=0.6, min_distance=128, seed=None):
+        if refresh not in PATH_POOL_REFRESH:
+            raise ValueError(f"Unknown refresh policy: {refresh}")
+        self.size = size
+        self.refresh = refresh
+        self.max_bytes = max_bytes
+        self.jitter_px = jitter_px
+        self.min_distance = min_distance
+        self.paths = {bucket: [] for bucket in PATH_POOL_BUCKETS}
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.rng_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.worker = None
+        self.closed = False
+        seeds = np.random.SeedSequence(seed).spawn(2)
+        self.fill_rng = np.random.default_rng(seeds[0])  # used by the worker only
+        self.rng = np.random.default_rng(seeds[1])       # used by path()
+        self.hits = 0
+        self.misses = 0
+
+    def _generate(self, bucket):
+        xs, ys = wind_mouse_path(0, 0, bucket, 0, rng=self.fill_rng)
+        return (xs / bucket).astype(np.float32), (ys / bucket).astype(np.float32)
+
+    def fill(self):
+        # Top every bucket up to size, smallest buckets first, within max_bytes
+        for bucket in PATH_POOL_BUCKETS:
+            while not self.closed:
+                with self.lock:
+                    if len(self.paths[bucket]) >= self.size:
+                        break
+                ux, uy = self._generate(bucket)
+                with self.lock:
+                    if self.nbytes + ux.nbytes + uy.nbytes > self.max_bytes:
+                        return
+                    self.paths[bucket].append((ux, uy))
+                    self.nbytes += ux.nbytes + uy.nbytes
+
+    def start(self):
+        # Fill the pool on a daemon thread and keep refilling it when paths are consumed
+        if self.worker is not None or self.size <= 0:
+            return
+        def run():
+            while not self.closed:
+                self.fill()
+                self.wake.wait()
+                self.wake.clear()
+        self.worker = threading.Thread(target=run, daemon=True)
+        self.worker.start()
+
+    def _bucket(self, dist):
+        if self.size <= 0 or dist < self.min_distance:
+            return None
+        idx = int(round(math.log2(dist / PATH_POOL_BUCKETS[0])))
+        return PATH_POOL_BUCKETS[min(max(idx, 0), len(PATH_POOL_BUCKETS) - 1)]
+
+    def path(self, start_x, start_y, dest_x, dest_y, rng=None):
+        # Same contract as wind_mouse_path: (xs, ys) int32 arrays of the positions after start
+        dx = dest_x - start_x
+        dy = dest_y - start_y
+        dist = math.hypot(dx, dy)
+        bucket = self._bucket(dist)
+        # path() may be called from the playback and the prefetch thread; the shared Generator is not thread-safe
+        guard = self.rng_lock if rng is None else nullcontext()
+        rng = self.rng if rng is None else rng
+        unit = None
+        if bucket is not None:
+            with self.lock:
+                paths = self.paths[bucket]
+                if paths:
+                    with guard:
+                        k = int(rng.integers(len(paths)))
+                    unit = paths[k]
+                    if self.refresh == 'replace':
+                        paths[k] = paths[-1]
+                        paths.pop()
+                        self.nbytes -= unit[0].nbytes + unit[1].nbytes
+                        self.wake.set()
+        with guard:
+            if unit is None:
+                self.misses += 1
+                return end_at_dest(*wind_mouse_path(start_x, start_y, dest_x, dest_y, rng=rng), dest_x, dest_y)
+            self.hits += 1
+            return self._place(unit, bucket, dist, start_x, start_y, dest_x, dest_y, rng)
+
+    def _place(self, unit, bucket, dist, start_x, start_y, dest_x, dest_y, rng):
+        ux, uy = unit
+        # WindMouse step count grows with distance, so resample to the count this distance would get
+        n = max(2, int(round(len(ux) * dist / bucket)))
+        steps = np.arange(n, dtype=np.float64)
+        if n != len(ux):
+            t = steps * ((len(ux) - 1) / (n - 1))
+            index = np.arange(len(ux))
+            ux = np.interp(t, index, ux)
+            uy = np.interp(t, index, uy)
+        along = ux * dist
+        across = uy * (dist if rng.random() < 0.5 else -dist)
+        if self.jitter_px > 0 and n > 2:
+            across += rng.normal(0.0, self.jitter_px, n) * np.sin(steps * (math.pi / (n - 1)))
+        return finish_path(*place_on_line(along, across, start_x, start_y, dest_x, dest_y), start_x, start_y, dest_x, dest_y)
+
+    def stats(self):
+        with self.lock:
+            stored = sum(len(paths) for paths in self.paths.values())
+        return {'paths': stored, 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        self.closed = True
+        self.wake.set()
+
+
+def create_path_pool():
+    '''
+    Build the playback path pool from the environment:
+    MACRO_PATH_POOL_SIZE (paths per bucket, 0 disables the pool, default 32),
+    MACRO_PATH_POOL_REFRESH ('keep' or 'replace', default 'replace') and
+    MACRO_PATH_POOL_MAX_MB (memory cap, default 16).
+    '''
+    size = int(os.environ.get('MACRO_PATH_POOL_SIZE', 32))
+    refresh = os.environ.get('MACRO_PATH_POOL_REFRESH', 'replace')
+    max_bytes = int(float(os.environ.get('MACRO_PATH_POOL_MAX_MB', 16)) * 1024 * 1024)
+    return PathPool(size=size, refresh=refresh, max_bytes=max_bytes)
+
+
+# Closed-form motion models. Each takes start/dest and returns a path with the same
+# contract as PathPool.path; n is the number of samples (by default proportional to the
+# distance, about as many as WindMouse would produce) and rng a numpy Generator. The
+# samples are taken at evenly spaced times through a minimum-jerk time law, so with
+# play_path's even per-point schedule the cursor speeds up and slows down like a hand.
+
+MODEL_STEP_PX = 8  # mean spacing of default samples along the path
+
+def model_samples(dist):
+    return max(2, int(math.ceil(dist / MODEL_STEP_PX)))
+
+def min_jerk_time(n):
+    # Minimum-jerk progress 10t^3 - 15t^4 + 6t^5 at n evenly spaced times in (0, 1]
+    t = np.arange(1, n + 1, dtype=np.float64) / n
+    return t * t * t * (10.0 + t * (-15.0 + 6.0 * t))
+
+def tremor(rng, n, jitter_px):
+    # Perpendicular jitter that fades out at both ends
+    if jitter_px <= 0 or n <= 2:
+        return 0.0
+    return rng.normal(0.0, jitter_px, n) * np.sin(np.arange(1, n + 1) * (math.pi / n))
+
+def min_jerk_path(start_x, start_y, dest_x, dest_y, n=None, rng=None, bow=0.04, jitter_px=0.6):
+    '''
+    Minimum-jerk reach: a straight line bent into a gentle arc whose height is drawn
+    from N(0, bow * distance), plus tremor jitter.
+    '''
+    dist = math.hypot(dest_x - start_x, dest_y - start_y)
+    if dist < 1:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    rng = rng if rng is not None else default_rng
+    n = n or model_samples(dist)
+    s = min_jerk_time(n)
+    along = s * dist
+    across = rng.normal(0.0, bow * dist) * np.sin(s * math.pi) + tremor(rng, n, jitter_px)
+    return finish_path(*place_on_line(along, across, start_x, start_y, dest_x, dest_y), start_x, start_y, dest_x, dest_y)
+
+def bezier_path(start_x, start_y, dest_x, dest_y, n=None, rng=None, spread=0.12, jitter_px=0.6):
+    '''
+    Noisy cubic Bezier: inner control points at random positions around the first and
+    second third of the line (perpendicular offset drawn from N(0, spread * distance)),
+    walked with the minimum-jerk time law, plus tremor jitter.
+    '''
+    dist = math.hypot(dest_x - start_x, dest_y - start_y)
+    if dist < 1:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    rng = rng if rng is not None else default_rng
+    n = n or model_samples(dist)
+    a1, a2 = rng.uniform(0.2, 0.45), rng.uniform(0.55, 0.8)
+    c1, c2 = rng.normal(0.0, spread, 2)
+    t = min_jerk_time(n)
+    u = 1.0 - t
+    # Bernstein weights of the two inner control points; the end points are (0, 0) and (1, 0)
+    w1 = 3.0 * u * u * t
+    w2 = 3.0 * u * t * t
+    along = (w1 * a1 + w2 * a2 + t * t * t) * dist
+    across = (w1 * c1 + w2 * c2) * dist + tremor(rng, n, jitter_px)
+    return finish_path(*place_on_line(along, across, start_x, start_y, dest_x, dest_y), start_x, start_y, dest_x, dest_y)
+
+def windmouse_path(start_x, start_y, dest_x, dest_y, n=None, rng=None):
+    # WindMouse as a registry model; its step count follows from the simulation, so n is ignored
+    return end_at_dest(*wind_mouse_path(start_x, start_y, dest_x, dest_y, rng=rng), dest_x, dest_y)
+
+MOTION_MODELS = {
+    'windmouse': windmouse_path,
+    'min_jerk': min_jerk_path,
+    'bezier': bezier_path,
+}
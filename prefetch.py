@@ -0,0 +1,94 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Lookahead planning for playback: while the current action sleeps through its delay,
+# a worker thread draws the randomized parameters and motion paths of the next ones.
+
+class Prefetcher:
+    '''
+    plan(index, start, step) must return (plan, end_pos): everything random about
+    action index, executed as the step-th action of the run, given the cursor
+    position it starts from, and where the cursor will be
+    once it is done (None if that cannot be known in advance, e.g. mouse_to_color,
+    which ends the lookahead chain). A prefetched plan is only handed out when the
+    cursor really is at the start it was planned from and the action runs as the
+    step it was planned for (seeded playback derives its random streams from the
+    step); otherwise it is dropped and counted as invalidated so the caller plans inline.
+    '''
+    def __init__(self, depth=2):
+        self.depth = depth
+        self.plan_func = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.pending = {}  # action index -> Future of (assumed start, step, plan, end_pos)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def _drop_pending(self):
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.generation += 1
+
+    def reset(self, plan_func=None):
+        # Drop everything planned so far; plan_func replaces the planner if given
+        self._drop_pending()
+        if plan_func is not None:
+            self.plan_func = plan_func
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def _plan_after(self, generation, index, step, previous, start):
+        if generation != self.generation:
+            return None, None, None, None
+        if previous is not None:
+            start = previous.result()[3]
+            if start is None:
+                return None, None, None, None
+        plan, end_pos = self.plan_func(index, start, step)
+        return start, step, plan, end_pos
+
+    def schedule(self, index, end_pos, count, step=0):
+        # Plan actions index+1 .. index+depth (steps step+1 ..) in the background, chaining each from the previous end position
+        if end_pos is None or self.depth <= 0 or self.plan_func is None:
+            return
+        with self.lock:
+            previous = None
+            for k in range(index + 1, min(index + 1 + self.depth, count)):
+                future = self.pending.get(k)
+                if future is None:
+                    future = self.executor.submit(self._plan_after, self.generation, k, step + k - index, previous, end_pos)
+                    self.pending[k] = future
+                previous = future
+
+    def take(self, index, start, step=0, wait=True):
+        # The prefetched plan for index if it was planned from start as this step, else None.
+        # wait=False does not block on a plan still being computed but returns None (a miss);
+        # the plans chained after it stay valid, as planning the same step again ends at the same position.
+        with self.lock:
+            future = self.pending.pop(index, None)
+        if future is None or not (wait or future.done()):
+            self.misses += 1
+            return None
+        try:
+            assumed_start, planned_step, plan, _ = future.result()
+        except Exception:
+            assumed_start, planned_step, plan = None, None, None
+        if plan is None or assumed_start != start or planned_step != step:
+            # Later plans were chained from this one's end position, so they are stale too
+            self.invalidated += 1
+            self._drop_pending()
+            return None
+        self.hits += 1
+        return plan
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'invalidated': self.invalidated}
+
+    def close(self):
+        self.reset()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,235 @@
+import copy
+from collections import namedtuple
+
+import numpy as np
+
+from color_scan import hex_to_rgb, pack_colors, points_bbox
+
+# Macros are compiled once when playback starts: the if/else/end and loop structure is
+# checked, every control-flow action gets the index of its partner, so taking a branch
+# or repeating a loop at run time is a list lookup instead of a scan, and every action
+# is decoded from its JSON dict into a typed object with its defaults applied and its
+# colors, points and trajectory parsed, so the playback loop only reads attributes.
+
+class Action:
+    '''
+    A decoded action. source is the dict it was decoded from (the form the editor and
+    macro files use); to_dict() returns a copy of it, so decode_action(a.to_dict())
+    gives the same action back and fields this version does not know are kept.
+    '''
+    __slots__ = ('type', 'min_delay', 'max_delay', 'comment', 'source')
+
+    def __init__(self, d):
+        self.type = d['type']
+        self.min_delay = d.get('min_delay', 0.0)
+        self.max_delay = d.get('max_delay', 0.0)
+        self.comment = d.get('comment', '')
+        self.source = d
+
+    def to_dict(self):
+        return copy.deepcopy(self.source)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.source!r})"
+
+def parse_colors(hex_colors):
+    # (list of RGB tuples, (N, 3) int32 array) of hex color strings
+    rgb = [hex_to_rgb(c) for c in hex_colors]
+    return rgb, np.array(rgb, dtype=np.int32).reshape(-1, 3)
+
+class PointsAction(Action):
+    # Base of the color checks: one pixel at (x, y) or the cursor, or many points answered from one capture
+    __slots__ = ('x', 'y', 'check_at_mouse', 'points', 'points_bbox', 'point_mode', 'min_matches', 'rgb', 'colors')
+
+    def __init__(self, d, hex_colors):
+        super().__init__(d)
+        self.x = d.get('x', 0)
+        self.y = d.get('y', 0)
+        self.check_at_mouse = d.get('check_at_mouse', False)
+        points = d.get('points')
+        self.points = np.array(points, dtype=np.int64).reshape(-1, 2) if points else None
+        self.points_bbox = points_bbox(self.points) if points else None
+        self.point_mode = d.get('point_mode', 'all')
+        self.min_matches = d.get('min_matches', 1)
+        self.rgb, self.colors = parse_colors(hex_colors)
+
+class KeyAction(Action):
+    __slots__ = ('key',)
+
+    def __init__(self, d):
+        super().__init__(d)
+        self.key = d['key']
+
+class MouseMove(Action):
+    __slots__ = ('min_x', 'max_x', 'min_y', 'max_y', 'motion_model')
+
+    def __init__(self, d):
+        super().__init__(d)
+        self.min_x = d['min_x']
+        self.max_x = d['max_x']
+        self.min_y = d['min_y']
+        self.max_y = d['max_y']
+        self.motion_model = d.get('motion_model', 'windmouse')
+
+class ColorCheck(PointsAction):
+    __slots__ = ('tolerance', 'tolerance2', 'on_fail', 'on_success_press', 'hold_min', 'hold_max')
+
+    def __init__(self, d):
+        super().__init__(d, d.get('expected_colors', [d.get('expected_color', '#000000')]))
+        self.tolerance = d.get('tolerance', 0)
+        self.tolerance2 = self.tolerance * self.tolerance
+        self.on_fail = d.get('on_fail', 'abort')
+        self.on_success_press = d.get('on_success_press')
+        self.hold_min = d.get('hold_min_ms', 1) / 1000.0
+        self.hold_max = d.get('hold_max_ms', 10) / 1000.0
+
+    def matches_rgb(self, color):
+        # True if the RGB tuple is within tolerance of any expected color
+        r, g, b = color[:3]
+        tol2 = self.tolerance2
+        return any((r - er) ** 2 + (g - eg) ** 2 + (b - eb) ** 2 <= tol2 for er, eg, eb in self.rgb)
+
+class IfColorStart(PointsAction):
+    __slots__ = ('expected',)
+
+    def __init__(self, d):
+        super().__init__(d, [d.get('expected_color', '#000000')])
+        self.expected = self.rgb[0]
+
+class MouseToColor(Action):
+    __slots__ = ('bbox', 'expected_colors', 'tolerance', 'selection_mode', 'best_across_colors', 'stationary_only',
+                 'pyramid_min_size', 'roi_tracking', 'border_margin_percent', 'border_margin_mode',
+                 'min_move_delay', 'max_move_delay', 'on_fail', 'motion_model')
+
+    def __init__(self, d):
+        super().__init__(d)
+        self.bbox = (d.get('min_x', 0), d.get('min_y', 0), d.get('max_x', 1920), d.get('max_y', 1080))
+        self.expected_colors = pack_colors(d.get('expected_colors', ['#ffffff']))
+        if not len(self.expected_colors):
+            raise ValueError("expected_colors is empty")
+        self.tolerance = d.get('tolerance', 0)
+        self.selection_mode = d.get('selection_mode', 'random')
+        self.best_across_colors = d.get('best_across_colors', False)
+        self.stationary_only = d.get('stationary_only', False)
+        self.pyramid_min_size = d.get('pyramid_min_size', 0)
+        self.roi_tracking = d.get('roi_tracking', False)
+        self.border_margin_percent = d.get('border_margin_percent', 20)
+        self.border_margin_mode = d.get('border_margin_mode', 'box')
+        self.min_move_delay = d.get('min_move_delay', 0.2)
+        self.max_move_delay = d.get('max_move_delay', 0.5)
+        self.on_fail = d.get('on_fail', 'continue')
+        self.motion_model = d.get('motion_model', 'windmouse')
+
+class Trajectory(Action):
+    __slots__ = ('times', 'xs', 'ys')
+
+    def __init__(self, d):
+        super().__init__(d)
+        points = np.array(d.get('trajectory', []), dtype=np.float64).reshape(-1, 3)
+        self.times = points[:, 0]
+        self.xs = points[:, 1].astype(np.int32)
+        self.ys = points[:, 2].astype(np.int32)
+
+class LoopStart(Action):
+    __slots__ = ('name', 'min_loops', 'max_loops')
+
+    def __init__(self, d):
+        super().__init__(d)
+        self.name = d.get('name', '')
+        self.min_loops = d.get('min_loops', 1)
+        self.max_loops = d.get('max_loops', 1)
+
+class LoopEnd(Action):
+    __slots__ = ('name',)
+
+    def __init__(self, d):
+        super().__init__(d)
+        self.name = d.get('name', '')
+
+class Wait(Action):
+    __slots__ = ('on_end',)
+
+    def __init__(self, d):
+        super().__init__(d)
+        self.on_end = d.get('on_end', 'continue')
+
+# Action class per type; else and if_end carry nothing beyond the base fields
+ACTION_TYPES = {
+    'key_action': KeyAction,
+    'mouse_move': MouseMove,
+    'color_check': ColorCheck,
+    'if_color_start': IfColorStart,
+    'mouse_to_color': MouseToColor,
+    'trajectory': Trajectory,
+    'loop_start': LoopStart,
+    'loop_end': LoopEnd,
+    'wait': Wait,
+}
+
+def decode_action(d):
+    return ACTION_TYPES.get(d['type'], Action)(d)
+
+# One entry per action, at the action's index. target is the partner's index:
+#   if_color_start -> its else, or its if_end when there is no else
+#   else           -> its if_end
+#   loop_start     -> its loop_end
+#   loop_end       -> its loop_start
+# and None for every other op.
+Instruction = namedtuple('Instruction', ['op', 'action', 'target'])
+
+def compile_macro(actions):
+    '''
+    Check the nesting of actions and return the instruction list of decoded actions
+    (see decode_action). Raises ValueError
+    naming the offending action (1-based, as counted in the action list) for an else or
+    if_end without an open if_color_start, a second else, a loop_end that does not close
+    the innermost open loop_start of the same name, blocks that cross each other, and
+    blocks left open at the end, and for actions with missing or malformed fields.
+    '''
+    targets = [None] * len(actions)
+    open_blocks = []  # [op, index, name, else index] of the blocks not yet closed, innermost last
+    for i, action in enumerate(actions):
+        op = action['type']
+        if op == 'if_color_start':
+            open_blocks.append([op, i, None, None])
+        elif op in ('else', 'if_end'):
+            if not open_blocks or open_blocks[-1][0] != 'if_color_start':
+                inside = f" (inside loop '{open_blocks[-1][2]}' from action {open_blocks[-1][1] + 1})" if open_blocks else ""
+                raise ValueError(f"Action {i + 1}: {op} without a matching if_color_start{inside}.")
+            block = open_blocks[-1]
+            if op == 'else':
+                if block[3] is not None:
+                    raise ValueError(f"Action {i + 1}: second else for the if_color_start at action {block[1] + 1}.")
+                block[3] = i
+                targets[block[1]] = i
+            else:
+                open_blocks.pop()
+                if block[3] is None:
+                    targets[block[1]] = i
+                else:
+                    targets[block[3]] = i
+        elif op == 'loop_start':
+            open_blocks.append([op, i, action.get('name', ''), None])
+        elif op == 'loop_end':
+            name = action.get('name', '')
+            if not open_blocks:
+                raise ValueError(f"Action {i + 1}: loop_end '{name}' without a matching loop_start.")
+            block = open_blocks[-1]
+            if block[0] != 'loop_start':
+                raise ValueError(f"Action {i + 1}: loop_end '{name}' inside the if_color_start at action {block[1] + 1}, which is not closed yet.")
+            if block[2] != name:
+                raise ValueError(f"Action {i + 1}: loop_end '{name}' does not match the open loop_start '{block[2]}' at action {block[1] + 1}.")
+            open_blocks.pop()
+            targets[block[1]] = i
+            targets[i] = block[1]
+    if open_blocks:
+        op, index, name, _ = open_blocks[-1]
+        closer = 'if_end' if op == 'if_color_start' else f"loop_end '{name}'"
+        raise ValueError(f"Action {index + 1}: {op} has no {closer}.")
+    program = []
+    for i, (action, target) in enumerate(zip(actions, targets)):
+        try:
+            program.append(Instruction(action['type'], decode_action(action), target))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Action {i + 1}: {action['type']} has a missing or malformed field ({e!r}).")
+    return program
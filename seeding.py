@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import random
+import secrets
+
+import numpy as np
+
+# Reproducible randomness for playback. One seed per playback fans out into independent
+# streams, so changing how often one consumer draws never shifts the others:
+#   delays    - action delays, pauses, move durations, key holds
+#   positions - mouse_move destinations and click points inside color masses
+#   motion    - miss/overshoot decisions in human_move
+#   paths     - WindMouse path generation and pool picks (numpy Generator)
+#   selection - which color mass is picked, loop counts
+# Streams are derived per executed action (its ordinal in the run) and phase ('plan' for
+# what the prefetch worker may compute ahead, 'run' for what happens while executing), so
+# the draws are the same whichever thread ends up planning an action.
+
+STREAMS = ('delays', 'positions', 'motion', 'selection')
+PHASES = {'plan': 0, 'run': 1}
+
+def new_seed():
+    return secrets.randbits(32)
+
+class RandomStreams:
+    # The streams of one (seed, key); built on first use, so actions that draw nothing stay cheap
+    def __init__(self, seed, key=()):
+        self.seed = seed
+        self.key = key
+
+    def __getattr__(self, name):
+        if name not in STREAMS and name != 'paths':
+            raise AttributeError(name)
+        children = np.random.SeedSequence(self.seed, spawn_key=self.key).spawn(len(STREAMS) + 1)
+        for stream, child in zip(STREAMS, children):
+            setattr(self, stream, random.Random(int.from_bytes(child.generate_state(4).tobytes(), 'little')))
+        self.paths = np.random.default_rng(children[-1])
+        return getattr(self, name)
+
+class GlobalStreams:
+    # Unseeded stand-in with the same attributes, backed by the random module
+    delays = positions = motion = selection = random
+    paths = None  # path generators fall back to their own Generator
+
+global_streams = GlobalStreams()
+
+class PlaybackRandom:
+    '''
+    The random streams of one playback. step(ordinal, phase) returns the streams of the
+    ordinal-th executed action; the same (seed, ordinal, phase) always gives the same draws.
+    '''
+    def __init__(self, seed=None):
+        self.seed = new_seed() if seed is None else int(seed)
+
+    def step(self, ordinal, phase='run'):
+        return RandomStreams(self.seed, (PHASES[phase], ordinal))
+
+
+def append_run_log(entry, path=None):
+    '''
+    Append one JSON line to the playback run log (MACRO_RUN_LOG, default
+    playback_runs.jsonl in the working directory); an empty MACRO_RUN_LOG disables it.
+    '''
+    path = path if path is not None else os.environ.get('MACRO_RUN_LOG', 'playback_runs.jsonl')
+    if not path:
+        return
+    entry = dict(entry, time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    try:
+        with open(path, 'a') as f:
+            f.write(json.dumps(entry, default=float) + '\n')
+    except OSError:
+        pass
@@ -0,0 +1,176 @@
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from collections import namedtuple
+
+from capture import create_capture_backend
+from engine import AsyncPlaybackEngine, PlaybackEngine, add_playback_arguments, config_from_args, load_macro_file
+from inputs import create_input_backend
+from motion import create_path_pool
+from program import compile_macro
+
+# Several playback engines in one process, e.g. one per virtual display, instead of one
+# process each. What engines only read is loaded once: compiled macros, the WindMouse
+# path pool and (through color_scan's module-level cache) the color LUTs.
+
+# One engine as seen by status(): whether it is playing, the seed and number of actions
+# executed of its current or last playback, and the PlaybackResult of the last one that ended
+EngineStatus = namedtuple('EngineStatus', ['name', 'active', 'seed', 'steps', 'result'])
+
+class Supervisor:
+    '''
+    Starts, stops and monitors named PlaybackEngines. on_status(name, text) and
+    on_end(name, result) receive the engines' callbacks, tagged with the engine name,
+    on the engines' playback threads.
+    '''
+    engine_class = PlaybackEngine
+
+    def __init__(self, path_pool=None, on_status=None, on_end=None):
+        self.owns_path_pool = path_pool is None
+        self.path_pool = path_pool or create_path_pool()
+        self.path_pool.start()
+        self.on_status = on_status
+        self.on_end = on_end
+        self.engines = {}  # name -> PlaybackEngine
+        self.programs = {}  # id(actions) -> (actions, compiled program); actions is kept so its id stays unique
+        self.lock = threading.Lock()
+
+    def add(self, name, display=None, input_backend=None, capture_backend=None, **engine_args):
+        '''
+        Create an engine bound to display (None = $DISPLAY) through the named input and
+        capture backends (see create_input_backend/create_capture_backend). Raises
+        ValueError for a duplicate name or backends that cannot be used, OSError if the
+        display cannot be opened.
+        '''
+        if name in self.engines:
+            raise ValueError(f"An engine named '{name}' already exists.")
+        mouse_controller, kb_controller = create_input_backend(input_backend, display)
+        capture = create_capture_backend(capture_backend, display)
+        engine = self.engine_class(mouse_controller, kb_controller, capture, path_pool=self.path_pool,
+                                on_status=lambda text: self._status(name, text), on_end=lambda result: self._end(name, result), **engine_args)
+        with self.lock:
+            self.engines[name] = engine
+        return engine
+
+    def _status(self, name, text):
+        if self.on_status:
+            self.on_status(name, text)
+
+    def _end(self, name, result):
+        if self.on_end:
+            self.on_end(name, result)
+
+    def compile(self, actions):
+        # The compiled program of actions, compiled once however many engines play it; actions must not change afterwards
+        with self.lock:
+            entry = self.programs.get(id(actions))
+            if entry is None:
+                entry = (actions, compile_macro(actions))
+                self.programs[id(actions)] = entry
+        return entry[1]
+
+    def start(self, name, actions, config):
+        # Start actions on the named engine; returns the seed. Raises ValueError/RuntimeError like PlaybackEngine.start
+        return self.engines[name].start(actions, config, self.compile(actions))
+
+    def start_all(self, actions, config):
+        # Start actions on every idle engine; with config.seed None each draws its own seed. Returns {name: seed}
+        program = self.compile(actions)
+        return {name: engine.start(actions, config, program) for name, engine in self.engines.items() if not engine.active}
+
+    def stop(self, name, timeout=1.0):
+        return self.engines[name].stop(timeout)
+
+    def stop_all(self, timeout=1.0):
+        # Stop every engine at once, then wait for their threads together
+        for engine in self.engines.values():
+            engine.stop(timeout=0)
+        self.wait(timeout)
+
+    def wait(self, timeout=None):
+        # Block until no engine is playing; False on timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for engine in list(self.engines.values()):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not engine.wait(remaining):
+                return False
+        return True
+
+    def status(self):
+        return [EngineStatus(name, engine.active, engine.seed, engine.steps, engine.result) for name, engine in self.engines.items()]
+
+    def remove(self, name):
+        with self.lock:
+            engine = self.engines.pop(name)
+        engine.close()
+
+    def close(self):
+        for name in list(self.engines):
+            self.remove(name)
+        if self.owns_path_pool:
+            self.path_pool.close()
+        self.programs.clear()
+
+class AsyncSupervisor(Supervisor):
+    '''
+    A Supervisor of AsyncPlaybackEngines, all multiplexed on the running event loop
+    instead of a thread each. start and stop are called on the loop; wait() and
+    stop_all() are coroutines, and the callbacks are called on the loop.
+    '''
+    engine_class = AsyncPlaybackEngine
+
+    async def stop_all(self, timeout=1.0):
+        for engine in self.engines.values():
+            engine.stop()
+        return await self.wait(timeout)
+
+    async def wait(self, timeout=None):
+        # Until no engine is playing; False on timeout
+        tasks = [engine.task for engine in self.engines.values() if engine.task is not None and not engine.task.done()]
+        if not tasks:
+            return True
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        return not pending
+
+
+async def watch(supervisor, actions, config, interval):
+    # start_all on an AsyncSupervisor and print status lines until every engine has ended
+    supervisor.start_all(actions, config)
+    while not await supervisor.wait(interval):
+        print(' '.join(f"{s.name}: {s.steps} steps" for s in supervisor.status() if s.active))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m supervisor', description="Play a macro on several X displays from one process. Ctrl+C stops all.")
+    add_playback_arguments(parser)
+    parser.add_argument('--displays', nargs='+', required=True, help="X displays to play on, one engine each, e.g. :1 :2 :3")
+    parser.add_argument('--interval', type=float, default=10.0, help="Seconds between status lines (default 10)")
+    parser.add_argument('--asyncio', action='store_true', help="Play all displays on one asyncio event loop instead of a thread each")
+    args = parser.parse_args(argv)
+    actions = load_macro_file(parser, args.macro)
+    config = config_from_args(args)
+    supervisor_class = AsyncSupervisor if args.asyncio else Supervisor
+    supervisor = supervisor_class(on_status=lambda name, text: print(f"[{name}] {text}"),
+                            on_end=lambda name, result: print(f"[{name}] {result.reason}: {result.message or result.status}"))
+    try:
+        for display in args.displays:
+            supervisor.add(display, display, args.input_backend, args.capture_backend)
+        if args.asyncio:
+            asyncio.run(watch(supervisor, actions, config, args.interval))
+        else:
+            supervisor.start_all(actions, config)
+            while not supervisor.wait(args.interval):
+                print(' '.join(f"{s.name}: {s.steps} steps" for s in supervisor.status() if s.active))
+    except (OSError, ValueError) as e:
+        supervisor.close()
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        if not args.asyncio:  # asyncio.run has already cancelled the engines' tasks, which report 'stopped'
+            supervisor.stop_all()
+    results = [s.result for s in supervisor.status()]
+    supervisor.close()
+    return 0 if all(r is not None and r.reason == 'finished' for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
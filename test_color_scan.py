@@ -0,0 +1,138 @@
+import random
+
+import numpy as np
+from scipy import ndimage
+
+from color_scan import RegionTracker, color_index_map, find_color_target, pack_colors, stationary_labels, tracked_color_target
+
+REGION = (100, 200, 500, 600)  # screen area of the frames below
+COLORS = ['#ff0000']
+
+def frame(*squares):
+    # 400x400 black frame with red 6x6 squares at the given screen positions
+    arr = np.zeros((400, 400, 3), dtype=np.uint8)
+    for x, y in squares:
+        arr[y - REGION[1]:y - REGION[1] + 6, x - REGION[0]:x - REGION[0] + 6] = (255, 0, 0)
+    return arr
+
+def tracker_near(x, y):
+    # A tracker whose last hit was the square at (x, y), so its windows surround it
+    tracker = RegionTracker()
+    xs, ys = np.meshgrid(np.arange(x, x + 6), np.arange(y, y + 6))
+    tracker.record(xs.ravel(), ys.ravel(), REGION)
+    return tracker
+
+def full_region_pick(arr, mode, cursor, seed=0):
+    target = find_color_target(arr, COLORS, None, mode, (cursor[0] - REGION[0], cursor[1] - REGION[1]), rng=random.Random(seed))
+    return target[0] + REGION[0], target[1] + REGION[1]
+
+def assert_same_target(a, b):
+    assert np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1])
+
+def test_nearer_match_outside_window():
+    arr = frame((150, 250), (420, 520))
+    tracker = tracker_near(150, 250)
+    cursor = (430, 530)  # next to the square far outside the windows around the last hit
+    target = tracked_color_target(tracker, REGION, arr, COLORS, None, 'closest', cursor)
+    assert_same_target(target, full_region_pick(arr, 'closest', cursor))
+    assert target[0].min() == 420
+    assert (tracker.hits, tracker.misses) == (0, 2)
+
+def test_further_match_outside_window():
+    arr = frame((150, 250), (420, 520))
+    tracker = tracker_near(150, 250)
+    cursor = (152, 252)
+    target = tracked_color_target(tracker, REGION, arr, COLORS, None, 'furthest', cursor)
+    assert_same_target(target, full_region_pick(arr, 'furthest', cursor))
+    assert target[0].min() == 420
+
+def test_random_pick_matches_full_region():
+    arr = frame((150, 250), (160, 270), (420, 520))
+    for seed in range(20):
+        tracker = tracker_near(150, 250)
+        target = tracked_color_target(tracker, REGION, arr, COLORS, None, 'random', (0, 0), rng=random.Random(seed))
+        assert_same_target(target, full_region_pick(arr, 'random', (0, 0), seed))
+
+def test_window_used_when_every_match_is_inside():
+    arr = frame((150, 250), (170, 280))
+    tracker = tracker_near(150, 250)
+    for mode in ('closest', 'furthest', 'random'):
+        target = tracked_color_target(tracker, REGION, arr, COLORS, None, mode, (480, 580), rng=random.Random(1))
+        assert_same_target(target, full_region_pick(arr, mode, (480, 580), 1))
+    assert tracker.misses == 1 and tracker.hits == 3
+
+def test_packed_colors_match_hex():
+    arr = frame((150, 250), (420, 520))
+    packed = pack_colors(COLORS)
+    for mode in ('closest', 'furthest'):
+        assert_same_target(find_color_target(arr, packed, None, mode, (0, 0)), find_color_target(arr, COLORS, None, mode, (0, 0)))
+
+def test_second_frame_and_labeled_area():
+    arr1 = frame((150, 250), (170, 280))
+    arr2 = frame((150, 250), (172, 280))  # the second square moved
+    tracker = tracker_near(150, 250)
+    full = find_color_target(arr1, COLORS, arr2, 'closest', (0, 0))
+    target = tracked_color_target(tracker, REGION, arr1, COLORS, arr2, 'closest', (100, 200))
+    assert_same_target(target, (full[0] + REGION[0], full[1] + REGION[1]))
+    assert target[0].min() == 150 and tracker.hits == 1
+    full_area = (REGION[2] - REGION[0]) * (REGION[3] - REGION[1])
+    assert tracker.labeled_area - full_area < full_area / 4  # tracker_near's own scan was a full-region miss
+
+def test_empty_color_list_matches_nothing():
+    arr = frame((150, 250))
+    for tolerance in (0, 10):
+        assert not color_index_map(arr, pack_colors([]), tolerance).any()
+    assert find_color_target(arr, [], None, 'closest', (0, 0)) is None
+
+def baseline_stationary_labels(labeled1, num_features, mask2):
+    # The per-label loop stationary_labels replaced: whole-component overlap, same size, same center of mass
+    labeled2, _ = ndimage.label(mask2)
+    labels = []
+    for lbl in range(1, num_features + 1):
+        comp_mask1 = labeled1 == lbl
+        if np.sum(comp_mask1 & mask2) != np.sum(comp_mask1):
+            continue
+        overlapping = np.unique(labeled2[comp_mask1])
+        overlapping = overlapping[overlapping > 0]
+        l2 = overlapping[np.argmax([np.sum(comp_mask1 & (labeled2 == l)) for l in overlapping])]
+        if np.sum(comp_mask1) == np.sum(labeled2 == l2) and ndimage.center_of_mass(comp_mask1) == ndimage.center_of_mass(labeled2 == l2):
+            labels.append(lbl)
+    return labels
+
+def test_stationary_labels_match_baseline():
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        mask1 = rng.random((60, 60)) < 0.3
+        mask2 = mask1.copy()
+        flips = rng.random(mask1.shape) < 0.02
+        mask2[flips] = ~mask2[flips]  # grows, shrinks, splits and merges some components
+        labeled1, num_features = ndimage.label(mask1)
+        assert list(stationary_labels(labeled1, num_features, mask2)) == baseline_stationary_labels(labeled1, num_features, mask2)
+
+def test_tolerance_lut_matches_distance():
+    rng = np.random.default_rng(6)
+    colors = np.array([[75, 0, 87], [80, 5, 90], [250, 250, 3]])
+    packed = pack_colors(['#%02x%02x%02x' % tuple(c) for c in colors])
+    # Pixels scattered around the colors, many right at the tolerance boundary
+    pixels = np.clip(colors[rng.integers(0, len(colors), 4000)] + rng.integers(-14, 15, (4000, 3)), 0, 255)
+    arr = pixels.reshape(40, 100, 3).astype(np.uint8)
+    for tolerance in (1, 7.5, 10):
+        dist2 = ((pixels[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2)
+        within = dist2 <= tolerance * tolerance
+        expected = np.where(within.any(axis=1), within.argmax(axis=1) + 1, 0)  # first color within tolerance wins
+        assert np.array_equal(color_index_map(arr, packed, tolerance).ravel(), expected)
+
+def test_pyramid_matches_full_scan():
+    rng = np.random.default_rng(7)
+    for min_size in (4, 6):
+        for _ in range(5):
+            arr = np.zeros((300, 400, 3), dtype=np.uint8)
+            for _ in range(12):
+                w, h = rng.integers(min_size, min_size + 8, 2)
+                x, y = rng.integers(0, 400 - w), rng.integers(0, 300 - h)
+                arr[y:y + h, x:x + w] = (255, 0, 0)  # blobs may touch and merge into larger shapes
+            for mode in ('closest', 'furthest'):
+                cursor = tuple(int(v) for v in rng.integers(0, 300, 2))
+                full = find_color_target(arr, COLORS, None, mode, cursor)
+                pyramid = find_color_target(arr, COLORS, None, mode, cursor, pyramid_min_size=min_size)
+                assert_same_target(pyramid, full)
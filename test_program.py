@@ -0,0 +1,48 @@
+import pytest
+
+from program import compile_macro
+
+def action(op, **fields):
+    return dict(fields, type=op)
+
+def test_nested_block_targets():
+    red = action('if_color_start', x=1, y=1, expected_color='#ff0000')
+    green = action('if_color_start', x=1, y=1, expected_color='#00ff00')
+    macro = [
+        action('loop_start', name='outer'), red, action('loop_start', name='inner'), action('key_action', key='a'),
+        action('loop_end', name='inner'), action('else'), action('wait'), action('if_end'),
+        green, action('if_end'), action('loop_end', name='outer'),
+    ]
+    program = compile_macro(macro)
+    assert [instruction.op for instruction in program] == [a['type'] for a in macro]
+    assert [instruction.target for instruction in program] == [10, 5, 4, None, 2, 7, None, None, 9, None, 0]
+    assert program[3].action.key == 'a'
+
+def test_unmatched_loop_end():
+    macro = [action('key_action', key='a'), action('loop_end', name='main')]
+    with pytest.raises(ValueError, match=r"^Action 2: loop_end 'main' without a matching loop_start"):
+        compile_macro(macro)
+
+def test_loop_end_name_mismatch():
+    macro = [action('loop_start', name='a'), action('loop_end', name='b')]
+    with pytest.raises(ValueError, match=r"^Action 2: .*does not match the open loop_start 'a' at action 1"):
+        compile_macro(macro)
+
+def test_missing_loop_end():
+    macro = [action('key_action', key='a'), action('loop_start', name='main'), action('key_action', key='b')]
+    with pytest.raises(ValueError, match=r"^Action 2: loop_start"):
+        compile_macro(macro)
+
+def test_crossed_blocks():
+    macro = [action('loop_start', name='main'), action('if_color_start', x=1, y=1, expected_color='#ff0000'), action('loop_end', name='main')]
+    with pytest.raises(ValueError, match=r"^Action 3: .*inside the if_color_start at action 2"):
+        compile_macro(macro)
+
+def test_bad_numeric_field():
+    macro = [action('key_action', key='a'), action('color_check', x=1, y=1, expected_colors=['#ff0000'], hold_min_ms='ten')]
+    with pytest.raises(ValueError, match=r"^Action 2: color_check has a missing or malformed field"):
+        compile_macro(macro)
+
+def test_missing_field():
+    with pytest.raises(ValueError, match=r"^Action 1: key_action has a missing or malformed field"):
+        compile_macro([action('key_action')])
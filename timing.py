@@ -0,0 +1,84 @@
+import time
+import ctypes
+import platform
+import threading
+from collections import deque
+
+import numpy as np
+
+# Cancellable high-resolution sleeping for playback. All deadlines use perf_counter.
+
+class Sleeper:
+    '''
+    Sleeps until a perf_counter deadline. The coarse part blocks on an Event, so a
+    long wait costs one wakeup and stop_playback can cut it short by setting the
+    event; only the last spin_s seconds are spun, to hit the deadline without the
+    OS timer's overshoot. calibrate() sizes the spin tail from measured wakeup
+    latency. Overshoot past each deadline is kept for mean/p99 reporting.
+    '''
+    def __init__(self, event=None, spin_s=0.001, max_spin_s=0.002, history=10000):
+        self.event = event if event is not None else threading.Event()
+        self.spin_s = spin_s
+        self.max_spin_s = max_spin_s
+        self.overshoots = deque(maxlen=history)
+        self.total_overshoot = 0.0
+        self.count = 0
+        self.timer_period_set = False
+
+    def calibrate(self, samples=50, wait_s=0.002):
+        # Spin for the event wait's 99th percentile overshoot plus a small margin
+        if platform.system() == 'Windows' and not self.timer_period_set:
+            # 1 ms system timer resolution instead of the default 15.6 ms
+            self.timer_period_set = ctypes.windll.winmm.timeBeginPeriod(1) == 0
+        probe = threading.Event()
+        late = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            probe.wait(wait_s)
+            late.append(time.perf_counter() - started - wait_s)
+        self.spin_s = min(max(float(np.percentile(late, 99)) + 0.00005, 0.0001), self.max_spin_s)
+        return self.spin_s
+
+    def sleep(self, duration):
+        # Returns False if woken early by the event, True once the full duration has passed
+        if duration <= 0:
+            return not self.event.is_set()
+        return self.sleep_until(time.perf_counter() + duration)
+
+    def sleep_until(self, deadline):
+        coarse = deadline - time.perf_counter() - self.spin_s
+        if coarse > 0 and self.event.wait(coarse):
+            return False
+        while time.perf_counter() < deadline:
+            if self.event.is_set():
+                return False
+        self.record(time.perf_counter() - deadline)
+        return True
+
+    def record(self, overshoot):
+        # Also used for sleeps taken elsewhere (e.g. awaited ones) to report them in the same stats
+        self.overshoots.append(overshoot)
+        self.total_overshoot += overshoot
+        self.count += 1
+
+    def cancel(self):
+        self.event.set()
+
+    def stats(self):
+        p99 = float(np.percentile(self.overshoots, 99)) if self.overshoots else 0.0
+        return {
+            'sleeps': self.count,
+            'spin_us': self.spin_s * 1e6,
+            'mean_overshoot_us': self.total_overshoot / self.count * 1e6 if self.count else 0.0,
+            'p99_overshoot_us': p99 * 1e6,
+        }
+
+    def reset_stats(self):
+        self.overshoots.clear()
+        self.total_overshoot = 0.0
+        self.count = 0
+
+    def close(self):
+        if self.timer_period_set:
+            ctypes.windll.winmm.timeEndPeriod(1)
+            self.timer_period_set = False